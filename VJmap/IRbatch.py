@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import cv2
+import numpy as np
+from multiprocessing import Pool
+import IRtext1 as ir
+
+# 版本说明：IRtext1.py 一次只处理写死的一张 123.png，夜间批量入库的扫描件要一张张手动改路径运行。
+# 这里把图片路径流式送入进程池，每个进程依次完成 解码 → 二值化 → 直线检测 → 合并 → 写结果，
+# 进程内的二值图缓冲区按图幅尺寸复用（同一批扫描件尺寸基本相同），不为每张图重新分配。
+# 每张图写一个紧凑的结果文件（线段为 [x1, y1, x2, y2] 数组），最后报告每秒处理的图片数，用于确定进程数。
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')
+
+# 每次分给一个进程的图片数
+CHUNK_SIZE = 4
+
+_worker = {}
+
+
+def list_images(image_dir):
+    """文件夹内全部扫描图片（按文件名排序）"""
+    return [os.path.join(image_dir, name) for name in sorted(os.listdir(image_dir))
+            if name.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def result_path(output_dir, image_path):
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(image_path))[0] + '.lines.json')
+
+
+def _init_worker(output_dir, engine, merge):
+    _worker.update(output_dir=output_dir, engine=engine, merge=merge, binary=None)
+
+
+def decode_image(image_path):
+    """读入灰度图；用 np.fromfile + imdecode，中文路径在 Windows 上也能读"""
+    data = np.fromfile(image_path, dtype=np.uint8)
+    return cv2.imdecode(data, cv2.IMREAD_GRAYSCALE) if data.size else None
+
+
+def binarize(img):
+    """二值化到进程内复用的缓冲区，尺寸变化时才重新分配"""
+    buffer = _worker.get("binary")
+    if buffer is None or buffer.shape != img.shape:
+        buffer = _worker["binary"] = np.empty_like(img)
+    cv2.threshold(img, 128, 255, cv2.THRESH_BINARY_INV, dst=buffer)
+    return buffer
+
+
+def process_image(image_path):
+    """处理一张图并写出结果文件，返回 (路径, 线段数, 耗时, 错误信息)"""
+    start = time.perf_counter()
+    try:
+        img = decode_image(image_path)
+        if img is None:
+            return image_path, 0, time.perf_counter() - start, "cannot decode image"
+        lines = ir.detect_line_segments(binarize(img), _worker["engine"])
+        if _worker["merge"]:
+            lines = ir.merge_collinear_segments(lines)
+        segments = np.zeros((0, 4), dtype=np.int32) if lines is None else lines.reshape(-1, 4)
+        result = {
+            "image": os.path.basename(image_path),
+            "width": int(img.shape[1]),
+            "height": int(img.shape[0]),
+            "engine": _worker["engine"],
+            "segments": segments.tolist(),
+        }
+        with open(result_path(_worker["output_dir"], image_path), 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, separators=(',', ':'))
+        return image_path, len(segments), time.perf_counter() - start, None
+    except Exception as e:
+        return image_path, 0, time.perf_counter() - start, str(e)
+
+
+def run_batch(image_dir, output_dir, processes=None, engine="hough", merge=True, chunksize=CHUNK_SIZE):
+    """批量处理文件夹中的扫描图片，每张图写一个结果文件，返回汇总信息（含 images_per_second）"""
+    image_paths = list_images(image_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    done, failed, total_segments = 0, [], 0
+    with Pool(processes, initializer=_init_worker, initargs=(output_dir, engine, merge)) as pool:
+        for image_path, n_segments, seconds, error in pool.imap_unordered(process_image, image_paths, chunksize):
+            if error is not None:
+                failed.append({"image": image_path, "error": error})
+                print(f"Failed {image_path}: {error}")
+                continue
+            done += 1
+            total_segments += n_segments
+    elapsed = time.perf_counter() - start
+    summary = {
+        "images": done,
+        "failed": failed,
+        "segments": total_segments,
+        "seconds": round(elapsed, 2),
+        "images_per_second": round(done / elapsed, 2) if elapsed > 0 else None,
+    }
+    print(f"Processed {done} images ({len(failed)} failed) in {elapsed:.1f} s, "
+          f"{summary['images_per_second']} images/s")
+    return summary
+
+
+if __name__ == "__main__":
+    # 示例用法：一个文件夹的扫描件批量提取直线，结果写到 lines 子文件夹
+    image_dir = r"C:\Users\Lenovo\Desktop\水闸纵剖面图\扫描件"
+    output_dir = r"C:\Users\Lenovo\Desktop\水闸纵剖面图\扫描件\lines"
+    run_batch(image_dir, output_dir, engine="morph")
@@ -1,7 +1,44 @@
 import cv2
 import numpy as np
 import json
-import matplotlib.pyplot as plt
+import time
+from multiprocessing import Pool
+import spatial_index as si
+
+# 分块处理：A0 图纸 300dpi 扫描件整幅做 Canny、HoughLinesP 内存占用大且只能用一个核，
+# 分块模式把图像切成带重叠的小块，每块在进程池中单独做二值化、边缘检测和直线检测，
+# 再把线段平移回整图坐标。重叠区内的线段两边的块都会检测到，每块只保留线段落在本块“核心区”
+# （块之间不重叠的部分）里的那一段，跨接缝的线在各块里是首尾相接的几段，不会重叠重复；
+# 需要整条线时打开 merge，由共线合并把这几段接起来。
+TILE_SIZE = 2048
+TILE_OVERLAP = 128
+
+# 共线合并：方向角容差（度）、法向偏移容差和沿线方向允许跨过的间隙（像素）
+MERGE_ANGLE_TOLERANCE = 1.0
+MERGE_OFFSET_TOLERANCE = 2.0
+MERGE_GAP = 10.0
+
+# 形态学提取：CAD 扫描件以水平、竖直线为主，用长条结构元素做开运算留下水平/竖直笔画，
+# 每个连通域拟合成一条中心线；剩下的图像（斜线）仍交给 Hough。结构元素长度与 Hough 的 minLineLength 一致
+ORTHO_MIN_LENGTH = 50
+# 法向跨度超过该值（像素）的连通域按略有倾斜的线拟合
+ORTHO_MAX_THICKNESS = 6
+LINE_ENGINES = ("hough", "morph")
+
+# 金字塔模式：先在缩小 PYRAMID_FACTOR 倍的图上找候选线，再只在候选线周围 PYRAMID_MARGIN 像素的区域内做全分辨率检测
+PYRAMID_FACTOR = 4
+PYRAMID_MARGIN = 16
+# 与全分辨率结果比较时允许的端点偏差（像素）
+PYRAMID_TOLERANCE = 3.0
+# 候选区域的并集超过整幅图的该比例时（线条密集的图纸），逐区域检测不再省时，直接做全分辨率检测
+PYRAMID_MAX_COVERAGE = 0.5
+
+# 文字掩膜：尺寸数字、说明文字的单个字符在连通域统计上的特征——
+# 包围盒不超过 TEXT_MAX_SIZE 像素、宽高比不超过 TEXT_MAX_ASPECT、墨迹占包围盒的比例在 TEXT_DENSITY 范围内
+TEXT_MAX_SIZE = 60
+TEXT_MIN_SIZE = 4
+TEXT_MAX_ASPECT = 5.0
+TEXT_DENSITY = (0.1, 0.9)
 
 
 def preprocess_image(image_path):
@@ -21,13 +58,419 @@ def detect_edges(binary_img):
     return edges
 
 
-def detect_lines(edges):
+def detect_lines(edges, max_line_gap=10):
     # 霍夫直线变换
-    lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=100, minLineLength=50, maxLineGap=10)
+    lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=100, minLineLength=50, maxLineGap=max_line_gap)
 
     return lines
 
 
+def component_centerlines(mask, axis, max_thickness=ORTHO_MAX_THICKNESS):
+    """mask 中每个连通域取一条中心线，axis=0 为水平线，axis=1 为竖直线，返回 (n, 4)。
+    细的连通域直接取包围盒的中线；略有倾斜、法向跨度较大的连通域对其轮廓点做直线拟合"""
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return np.zeros((0, 4), dtype=np.int32)
+    x, y, w, h = np.array([cv2.boundingRect(c) for c in contours], dtype=np.float64).T
+    if axis == 0:
+        segments = np.stack([x, y + (h - 1) / 2, x + w - 1, y + (h - 1) / 2], axis=1)
+        thickness = h
+    else:
+        segments = np.stack([x + (w - 1) / 2, y, x + (w - 1) / 2, y + h - 1], axis=1)
+        thickness = w
+    for k in np.flatnonzero(thickness > max_thickness):
+        vx, vy, px, py = cv2.fitLine(contours[k], cv2.DIST_L2, 0, 0.01, 0.01).ravel()
+        if axis == 0:
+            x0, x1 = x[k], x[k] + w[k] - 1
+            segments[k] = (x0, py + (x0 - px) * vy / vx, x1, py + (x1 - px) * vy / vx)
+        else:
+            y0, y1 = y[k], y[k] + h[k] - 1
+            segments[k] = (px + (y0 - py) * vx / vy, y0, px + (y1 - py) * vx / vy, y1)
+    return np.round(segments).astype(np.int32)
+
+
+def detect_orthogonal_lines(binary_img, min_length=ORTHO_MIN_LENGTH):
+    """形态学开运算提取水平、竖直线（中心线），斜线在去掉水平/竖直笔画后的图像上用 Hough 检测，返回 (n, 1, 4)"""
+    horizontal = cv2.morphologyEx(binary_img, cv2.MORPH_OPEN,
+                                  cv2.getStructuringElement(cv2.MORPH_RECT, (min_length, 1)))
+    vertical = cv2.morphologyEx(binary_img, cv2.MORPH_OPEN,
+                                cv2.getStructuringElement(cv2.MORPH_RECT, (1, min_length)))
+    parts = [component_centerlines(horizontal, 0), component_centerlines(vertical, 1)]
+    # 去掉已提取的笔画；笔画边缘残留的毛刺和文字、碎点一样，
+    # 包围盒对角线不足 min_length，其中不可能有够长的斜线，先去掉再做 Hough
+    rest = cv2.bitwise_and(binary_img, cv2.bitwise_not(cv2.bitwise_or(horizontal, vertical)))
+    contours, _ = cv2.findContours(rest, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    large = [c for c in contours if np.hypot(*cv2.boundingRect(c)[2:]) >= min_length]
+    keep = np.zeros_like(rest)
+    cv2.drawContours(keep, large, -1, 255, cv2.FILLED)
+    # 斜线穿过水平/竖直线处被挖断，角度越平缺口越长，剩下的像素很稀疏，放宽 maxLineGap 把缺口接上
+    oblique = detect_lines(detect_edges(cv2.bitwise_and(rest, keep)), max_line_gap=min_length)
+    if oblique is not None:
+        parts.append(oblique.reshape(-1, 4))
+    return np.concatenate(parts).reshape(-1, 1, 4)
+
+
+def detect_line_segments(binary_img, engine="hough"):
+    """按 engine 选择直线检测方法：hough 为 Canny + HoughLinesP，morph 为形态学提取水平/竖直线加 Hough 检测斜线"""
+    if engine == "hough":
+        return detect_lines(detect_edges(binary_img))
+    if engine == "morph":
+        return detect_orthogonal_lines(binary_img)
+    raise ValueError(f"Unknown line engine {engine!r}, expected one of {LINE_ENGINES}")
+
+
+def benchmark_engines(image_path, repeat=3):
+    """在同一幅图上比较两种直线检测方法的耗时（取多次运行的最短时间）和线段数"""
+    binary_img = preprocess_image(image_path)
+    results = {}
+    for engine in LINE_ENGINES:
+        best = np.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            lines = detect_line_segments(binary_img, engine)
+            best = min(best, time.perf_counter() - start)
+        merged = merge_collinear_segments(lines)
+        results[engine] = {
+            "seconds": round(best, 4),
+            "segments": 0 if lines is None else len(lines),
+            "merged_segments": 0 if merged is None else len(merged),
+        }
+        print(f"{engine}: {best * 1000:.1f} ms, {results[engine]['segments']} segments "
+              f"({results[engine]['merged_segments']} after merge)")
+    return results
+
+
+def candidate_regions(binary_img, factor=PYRAMID_FACTOR, margin=PYRAMID_MARGIN):
+    """在缩小的图上做粗检测，每条候选线取其两侧各扩 margin 像素的区域，返回全分辨率下的
+    [(x0, y0, x1, y1), 候选线 (x1, y1, x2, y2)] 列表"""
+    height, width = binary_img.shape[:2]
+    # INTER_AREA 缩小后只要有墨迹就算前景，细线不会在缩小时丢失
+    small = cv2.resize(binary_img, (max(width // factor, 1), max(height // factor, 1)), interpolation=cv2.INTER_AREA)
+    small = np.where(small > 0, 255, 0).astype(np.uint8)
+    # 粗检测宁多勿漏：票数阈值不高于最短线长，允许的间隙按缩小倍数放大
+    min_length = max(50 // factor - 2, 3)
+    lines = cv2.HoughLinesP(small, 1, np.pi / 180, threshold=min_length, minLineLength=min_length,
+                            maxLineGap=10 // factor + 1)
+    if lines is None:
+        return []
+    lines = merge_collinear_segments(lines, gap=margin / factor).reshape(-1, 4).astype(np.int64) * factor
+    x0 = np.maximum(np.minimum(lines[:, 0], lines[:, 2]) - margin, 0)
+    y0 = np.maximum(np.minimum(lines[:, 1], lines[:, 3]) - margin, 0)
+    x1 = np.minimum(np.maximum(lines[:, 0], lines[:, 2]) + margin + factor, width)
+    y1 = np.minimum(np.maximum(lines[:, 1], lines[:, 3]) + margin + factor, height)
+    return [((int(x0[k]), int(y0[k]), int(x1[k]), int(y1[k])), lines[k]) for k in range(len(lines))]
+
+
+def region_coverage(boxes, shape, factor=PYRAMID_FACTOR):
+    """候选区域并集占整幅图的比例：在缩小 factor 倍的网格上用二维差分累加各区域，不逐个画矩形"""
+    height, width = shape[:2]
+    rows, cols = -(-height // factor), -(-width // factor)
+    cells = np.stack([boxes[:, 0] // factor, boxes[:, 1] // factor,
+                      -(-boxes[:, 2] // factor), -(-boxes[:, 3] // factor)], axis=1)
+    diff = np.zeros((rows + 1, cols + 1), dtype=np.int64)
+    np.add.at(diff, (cells[:, 1], cells[:, 0]), 1)
+    np.add.at(diff, (cells[:, 1], cells[:, 2]), -1)
+    np.add.at(diff, (cells[:, 3], cells[:, 0]), -1)
+    np.add.at(diff, (cells[:, 3], cells[:, 2]), 1)
+    covered = np.cumsum(np.cumsum(diff, axis=0), axis=1)[:rows, :cols] > 0
+    return float(covered.mean())
+
+
+def contained_regions(boxes, oblique):
+    """被另一个（不做掩膜的）区域完全包含的区域编号，两个区域相同时保留编号小的一个。
+    只比较网格索引给出的相交对，不建 R × R 的包含矩阵"""
+    pairs = si.overlapping_pairs(si.build_grid_index(boxes.astype(np.float64)))
+    parts = []
+    for inner, outer in ((pairs[:, 0], pairs[:, 1]), (pairs[:, 1], pairs[:, 0])):
+        a, b = boxes[inner], boxes[outer]
+        inside = (a[:, 0] >= b[:, 0]) & (a[:, 1] >= b[:, 1]) & (a[:, 2] <= b[:, 2]) & (a[:, 3] <= b[:, 3]) & \
+                 ~oblique[outer]
+        same = (a == b).all(axis=1)
+        # 相同的两个区域只去掉编号大的一个
+        inside &= ~same | (inner > outer)
+        parts.append(inner[inside])
+    return np.unique(np.concatenate(parts))
+
+
+def detect_lines_pyramid(binary_img, factor=PYRAMID_FACTOR, margin=PYRAMID_MARGIN, engine="hough",
+                         max_coverage=PYRAMID_MAX_COVERAGE):
+    """由粗到精检测：只在粗检测找到的候选线周围做全分辨率检测，返回 (n, 1, 4)。
+    空白多的图纸上大部分像素不再参与 Canny 和 Hough；候选区域覆盖超过 max_coverage 时退回全分辨率检测"""
+    regions = candidate_regions(binary_img, factor, margin)
+    if not regions:
+        return None
+    boxes = np.array([box for box, _ in regions])
+    lines = np.array([line for _, line in regions])
+    if region_coverage(boxes, binary_img.shape, factor) > max_coverage:
+        return detect_line_segments(binary_img, engine)
+    # 斜线的包围盒很大，只保留候选线两侧 margin 以内的像素；接近水平/竖直的候选线直接用包围盒
+    dx = np.abs(lines[:, 2] - lines[:, 0])
+    dy = np.abs(lines[:, 3] - lines[:, 1])
+    oblique = np.minimum(dx, dy) > 2 * margin
+    # 完全落在另一个区域内的区域不必再检测一遍
+    skip = np.zeros(len(boxes), dtype=bool)
+    skip[contained_regions(boxes, oblique)] = True
+    parts = []
+    for k in np.flatnonzero(~skip):
+        x0, y0, x1, y1 = boxes[k]
+        roi = binary_img[y0:y1, x0:x1]
+        if oblique[k]:
+            band = np.zeros_like(roi)
+            cv2.line(band, (int(lines[k, 0] - x0), int(lines[k, 1] - y0)), (int(lines[k, 2] - x0), int(lines[k, 3] - y0)),
+                     255, thickness=2 * margin + factor)
+            roi = cv2.bitwise_and(roi, band)
+        found = detect_line_segments(roi, engine)
+        if found is not None:
+            parts.append(found.reshape(-1, 4) + np.array([x0, y0, x0, y0], dtype=np.int32))
+    if not parts:
+        return None
+    # 相邻候选线的区域会重叠，同一条线检出多次的留给合并去重
+    return np.unique(np.concatenate(parts), axis=0).reshape(-1, 1, 4)
+
+
+def segment_recall(reference, candidate, tol=PYRAMID_TOLERANCE):
+    """reference 线段总长中落在 candidate 线段 tol 像素以内的比例，用于核对金字塔模式与全分辨率结果是否一致。
+    candidate 按 2 * tol + 1 的线宽画到掩膜上，reference 沿线每隔一个像素取点查掩膜"""
+    ref = np.asarray(reference, dtype=np.float64).reshape(-1, 4)
+    cand = np.asarray(candidate, dtype=np.int32).reshape(-1, 4)
+    if len(ref) == 0:
+        return 1.0
+    if len(cand) == 0:
+        return 0.0
+    width = int(max(ref[:, [0, 2]].max(), cand[:, [0, 2]].max())) + 1
+    height = int(max(ref[:, [1, 3]].max(), cand[:, [1, 3]].max())) + 1
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.polylines(mask, cand.reshape(-1, 2, 2), False, 255, thickness=2 * int(np.ceil(tol)) + 1)
+    length = np.hypot(ref[:, 2] - ref[:, 0], ref[:, 3] - ref[:, 1])
+    steps = np.ceil(length).astype(np.int64) + 1
+    owner = np.repeat(np.arange(len(ref)), steps)
+    t = (np.arange(len(owner)) - np.repeat(np.cumsum(steps) - steps, steps)) / np.repeat(steps - 1, steps).clip(1)
+    xs = np.round(ref[owner, 0] + t * (ref[owner, 2] - ref[owner, 0])).astype(np.int64)
+    ys = np.round(ref[owner, 1] + t * (ref[owner, 3] - ref[owner, 1])).astype(np.int64)
+    return float((mask[ys, xs] > 0).sum() / len(owner))
+
+
+def tile_windows(shape, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """按块大小切分图像，返回 (读取窗口, 核心区) 列表，均为 (x0, y0, x1, y1)，核心区互不重叠并铺满整幅图"""
+    height, width = shape[:2]
+    windows = []
+    for y0 in range(0, height, tile_size):
+        for x0 in range(0, width, tile_size):
+            core = (x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+            window = (max(x0 - overlap, 0), max(y0 - overlap, 0),
+                      min(core[2] + overlap, width), min(core[3] + overlap, height))
+            windows.append((window, core))
+    return windows
+
+
+def clip_to_core(segments, core):
+    """把线段批量裁剪到核心区（Liang–Barsky），核心区按像素中心取 [x0 - 0.5, x1 - 0.5)，
+    相邻两块的核心区首尾相接，返回取整后的 (n, 4)"""
+    segments = segments.astype(np.float64)
+    x0, y0 = core[0] - 0.5, core[1] - 0.5
+    x1, y1 = core[2] - 0.5, core[3] - 0.5
+    dx = segments[:, 2] - segments[:, 0]
+    dy = segments[:, 3] - segments[:, 1]
+    p = np.stack([-dx, dx, -dy, dy], axis=1)
+    q = np.stack([segments[:, 0] - x0, x1 - segments[:, 0], segments[:, 1] - y0, y1 - segments[:, 1]], axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = q / p
+    t0 = np.maximum(np.where(p < 0, r, -np.inf).max(axis=1), 0.0)
+    t1 = np.minimum(np.where(p > 0, r, np.inf).min(axis=1), 1.0)
+    hit = ~((p == 0) & (q < 0)).any(axis=1) & (t0 < t1)
+    start = segments[hit, :2] + (segments[hit, 2:] - segments[hit, :2]) * t0[hit, None]
+    end = segments[hit, :2] + (segments[hit, 2:] - segments[hit, :2]) * t1[hit, None]
+    clipped = np.round(np.hstack([start, end])).astype(np.int32)
+    # 只擦过核心区一角的线段裁剪后不足一个像素，丢掉
+    keep = np.abs(clipped[:, 2:] - clipped[:, :2]).max(axis=1) >= 1
+    return clipped[keep]
+
+
+def detect_tile(task):
+    """进程池中处理一个块：二值化、（可选）去掉文字、直线检测，返回整图坐标下裁剪到核心区内的线段 (n, 4)
+    和中心落在核心区内的文字框列表。文字框按中心归属，接缝两侧的块不会重复输出同一个词"""
+    tile, window, core, engine, pyramid, mask_text = task
+    _, binary_img = cv2.threshold(tile, 128, 255, cv2.THRESH_BINARY_INV)
+    text_boxes = []
+    if mask_text:
+        binary_img, boxes = mask_text_regions(binary_img)
+        for box in boxes:
+            box = dict(box, x=box["x"] + window[0], y=box["y"] + window[1])
+            cx, cy = box["x"] + box["width"] / 2, box["y"] + box["height"] / 2
+            if core[0] <= cx < core[2] and core[1] <= cy < core[3]:
+                text_boxes.append(box)
+    if pyramid:
+        lines = detect_lines_pyramid(binary_img, engine=engine)
+    else:
+        lines = detect_line_segments(binary_img, engine)
+    if lines is None:
+        return np.zeros((0, 4), dtype=np.int32), text_boxes
+    segments = lines.reshape(-1, 4) + np.array([window[0], window[1], window[0], window[1]], dtype=np.int32)
+    return clip_to_core(segments, core), text_boxes
+
+
+def detect_lines_tiled(image_path, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, processes=None, engine="hough",
+                       pyramid=False, mask_text=False):
+    """分块并行检测整幅图中的线段，返回 (n, 4) 数组，格式与 HoughLinesP 的结果展平后一致。
+    pyramid、mask_text 与整幅处理时含义相同，在每个块内分别进行；mask_text=True 时返回 (线段, 文字框列表)"""
+    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    windows = tile_windows(img.shape, tile_size, overlap)
+    # 块按需切出并送入进程池，不一次复制出全部块
+    tasks = ((img[w[1]:w[3], w[0]:w[2]], w, core, engine, pyramid, mask_text) for w, core in windows)
+    with Pool(processes) as pool:
+        results = list(pool.imap(detect_tile, tasks))
+    segments = np.concatenate([part for part, _ in results]) if results else np.zeros((0, 4), dtype=np.int32)
+    if not mask_text:
+        return segments
+    text_boxes = sorted((box for _, boxes in results for box in boxes), key=lambda box: (box["y"], box["x"]))
+    return segments, text_boxes
+
+
+def mask_text_regions(binary_img, max_size=TEXT_MAX_SIZE, min_size=TEXT_MIN_SIZE, max_aspect=TEXT_MAX_ASPECT,
+                      density=TEXT_DENSITY):
+    """按连通域统计（尺寸、宽高比、墨迹密度）找出像字符的连通域并从二值图中去掉，
+    返回 (去掉文字后的二值图, 文字框列表)。字符按字高膨胀连成词，每个词一个文字框 {x, y, width, height}"""
+    n_labels, labels, stats, _ = cv2.connectedComponentsWithStats(binary_img, connectivity=8)
+    w = stats[:, cv2.CC_STAT_WIDTH]
+    h = stats[:, cv2.CC_STAT_HEIGHT]
+    fill = stats[:, cv2.CC_STAT_AREA] / np.maximum(w * h, 1)
+    longer, shorter = np.maximum(w, h), np.minimum(w, h)
+    # 与线相连的字符并在线的连通域里，不会被当成文字去掉
+    text = (longer <= max_size) & (longer >= min_size) & (longer <= max_aspect * np.maximum(shorter, 1)) & \
+           (fill >= density[0]) & (fill <= density[1])
+    text[0] = False
+    if not text.any():
+        return binary_img, []
+    # 只在各字符的包围盒内查标号，不对整幅标号图做查表
+    text_mask = np.zeros_like(binary_img)
+    for k in np.flatnonzero(text):
+        x, y = stats[k, cv2.CC_STAT_LEFT], stats[k, cv2.CC_STAT_TOP]
+        window = text_mask[y:y + h[k], x:x + w[k]]
+        window[labels[y:y + h[k], x:x + w[k]] == k] = 255
+    masked = cv2.bitwise_and(binary_img, cv2.bitwise_not(text_mask))
+
+    # 同一行相邻字符的间距小于字高，按字高的一半水平膨胀后连成一个文字框
+    char_height = int(np.median(h[text]))
+    words = cv2.dilate(text_mask, cv2.getStructuringElement(cv2.MORPH_RECT, (max(char_height, 1), 1)))
+    contours, _ = cv2.findContours(words, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = []
+    for contour in contours:
+        x, y, bw, bh = cv2.boundingRect(contour)
+        # 去掉膨胀带来的左右余量
+        pad = min(char_height // 2, (bw - 1) // 2)
+        boxes.append({"x": x + pad, "y": y, "width": bw - 2 * pad, "height": bh})
+    boxes.sort(key=lambda box: (box["y"], box["x"]))
+    return masked, boxes
+
+
+def connected_labels(n, i, j):
+    """标签传播 + 指针跳跃求连通分量，返回每个元素所在分量中最小的元素编号"""
+    labels = np.arange(n)
+    while True:
+        new = labels.copy()
+        np.minimum.at(new, i, labels[j])
+        np.minimum.at(new, j, labels[i])
+        new = new[new]
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+
+def merge_collinear_segments(lines, angle_tol=MERGE_ANGLE_TOLERANCE, offset_tol=MERGE_OFFSET_TOLERANCE,
+                             gap=MERGE_GAP):
+    """把 HoughLinesP 输出中同一条线上的碎段合并：包围盒相近的碎段两两比较，方向差不超过 angle_tol、
+    短的一段两端到长的一段所在直线的距离不超过 offset_tol、沿线方向重叠或间隙不超过 gap 的连在一起。
+    每个连通的组以其中最长的碎段为基准线，只收两端到基准线的距离都不超过 offset_tol 的碎段，
+    其余碎段在下一轮另成一组，密集的平行线不会一段接一段连成一片。返回 (n, 1, 4) 整数数组"""
+    if lines is None or len(lines) == 0:
+        return lines
+    seg = np.asarray(lines, dtype=np.float64).reshape(-1, 4)
+    n = len(seg)
+    d = seg[:, 2:] - seg[:, :2]
+    length = np.hypot(d[:, 0], d[:, 1])
+    unit = d / np.maximum(length, 1e-12)[:, None]
+    angle = np.degrees(np.arctan2(d[:, 1], d[:, 0])) % 180.0
+
+    # 候选对：包围盒外扩 gap 后相交的碎段
+    reach = max(gap, offset_tol)
+    boxes = np.stack([np.minimum(seg[:, 0], seg[:, 2]) - reach, np.minimum(seg[:, 1], seg[:, 3]) - reach,
+                      np.maximum(seg[:, 0], seg[:, 2]) + reach, np.maximum(seg[:, 1], seg[:, 3]) + reach], axis=1)
+    pairs = si.overlapping_pairs(si.build_grid_index(boxes))
+    i, j = pairs[:, 0], pairs[:, 1]
+    diff = np.abs(angle[i] - angle[j])
+    diff = np.minimum(diff, 180.0 - diff)
+    # 以长的一段为基准线，短的一段两端的法向距离和沿线位置
+    longer = np.where(length[i] >= length[j], i, j)
+    shorter = np.where(length[i] >= length[j], j, i)
+    u = unit[longer]
+    origin = seg[longer, :2]
+    rel = np.stack([seg[shorter, :2] - origin, seg[shorter, 2:] - origin], axis=1)
+    across = np.abs(rel[:, :, 0] * u[:, None, 1] - rel[:, :, 1] * u[:, None, 0]).max(axis=1)
+    along = np.einsum('kpj,kj->kp', rel, u)
+    separation = np.maximum(np.maximum(along.min(axis=1) - length[longer], -along.max(axis=1)), 0.0)
+    linked = (diff <= angle_tol) & (across <= offset_tol) & (separation <= gap)
+    i, j = i[linked], j[linked]
+
+    # 逐轮在未分组的碎段中求连通分量：分量方向取按长度加权的平均方向，以分量内最长的碎段为基准，
+    # 两端沿该方向的法向偏移都在基准线 offset_tol 以内的归入该组，组内偏移的总跨度因此有界
+    group = np.full(n, -1)
+    while (group < 0).any():
+        free = group < 0
+        keep = free[i] & free[j]
+        labels = connected_labels(n, i[keep], j[keep])
+        leader = np.empty(n, dtype=np.int64)
+        order = np.lexsort((length, labels))
+        leader[labels[order]] = order
+        ref = leader[labels]
+        sign = np.where(np.einsum('ij,ij->i', unit, unit[ref]) < 0, -1.0, 1.0)
+        weighted = unit * (sign * length * free)[:, None]
+        mean = np.stack([np.bincount(labels, weighted[:, 0], n), np.bincount(labels, weighted[:, 1], n)], axis=1)
+        mean = mean / np.maximum(np.hypot(mean[:, 0], mean[:, 1]), 1e-12)[:, None]
+        normal = np.stack([-mean[labels, 1], mean[labels, 0]], axis=1)
+        level = np.einsum('ij,ij->i', (seg[ref, :2] + seg[ref, 2:]) / 2, normal)
+        across = np.maximum(np.abs(np.einsum('ij,ij->i', seg[:, :2], normal) - level),
+                            np.abs(np.einsum('ij,ij->i', seg[:, 2:], normal) - level))
+        turn = np.degrees(np.arccos(np.clip(np.abs(np.einsum('ij,ij->i', unit, mean[labels])), 0.0, 1.0)))
+        accept = free & (((across <= offset_tol) & (turn <= angle_tol)) | (np.arange(n) == ref))
+        group[accept] = ref[accept]
+
+    # 去掉中间碎段后组内可能留下大于 gap 的空档：沿基准线方向排序，起点超过前面最远终点 + gap 处断开
+    u = unit[group]
+    t = np.stack([np.einsum('ij,ij->i', seg[:, :2], u), np.einsum('ij,ij->i', seg[:, 2:], u)], axis=1)
+    t0, t1 = t.min(axis=1), t.max(axis=1)
+    group = np.unique(group, return_inverse=True)[1]
+    order = np.lexsort((t0, group))
+    gid, a0, a1 = group[order], t0[order], t1[order]
+    base = a0.min()
+    span = a1.max() - base + gap + 1.0
+    farthest = np.maximum.accumulate(a1 - base + gid * span) - gid * span + base
+    new_piece = np.r_[True, (gid[1:] != gid[:-1]) | (a0[1:] > farthest[:-1] + gap)]
+    piece = np.empty(n, dtype=np.int64)
+    piece[order] = np.cumsum(new_piece) - 1
+
+    # 每段拟合一条直线：方向取按长度加权的平均方向，法向偏移取按长度加权的平均，
+    # 沿方向取组内端点的最小、最大位置。直线的两条边缘不会被拼成一条斜线
+    sign = np.where(np.einsum('ij,ij->i', unit, u) < 0, -1.0, 1.0)
+    weighted = unit * (sign * length)[:, None]
+    direction = np.stack([np.bincount(piece, weighted[:, 0]), np.bincount(piece, weighted[:, 1])], axis=1)
+    direction /= np.maximum(np.hypot(direction[:, 0], direction[:, 1]), 1e-12)[:, None]
+    pu = direction[piece]
+    normal = np.stack([-pu[:, 1], pu[:, 0]], axis=1)
+    middle = (seg[:, :2] + seg[:, 2:]) / 2
+    weight = np.maximum(length, 1e-9)
+    offset = np.bincount(piece, np.einsum('ij,ij->i', middle, normal) * weight) / np.bincount(piece, weight)
+    ends = np.stack([np.einsum('ij,ij->i', seg[:, :2], pu), np.einsum('ij,ij->i', seg[:, 2:], pu)], axis=1)
+    n_pieces = piece.max() + 1
+    p0 = np.full(n_pieces, np.inf)
+    p1 = np.full(n_pieces, -np.inf)
+    np.minimum.at(p0, piece, ends.min(axis=1))
+    np.maximum.at(p1, piece, ends.max(axis=1))
+    ux, uy = direction[:, 0], direction[:, 1]
+    merged = np.stack([p0 * ux - offset * uy, p0 * uy + offset * ux,
+                       p1 * ux - offset * uy, p1 * uy + offset * ux], axis=1)
+    return np.round(merged).astype(np.int32).reshape(-1, 1, 4)
+
+
 def extract_line_segments(lines):
     line_segments = []
     if lines is not None:
@@ -40,13 +483,20 @@ def extract_line_segments(lines):
     return line_segments
 
 
-def visualize_lines(image_path, line_segments):
+def visualize_lines(image_path, line_segments, overlay_path=None, show=True):
+    """把线段画在原图上：overlay_path 不为空时用 cv2.imwrite 写出叠加图，show=True 时用 matplotlib 显示。
+    matplotlib 只在需要显示时才导入，批量处理和无显示器的环境不依赖它"""
     img = cv2.imread(image_path)
     for segment in line_segments:
         cv2.line(img, (segment["start"]["x"], segment["start"]["y"]), (segment["end"]["x"], segment["end"]["y"]),
                  (0, 255, 0), 2)
-    plt.imshow(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-    plt.show()
+    if overlay_path is not None:
+        cv2.imwrite(overlay_path, img)
+        print(f"Overlay successfully saved to {overlay_path}")
+    if show:
+        import matplotlib.pyplot as plt
+        plt.imshow(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+        plt.show()
 
 
 def save_to_json(data, output_filename):
@@ -55,15 +505,43 @@ def save_to_json(data, output_filename):
     print(f"Coordinates successfully saved to {output_filename}")
 
 
-def main(image_path, output_filename):
-    # 图像预处理
-    binary_img = preprocess_image(image_path)
+def main(image_path, output_filename, tiled=False, tile_size=TILE_SIZE, processes=None, merge=True, engine="hough",
+         show=True, overlay_path=None, pyramid=False, mask_text=False, text_output_filename=None):
+    if tiled:
+        # 分块并行处理大幅面扫描件，文字掩膜和由粗到精检测在各块内分别进行
+        lines = detect_lines_tiled(image_path, tile_size, processes=processes, engine=engine, pyramid=pyramid,
+                                   mask_text=mask_text)
+        if mask_text:
+            lines, text_boxes = lines
+            if text_output_filename is not None:
+                save_to_json(text_boxes, text_output_filename)
+        lines = lines.reshape(-1, 1, 4)
+    else:
+        # 图像预处理
+        binary_img = preprocess_image(image_path)
+
+        # 去掉尺寸数字、说明文字，直线检测只处理线条；文字框单独保存
+        if mask_text:
+            binary_img, text_boxes = mask_text_regions(binary_img)
+            if text_output_filename is not None:
+                save_to_json(text_boxes, text_output_filename)
+
+        if pyramid:
+            # 由粗到精：缩小图上找候选区域，只在候选区域内做全分辨率检测
+            lines = detect_lines_pyramid(binary_img, engine=engine)
+        elif engine == "hough":
+            # 边缘检测
+            edges = detect_edges(binary_img)
 
-    # 边缘检测
-    edges = detect_edges(binary_img)
+            # 直线检测
+            lines = detect_lines(edges)
+        else:
+            # 形态学提取水平/竖直线，斜线仍用 Hough
+            lines = detect_line_segments(binary_img, engine)
 
-    # 直线检测
-    lines = detect_lines(edges)
+    # 合并同一条线上的碎段（分块模式下也把接缝两侧的线段接起来）
+    if merge:
+        lines = merge_collinear_segments(lines)
 
     # 提取线段信息
     line_segments = extract_line_segments(lines)
@@ -75,13 +553,16 @@ def main(image_path, output_filename):
     # 保存到JSON文件
     save_to_json(line_segments, output_filename)
 
-    # 可视化结果
-    visualize_lines(image_path, line_segments)
+    # 可视化结果（show=False 为无界面模式，只在给出 overlay_path 时写出叠加图）
+    if show or overlay_path is not None:
+        visualize_lines(image_path, line_segments, overlay_path, show)
 
 
-# 输入图像路径和输出JSON文件路径
-image_path = r"C:\Users\Lenovo\Desktop\123.png"
-output_filename = r"C:\\Users\\Lenovo\\Desktop\\水闸纵剖面图\\cad解析\\text2.1lotlib.pyplot as plt.json"
+if __name__ == "__main__":
+    # 输入图像路径和输出JSON文件路径
+    image_path = r"C:\Users\Lenovo\Desktop\123.png"
+    output_filename = r"C:\\Users\\Lenovo\\Desktop\\水闸纵剖面图\\cad解析\\text2.1lotlib.pyplot as plt.json"
 
-# 运行主程序
-main(image_path, output_filename)
+    # 运行主程序（进程池需要放在 __main__ 保护下；大幅面扫描件用 tiled=True；
+    # 以水平/竖直线为主的扫描件可用 engine="morph"，benchmark_engines(image_path) 比较两种方法）
+    main(image_path, output_filename)
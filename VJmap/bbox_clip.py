@@ -0,0 +1,303 @@
+import os
+import json
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import entity_store as es
+import dimension_table as dt
+
+# 版本说明：原来的 extract_coordinates_in_bbox 只要LINE有一个端点在框内、多段线有一个顶点在框内才保留，
+# 穿过查询框但两端都在框外的长剖面线会被漏掉，只能把查询框画得很大。
+# 这里对线段表整体做向量化的 Liang–Barsky 裁剪：一次得到每条线段是否与框相交，
+# 需要时同时返回裁剪到框内的那一段几何，不用再放大查询区域。
+# 审图调规则时同一区域会反复查询，extract_coordinates_cached 按 (图纸哈希, 规整后的框, 实体类型, 提取版本)
+# 缓存结果：内存中按 LRU 保留最近的若干条，可选再写到缓存目录，相同的查询直接返回上次的结果。
+
+# 提取逻辑或输出格式改变时加一，旧的缓存结果随之失效
+EXTRACTOR_VERSION = 3
+
+# 内存缓存保留的查询结果条数
+RESULT_CACHE_SIZE = 128
+
+# 查询框坐标规整到的小数位数，浮点误差不影响命中
+BBOX_DECIMALS = 6
+
+RESULT_CACHE = OrderedDict()
+
+def liang_barsky(segments, bbox):
+    """批量 Liang–Barsky 裁剪。
+    返回 (hit, t0, t1)：hit 表示线段与框相交，t0/t1 为框内部分在线段上的参数区间"""
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    min_x, min_y, max_x, max_y = bbox
+    x1, y1 = segments[:, 0], segments[:, 1]
+    dx = segments[:, 2] - x1
+    dy = segments[:, 3] - y1
+
+    # 四条边界：p * t <= q
+    p = np.stack([-dx, dx, -dy, dy], axis=1)
+    q = np.stack([x1 - min_x, max_x - x1, y1 - min_y, max_y - y1], axis=1)
+
+    parallel = p == 0
+    # 与某条边界平行且在其外侧的线段不可能相交
+    outside = (parallel & (q < 0)).any(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = q / p
+    entering = np.where(p < 0, r, -np.inf)
+    leaving = np.where(p > 0, r, np.inf)
+    t0 = np.maximum(entering.max(axis=1), 0.0)
+    t1 = np.minimum(leaving.min(axis=1), 1.0)
+    hit = ~outside & (t0 <= t1)
+    return hit, t0, t1
+
+
+def clip_segments(segments, bbox):
+    """返回与框相交的线段编号以及裁剪到框内的线段"""
+    hit, t0, t1 = liang_barsky(segments, bbox)
+    ids = np.flatnonzero(hit)
+    s = np.asarray(segments, dtype=np.float64).reshape(-1, 4)[ids]
+    d = s[:, 2:] - s[:, :2]
+    # 没被裁掉的端点保持原值，相邻线段的公共顶点裁剪后仍然完全相同
+    start = np.where(t0[ids, None] > 0, s[:, :2] + d * t0[ids, None], s[:, :2])
+    end = np.where(t1[ids, None] < 1, s[:, :2] + d * t1[ids, None], s[:, 2:])
+    return ids, np.hstack([start, end])
+
+
+def segments_in_bbox(store, bbox, dxftypes=None, clip=False):
+    """在实体表的线段表上查询与框相交的线段，先按实体包围盒筛掉不可能相交的实体"""
+    rows = es.query_entities(store, dxftype=dxftypes, bbox=bbox)
+    ids = np.flatnonzero(np.isin(store["segment_row"], rows))
+    local, clipped = clip_segments(store["segments"][ids], bbox)
+    ids = ids[local]
+    if clip:
+        return ids, clipped
+    return ids, store["segments"][ids]
+
+
+def segment_length(segments):
+    return np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+
+
+def polygon_area(points):
+    """鞋带公式求多边形面积"""
+    x, y = points[:, 0], points[:, 1]
+    return abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+
+def arc_record(store, row, points, complete=True):
+    """圆弧（或裁剪后的一段）按原脚本的格式输出：圆心、半径、逆时针起止角（度）和弧长。
+    圆心、半径和完整圆弧的起止角取加载时记下的实体参数（store["arc"]），
+    裁剪后的一段由框内首尾点相对圆心的方向求起止角"""
+    cx, cy, radius, start, end = store["arc"][row]
+    if not complete:
+        rel = points - (cx, cy)
+        start, end = np.degrees(np.arctan2(rel[[0, -1], 1], rel[[0, -1], 0])) % 360.0
+        # 镜像圆弧展开后的顶点是顺时针的，换成逆时针的起止角
+        if np.sum(rel[:-1, 0] * rel[1:, 1] - rel[:-1, 1] * rel[1:, 0]) < 0:
+            start, end = end, start
+    return {
+        "handle": store["handle"][row],
+        "center": [float(cx), float(cy)],
+        "radius": float(radius),
+        "start_angle": float(start),
+        "end_angle": float(end),
+        "length": float(radius * np.radians((end - start) % 360.0 or 360.0)),
+    }
+
+
+def linear_dimensions_in_bbox(dimension_table, bbox):
+    """尺寸线中点落在框内的线性标注，格式同 dimension_table.dimension_records"""
+    linear = np.flatnonzero(np.isin(dimension_table["dimtype"], list(dt.LINEAR_TYPES)))
+    p0 = dimension_table["defpoints"][linear, 0, :2]
+    p2 = dimension_table["defpoints"][linear, 1, :2]
+    p3 = dimension_table["defpoints"][linear, 2, :2]
+    rad = np.where(dimension_table["dimtype"][linear] == dt.DIM_LINEAR,
+                   np.radians(dimension_table["angle"][linear]),
+                   np.arctan2(p3[:, 1] - p2[:, 1], p3[:, 0] - p2[:, 0]))
+    direction = np.stack([np.cos(rad), np.sin(rad)], axis=1)
+    # 两个尺寸界线原点的中点投影到尺寸线上
+    middle = p0 + direction * np.einsum('ij,ij->i', (p2 + p3) / 2 - p0, direction)[:, None]
+    min_x, min_y, max_x, max_y = bbox
+    inside = (middle[:, 0] >= min_x) & (middle[:, 0] <= max_x) & (middle[:, 1] >= min_y) & (middle[:, 1] <= max_y)
+    return dt.dimension_records(dimension_table, dt.LINEAR_TYPES, linear[inside])
+
+
+def extract_coordinates_in_bbox(store, bbox, clip=False, dxftypes=None, dimension_table=None):
+    """按线段与框的真实相交关系提取框内的直线、多段线、样条和圆弧，输出格式与原脚本一致；
+    clip=True 时坐标、长度为裁剪到框内的部分，dxftypes 给出时只提取这些类型的实体。
+    给出 dimension_table（dimension_table.build_dimension_table 的结果）时同时输出框内的线性标注"""
+    coordinates = {
+        "points": [],
+        "lines": [],
+        "lwpolylines": [],
+        "splines": [],
+        "arcs": [],
+        "texts": [],
+        "mtexts": [],
+        "linear_dimensions": [],
+    }
+    ids, segments = segments_in_bbox(store, bbox, dxftypes=dxftypes, clip=clip)
+    segment_row = store["segment_row"]
+    if not clip:
+        # 不裁剪时输出相交实体的完整几何
+        rows = np.unique(segment_row[ids])
+        ids = np.flatnonzero(np.isin(segment_row, rows))
+        segments = store["segments"][ids]
+    rows = segment_row[ids]
+    lengths = segment_length(segments)
+
+    # 按实体行号、线段编号是否连续以及首尾是否相接切分成若干段连续折线
+    # （裁剪后同一实体可能在框内出现多段，INSERT 展开出的线段也不是一条折线）
+    if len(ids):
+        joined = (segments[1:, :2] == segments[:-1, 2:]).all(axis=1)
+        breaks = np.r_[True, (rows[1:] != rows[:-1]) | (ids[1:] != ids[:-1] + 1) | ~joined]
+    else:
+        breaks = np.zeros(0, dtype=bool)
+    starts = np.flatnonzero(breaks)
+    ends = np.r_[starts[1:], len(ids)]
+    for start, end in zip(starts, ends):
+        row = rows[start]
+        dxftype = store["dxftype"][row]
+        part = segments[start:end]
+        info = {
+            "handle": store["handle"][row],
+            "length": float(lengths[start:end].sum()),
+        }
+        if dxftype == 'LINE':
+            info["start"] = part[0, :2].tolist()
+            info["end"] = part[0, 2:].tolist()
+            coordinates["lines"].append(info)
+            continue
+        points = np.vstack([part[:, :2], part[-1:, 2:]])
+        info["points"] = points.tolist()
+        lo, hi = np.searchsorted(segment_row, [row, row + 1])
+        complete = end - start == hi - lo and np.allclose(store["segments"][lo:hi], part)
+        if dxftype in es.POLYLINE_TYPES:
+            # 只有完整保留下来的闭合多段线才计算面积
+            is_closed = bool(np.allclose(points[0], points[-1]))
+            info["is_closed"] = is_closed
+            info["area"] = float(polygon_area(points[:-1])) if is_closed and complete else None
+            coordinates["lwpolylines"].append(info)
+        elif dxftype == 'SPLINE':
+            coordinates["splines"].append(info)
+        elif dxftype in {'ARC', 'CIRCLE'}:
+            coordinates["arcs"].append(arc_record(store, row, points, complete))
+        else:
+            info["type"] = dxftype
+            coordinates.setdefault("others", []).append(info)
+
+    texts = store["texts"]
+    min_x, min_y, max_x, max_y = bbox
+    inside = (texts["insert"][:, 0] >= min_x) & (texts["insert"][:, 0] <= max_x) & \
+             (texts["insert"][:, 1] >= min_y) & (texts["insert"][:, 1] <= max_y)
+    if dxftypes is not None:
+        inside &= np.isin(store["dxftype"][texts["row"]], dxftypes)
+    for i in np.flatnonzero(inside):
+        row = texts["row"][i]
+        key = "mtexts" if store["dxftype"][row] == 'MTEXT' else "texts"
+        coordinates[key].append({
+            "text": texts["text"][i],
+            "location": texts["insert"][i].tolist(),
+            "height": float(texts["height"][i]),
+        })
+
+    if dxftypes is None or 'POINT' in dxftypes:
+        for row in es.query_entities(store, dxftype='POINT', bbox=bbox):
+            coordinates["points"].append(store["bbox"][row, :2].tolist())
+    if dimension_table is not None:
+        coordinates["linear_dimensions"] = linear_dimensions_in_bbox(dimension_table, bbox)
+    return coordinates
+
+
+def drawing_hash(store):
+    """实体表内容的 sha1（线段、实体属性和文字），第一次计算后记在 store["hash"] 里。
+    替换实体表中的数组后须调用 es.build_store_indexes 重建索引，它同时丢掉记下的哈希，下次重新计算"""
+    digest = store.get("hash")
+    if digest is None:
+        sha = hashlib.sha1()
+        for array in (store["segments"], store["segment_row"], store["bbox"], store["arc"], store["texts"]["insert"]):
+            sha.update(np.ascontiguousarray(array).tobytes())
+        for values in (store["handle"], store["dxftype"], store["layer"], store["texts"]["text"]):
+            sha.update('\x00'.join(map(str, values)).encode('utf-8'))
+        digest = store["hash"] = sha.hexdigest()
+    return digest
+
+
+def cache_key(store, bbox, clip=False, dxftypes=None, dimensions=False):
+    """(图纸哈希, 规整后的框, 实体类型, 是否裁剪, 是否含标注, 提取版本)"""
+    x0, y0, x1, y1 = (round(float(v), BBOX_DECIMALS) for v in bbox)
+    box = (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+    if isinstance(dxftypes, str):
+        dxftypes = [dxftypes]
+    types = None if dxftypes is None else tuple(sorted(set(dxftypes)))
+    return drawing_hash(store), box, types, bool(clip), bool(dimensions), EXTRACTOR_VERSION
+
+
+def cache_file(cache_dir, key):
+    name = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, name + '.json')
+
+
+def write_cache_file(filename, key, coordinates):
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump({"key": key, "coordinates": coordinates}, f, ensure_ascii=False)
+    except OSError as e:
+        print(f"An error occurred while saving result cache: {e}")
+
+
+def extract_coordinates_cached(store, bbox, clip=False, dxftypes=None, dimension_table=None, cache_dir=None):
+    """带缓存的 extract_coordinates_in_bbox：先查内存 LRU，再查 cache_dir 中的结果文件，都没有才重新提取。
+    内存命中时若给了 cache_dir 而结果文件还不存在（先前的查询没有开磁盘缓存），顺便补写文件。
+    dimension_table 须来自同一张图纸。返回的是缓存中的同一个字典，调用方不要修改它"""
+    key = cache_key(store, bbox, clip, dxftypes, dimension_table is not None)
+    filename = cache_file(cache_dir, key) if cache_dir is not None else None
+    coordinates = RESULT_CACHE.get(key)
+    if coordinates is not None:
+        RESULT_CACHE.move_to_end(key)
+        if filename is not None and not os.path.isfile(filename):
+            write_cache_file(filename, key, coordinates)
+        return coordinates
+
+    if filename is not None and os.path.isfile(filename):
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get("key") == json.loads(json.dumps(key)):
+                coordinates = cached["coordinates"]
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable result cache {filename}: {e}")
+    if coordinates is None:
+        coordinates = extract_coordinates_in_bbox(store, key[1], clip, None if key[2] is None else list(key[2]),
+                                                  dimension_table)
+        if filename is not None:
+            write_cache_file(filename, key, coordinates)
+
+    RESULT_CACHE[key] = coordinates
+    while len(RESULT_CACHE) > RESULT_CACHE_SIZE:
+        RESULT_CACHE.popitem(last=False)
+    return coordinates
+
+
+def clear_result_cache():
+    RESULT_CACHE.clear()
+
+
+def save_to_json(data, output_filename):
+    try:
+        with open(output_filename, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        print(f"Coordinates successfully saved to {output_filename}")
+    except Exception as e:
+        print(f"An error occurred while saving to JSON: {e}")
+
+
+if __name__ == "__main__":
+    # 示例用法
+    dxf_file_path = r"C:\Users\Lenovo\Desktop\水闸纵剖面图\cad解析\剖面底板厚度.dxf"
+    xmin, ymin, xmax, ymax = map(float, input("Enter xmin, ymin, xmax, ymax: ").split())
+    store = es.load_entity_store(dxf_file_path)
+    if store is not None:
+        coords = extract_coordinates_cached(store, (xmin, ymin, xmax, ymax), clip=True,
+                                            cache_dir=r"C:\\Users\\Lenovo\\Desktop\\水闸纵剖面图\\cache")
+        save_to_json(coords, r"C:\\Users\\Lenovo\\Desktop\\水闸纵剖面图\\text_clip.json")
@@ -0,0 +1,143 @@
+import json
+import numpy as np
+import dimension_table as dt
+
+# 版本说明：train7.0.py 把框内所有线性标注 sum += measurement 累加，分不清连续的尺寸链和零散的标注，
+# 总长核对只能靠手画框。这里把测量方向角、尺寸线在法向上的位置分别排序，相邻两项之差超过容差处断开分组
+# （不取整，容差边界两侧相同的值不会被分开），每个方向组按组内的平均方向投影，斜向的尺寸链不会因为方向取整而偏离基线。
+# 同一条基线上的标注按沿测量方向的起点排序，首尾相接的标注归为一条尺寸链，
+# 链的合计、链内间隙以及与“总尺寸”（同方向、端点正好覆盖整条链的标注）的比较都在一次向量化计算中完成。
+
+# 尺寸线位置、端点相接判断的容差（图纸单位）
+CHAIN_TOLERANCE = 0.05
+
+# 测量方向角的容差（度）：排序后相邻两个方向角相差不超过该值的归为同一方向
+CHAIN_ANGLE_STEP = 1.0
+
+
+def split_sorted(values, tol, groups=None):
+    """按 (groups, values) 排序后，相邻两项属于不同的组或数值之差超过 tol 处断开，返回每项的新组号"""
+    n = len(values)
+    groups = np.zeros(n, dtype=np.int64) if groups is None else groups
+    order = np.lexsort((values, groups))
+    breaks = np.r_[True, (np.diff(groups[order]) != 0) | (np.diff(values[order]) > tol)]
+    labels = np.empty(n, dtype=np.int64)
+    labels[order] = np.cumsum(breaks) - 1
+    return labels
+
+
+def dimension_axes(table, rows, angle_tol=CHAIN_ANGLE_STEP):
+    """线性标注的方向组号、组内平均测量方向角（0~180度）、基线位置以及沿测量方向的起止坐标。
+    投影用各方向组的平均方向，不用取整后的角度"""
+    p0 = table["defpoints"][rows, 0, :2]
+    p2 = table["defpoints"][rows, 1, :2]
+    p3 = table["defpoints"][rows, 2, :2]
+    # 转角标注取 angle，对齐标注取两个原点连线方向；180度与0度为同一方向
+    angle = np.where(table["dimtype"][rows] == dt.DIM_LINEAR, table["angle"][rows],
+                     np.degrees(np.arctan2(p3[:, 1] - p2[:, 1], p3[:, 0] - p2[:, 0]))) % 180.0
+    angle_group = split_sorted(angle, angle_tol)
+    # 接近180度的一组与接近0度的一组是同一方向
+    if len(angle) and angle.max() - 180.0 >= angle.min() - angle_tol:
+        angle_group[angle_group == angle_group[np.argmax(angle)]] = angle_group[np.argmin(angle)]
+    angle_group = np.unique(angle_group, return_inverse=True)[1]
+    # 平均方向按二倍角求平均，0度和180度附近的方向不会互相抵消
+    doubled = np.radians(2 * angle)
+    mean = np.arctan2(np.bincount(angle_group, np.sin(doubled)), np.bincount(angle_group, np.cos(doubled))) / 2
+    rad = mean[angle_group]
+    direction = np.stack([np.cos(rad), np.sin(rad)], axis=1)
+    normal = np.stack([-direction[:, 1], direction[:, 0]], axis=1)
+    baseline = np.einsum('ij,ij->i', p0, normal)
+    s2 = np.einsum('ij,ij->i', p2, direction)
+    s3 = np.einsum('ij,ij->i', p3, direction)
+    return angle_group, np.degrees(rad) % 180.0, baseline, np.minimum(s2, s3), np.maximum(s2, s3)
+
+
+def detect_chains(table, tol=CHAIN_TOLERANCE, min_length=2):
+    """检测全部线性尺寸链，返回链列表（按基线分组、沿测量方向排序）"""
+    rows = np.flatnonzero(np.isin(table["dimtype"], list(dt.LINEAR_TYPES)))
+    if len(rows) == 0:
+        return []
+    angle_group, angle, baseline, start, end = dimension_axes(table, rows)
+    value = table["value"][rows]
+    scale = table["dimlfac"][rows]
+
+    # 方向组内按基线位置排序，相邻基线之差超过容差处断开
+    group = split_sorted(baseline, tol, angle_group)
+
+    # 总尺寸的查找表：方向组内按起点排序
+    by_start = np.lexsort((start, angle_group))
+    sorted_group, sorted_start = angle_group[by_start], start[by_start]
+    sorted_rows, sorted_end = rows[by_start], end[by_start]
+
+    order = np.lexsort((end, start, group))
+    rows, group, angle_group, angle, baseline, start, end, value, scale = (
+        v[order] for v in (rows, group, angle_group, angle, baseline, start, end, value, scale))
+
+    # 同组相邻两个标注：后一个起点与前一个终点相接（容差内）则连成一条链
+    gap = start[1:] - end[:-1]
+    same_group = group[1:] == group[:-1]
+    joined = same_group & (np.abs(gap) <= tol)
+    chain = np.cumsum(np.r_[True, ~joined]) - 1
+    n_chains = chain[-1] + 1
+    counts = np.bincount(chain, minlength=n_chains)
+    totals = np.bincount(chain, value, minlength=n_chains)
+    first = np.flatnonzero(np.r_[True, ~joined])
+    last = np.r_[first[1:], len(rows)] - 1
+    chain_start = start[first]
+    chain_end = end[last]
+    span = (chain_end - chain_start) * scale[first]
+
+    # 同一基线上相邻两条链之间的间隙（负值为重叠）
+    next_gap = np.full(n_chains, np.nan)
+    has_next = np.r_[same_group & ~joined, False][last]
+    next_gap[has_next] = gap[last[has_next]] * scale[last[has_next]]
+
+    chains = []
+    for c in np.flatnonzero(counts >= min_length):
+        members = rows[first[c]:last[c] + 1]
+        # 总尺寸：同方向、起止点与整条链一致的单个标注（可以在另一条基线上）
+        g = angle_group[first[c]]
+        lo, hi = np.searchsorted(sorted_group, [g, g + 1])
+        lo, hi = lo + np.searchsorted(sorted_start[lo:hi], [chain_start[c] - tol, chain_start[c] + tol], 'right')
+        overall = [row for row, e in zip(sorted_rows[lo:hi], sorted_end[lo:hi])
+                   if abs(e - chain_end[c]) <= tol and row not in members]
+        record = {
+            "angle": float(angle[first[c]]),
+            "baseline": float(baseline[first[c]]),
+            "start": float(chain_start[c]),
+            "end": float(chain_end[c]),
+            "handles": [table["handle"][row] for row in members],
+            "values": value[first[c]:last[c] + 1].tolist(),
+            "total": round(float(totals[c]), 2),
+            "span": round(float(span[c]), 2),
+            "gap_to_next": None if np.isnan(next_gap[c]) else round(float(next_gap[c]), 2),
+        }
+        if overall:
+            row = overall[0]
+            record["overall"] = {
+                "handle": table["handle"][row],
+                "value": float(table["value"][row]),
+                "difference": round(float(totals[c] - table["value"][row]), 2),
+            }
+        chains.append(record)
+    return chains
+
+
+def save_to_json(data, output_filename):
+    try:
+        with open(output_filename, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        print(f"Dimension chains successfully saved to {output_filename}")
+    except Exception as e:
+        print(f"An error occurred while saving to JSON: {e}")
+
+
+if __name__ == "__main__":
+    # 示例用法
+    import ezdxf
+    dxf_file_path = r"C:\Users\Lenovo\Desktop\水闸纵剖面图\cad解析\剖面底板厚度.dxf"
+    doc = ezdxf.readfile(dxf_file_path)
+    chains = detect_chains(dt.build_dimension_table(doc))
+    for chain in chains:
+        print(f"尺寸链 {len(chain['handles'])} 段，合计 {chain['total']}，图上长度 {chain['span']}")
+    save_to_json(chains, r"C:\\Users\\Lenovo\\Desktop\\水闸纵剖面图\\dimension_chains.json")
@@ -0,0 +1,214 @@
+import json
+import numpy as np
+import entity_store as es
+import spatial_index as si
+import topology as tp
+import dimension_table as dt
+
+# 版本说明：线性标注在输出的JSON里一直是孤立的，核对“图上画的长度”和“标注写的数值”时不知道它标的是哪两条边。
+# 这里对线段表建立一次网格空间索引，把所有线性标注的两个尺寸界线原点（defpoint2 / defpoint3）
+# 一次性批量查询附近的线段，取尺寸界线所在直线穿过的、离原点最近的一条作为被标注的边。
+# 命中点本来就在尺寸界线上，用它们量出的距离只是把标注的定义点又算了一遍。所以图上实测值改为量几何本身：
+# 每个原点附近找与尺寸界线平行的边、与测量方向平行的边的端点，取沿测量方向离原点最近的一个作为几何特征，
+# 两个特征沿测量方向的距离（乘 dimlfac）与标注值比较。几何被改动而标注没跟着改时就会出现差值。
+# 整张图所有标注一批完成。
+
+# 尺寸界线所在直线偏离几何的容差（图纸单位）
+ASSOCIATION_TOLERANCE = 0.05
+
+# 沿尺寸界线的搜索范围相对尺寸线偏移的倍数
+REACH_FACTOR = 3.0
+
+# 几何特征：边与尺寸界线/测量方向的夹角容差（度），沿测量方向离原点的最大距离相对测量长度的比例
+FEATURE_ANGLE_TOLERANCE = 1.0
+FEATURE_WINDOW_FACTOR = 0.25
+
+
+def segment_boxes(segments):
+    return np.stack([np.minimum(segments[:, 0], segments[:, 2]), np.minimum(segments[:, 1], segments[:, 3]),
+                     np.maximum(segments[:, 0], segments[:, 2]), np.maximum(segments[:, 1], segments[:, 3])], axis=1)
+
+
+def extension_hits(segments, origins, directions, reach, tol=ASSOCIATION_TOLERANCE, index=None):
+    """沿尺寸界线所在直线（过原点、方向为 directions）批量寻找被它穿过的线段，
+    每个原点取离它最近的一条（原点本身落在几何上时距离为0）。
+    返回线段编号（没有为 -1）、沿尺寸界线的距离和命中点"""
+    origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+    n = len(origins)
+    best = np.full(n, -1)
+    best_distance = np.full(n, np.nan)
+    best_hit = np.full((n, 2), np.nan)
+    if len(segments) == 0 or n == 0:
+        return best, best_distance, best_hit
+    if index is None:
+        index = si.build_grid_index(segment_boxes(segments))
+    point_ids, seg, _ = si.query_radius_batch(index, origins, reach)
+    p, v = origins[point_ids], directions[point_ids]
+    u = np.stack([v[:, 1], -v[:, 0]], axis=1)
+    s0, d = segments[seg, :2], segments[seg, 2:] - segments[seg, :2]
+    # 线段两端在测量方向上相对尺寸界线的位置，异号（或在容差内）说明被尺寸界线穿过
+    e0 = np.einsum('ij,ij->i', s0 - p, u)
+    du = np.einsum('ij,ij->i', d, u)
+    crossing = (np.minimum(e0, e0 + du) <= tol) & (np.maximum(e0, e0 + du) >= -tol)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(np.abs(du) > 1e-12, -e0 / du, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    hit = s0 + d * t[:, None]
+    # 与尺寸界线平行且重合的线段取离原点最近的点
+    along0 = np.einsum('ij,ij->i', s0 - p, v)
+    along1 = along0 + np.einsum('ij,ij->i', d, v)
+    parallel = np.abs(du) <= 1e-12
+    inside = (np.minimum(along0, along1) <= 0) & (np.maximum(along0, along1) >= 0)
+    distance = np.where(parallel & inside, 0.0,
+                        np.where(parallel, np.minimum(np.abs(along0), np.abs(along1)),
+                                 np.abs(np.einsum('ij,ij->i', hit - p, v))))
+    hit = np.where((parallel & inside)[:, None], p, hit)
+    hit = np.where((parallel & ~inside & (np.abs(along1) < np.abs(along0)))[:, None], segments[seg, 2:], hit)
+    keep = crossing & (distance <= reach if np.isscalar(reach) else distance <= np.asarray(reach)[point_ids])
+    point_ids, seg, distance, hit = point_ids[keep], seg[keep], distance[keep], hit[keep]
+    # 每个原点取距离最小的一条：按 (原点, 距离) 排序后取每组第一个
+    order = np.lexsort((distance, point_ids))
+    first = order[np.r_[True, point_ids[order][1:] != point_ids[order][:-1]]] if len(order) else order
+    best[point_ids[first]] = seg[first]
+    best_distance[point_ids[first]] = distance[first]
+    best_hit[point_ids[first]] = hit[first]
+    return best, best_distance, best_hit
+
+
+def geometry_features(segments, origins, directions, reach, window, index=None,
+                      angle_tol=FEATURE_ANGLE_TOLERANCE):
+    """为每个尺寸界线原点找被标注的几何特征：与尺寸界线平行的边（取整条边的位置），
+    或与测量方向平行的边的端点（轮廓的角点）。取沿测量方向离原点最近的一个，
+    返回特征沿测量方向相对原点的偏移（没有为 nan）、特征点和线段编号（没有为 -1）"""
+    origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+    n = len(origins)
+    best_shift = np.full(n, np.nan)
+    best_point = np.full((n, 2), np.nan)
+    best_seg = np.full(n, -1)
+    if len(segments) == 0 or n == 0:
+        return best_shift, best_point, best_seg
+    if index is None:
+        index = si.build_grid_index(segment_boxes(segments))
+    point_ids, seg, _ = si.query_radius_batch(index, origins, reach)
+    p, v = origins[point_ids], directions[point_ids]
+    e = np.stack([-v[:, 1], v[:, 0]], axis=1)
+    s0, s1 = segments[seg, :2], segments[seg, 2:]
+    d = s1 - s0
+    length = np.maximum(np.hypot(d[:, 0], d[:, 1]), 1e-12)
+    cos_limit = np.cos(np.radians(angle_tol))
+    along_extension = np.abs(np.einsum('ij,ij->i', d, e)) / length >= cos_limit
+    along_measure = np.abs(np.einsum('ij,ij->i', d, v)) / length >= cos_limit
+
+    # 候选特征：平行于尺寸界线的边取其上离原点最近的点，平行于测量方向的边取两个端点
+    t = np.clip(np.einsum('ij,ij->i', p - s0, d) / length ** 2, 0.0, 1.0)
+    nearest = s0 + d * t[:, None]
+    owner = np.concatenate([point_ids[along_extension], point_ids[along_measure], point_ids[along_measure]])
+    feature_seg = np.concatenate([seg[along_extension], seg[along_measure], seg[along_measure]])
+    point = np.vstack([nearest[along_extension], s0[along_measure], s1[along_measure]])
+    rel = point - origins[owner]
+    shift = np.einsum('ij,ij->i', rel, directions[owner])
+    lateral = np.abs(np.einsum('ij,ij->i', rel, np.stack([-directions[owner, 1], directions[owner, 0]], axis=1)))
+    limit = window if np.isscalar(window) else np.asarray(window)[owner]
+    keep = np.abs(shift) <= limit
+    owner, feature_seg, point, shift, lateral = (a[keep] for a in (owner, feature_seg, point, shift, lateral))
+    # 每个原点取沿测量方向最近的，同样近时取沿尺寸界线更近的
+    order = np.lexsort((lateral, np.abs(shift), owner))
+    first = order[np.r_[True, owner[order][1:] != owner[order][:-1]]] if len(order) else order
+    best_shift[owner[first]] = shift[first]
+    best_point[owner[first]] = point[first]
+    best_seg[owner[first]] = feature_seg[first]
+    return best_shift, best_point, best_seg
+
+
+def associate_dimensions(store, dimension_table, tol=ASSOCIATION_TOLERANCE, dxftypes=tp.LINEWORK_TYPES):
+    """为全部线性标注关联其两个尺寸界线所指的几何，并计算图上实测值与标注值的差。
+    尺寸界线原点常常离轮廓线有一小段距离，所以沿尺寸界线方向寻找，
+    搜索范围取该标注的测量长度与尺寸线到原点距离若干倍中的较大者"""
+    linear = np.flatnonzero(np.isin(dimension_table["dimtype"], list(dt.LINEAR_TYPES)))
+    p0 = dimension_table["defpoints"][linear, 0, :2]
+    p2 = dimension_table["defpoints"][linear, 1, :2]
+    p3 = dimension_table["defpoints"][linear, 2, :2]
+    # 测量方向：转角标注取 angle，对齐标注取两个原点连线方向
+    rad = np.where(dimension_table["dimtype"][linear] == dt.DIM_LINEAR,
+                   np.radians(dimension_table["angle"][linear]),
+                   np.arctan2(p3[:, 1] - p2[:, 1], p3[:, 0] - p2[:, 0]))
+    direction = np.stack([np.cos(rad), np.sin(rad)], axis=1)
+    extension = np.stack([-direction[:, 1], direction[:, 0]], axis=1)
+    measurement = np.nan_to_num(dimension_table["measurement"][linear])
+    offset = np.abs(np.einsum('ij,ij->i', p0 - p2, extension))
+    # 很短的标注、紧贴轮廓的尺寸线搜索范围太小，至少取整张图尺寸线偏移中位数的 REACH_FACTOR 倍
+    floor = REACH_FACTOR * np.median(offset) if len(offset) else 0.0
+    reach = np.maximum(np.maximum(measurement, REACH_FACTOR * offset), floor)
+    reach = np.concatenate([reach, reach]) + tol
+
+    rows = es.query_entities(store, dxftype=list(dxftypes))
+    segment_ids = np.flatnonzero(np.isin(store["segment_row"], rows))
+    segments = store["segments"][segment_ids]
+    index = si.build_grid_index(segment_boxes(segments))
+    origins = np.vstack([p2, p3])
+    best, distance, hit = extension_hits(segments, origins, np.vstack([extension, extension]), reach, tol, index)
+    n = len(linear)
+    seg = np.where(best >= 0, segment_ids[np.maximum(best, 0)], -1)
+    # 图上实测值：两个几何特征沿测量方向的距离
+    window = np.concatenate([measurement, measurement]) * FEATURE_WINDOW_FACTOR + tol
+    shift, feature, feature_seg = geometry_features(segments, origins, np.vstack([direction, direction]),
+                                                    reach, window, index)
+    feature_seg = np.where(feature_seg >= 0, segment_ids[np.maximum(feature_seg, 0)], -1)
+    drawn = np.abs(np.einsum('ij,ij->i', p3 - p2, direction) + shift[n:] - shift[:n]) * \
+        dimension_table["dimlfac"][linear]
+    discrepancy = drawn - dimension_table["value"][linear]
+
+    segment_row = store["segment_row"]
+    records = []
+    for k, row in enumerate(linear):
+        ends = []
+        for end in (k, n + k):
+            if seg[end] < 0:
+                ends.append(None)
+                continue
+            entity = segment_row[seg[end]]
+            ends.append({
+                "row": int(entity),
+                "handle": store["handle"][entity],
+                "dxftype": store["dxftype"][entity],
+                "segment": int(seg[end]),
+                "distance": float(distance[end]),
+                "point": hit[end].tolist(),
+            })
+        features = [None if feature_seg[end] < 0 else {
+            "handle": store["handle"][segment_row[feature_seg[end]]],
+            "segment": int(feature_seg[end]),
+            "point": feature[end].tolist(),
+        } for end in (k, n + k)]
+        measured = not np.isnan(drawn[k])
+        records.append({
+            "handle": dimension_table["handle"][row],
+            "type": dt.DIMENSION_TYPE_NAMES[int(dimension_table["dimtype"][row])],
+            "value": float(dimension_table["value"][row]),
+            "start_geometry": ends[0],
+            "end_geometry": ends[1],
+            "start_feature": features[0],
+            "end_feature": features[1],
+            "drawn_value": round(float(drawn[k]), 2) if measured else None,
+            "discrepancy": round(float(discrepancy[k]), 2) if measured else None,
+        })
+    return records
+
+
+def save_to_json(data, output_filename):
+    try:
+        with open(output_filename, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        print(f"Dimension associations successfully saved to {output_filename}")
+    except Exception as e:
+        print(f"An error occurred while saving to JSON: {e}")
+
+
+if __name__ == "__main__":
+    # 示例用法
+    import ezdxf
+    dxf_file_path = r"C:\Users\Lenovo\Desktop\水闸纵剖面图\cad解析\剖面底板厚度.dxf"
+    doc = ezdxf.readfile(dxf_file_path)
+    store = es.build_entity_store(doc)
+    records = associate_dimensions(store, dt.build_dimension_table(doc))
+    save_to_json(records, r"C:\\Users\\Lenovo\\Desktop\\水闸纵剖面图\\dimension_geometry.json")
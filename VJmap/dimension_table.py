@@ -0,0 +1,257 @@
+import ezdxf
+import os
+import re
+import json
+import numpy as np
+
+# 版本说明：把图纸中所有DIMENSION实体一次遍历读入一张按列存放的标注表（numpy数组），
+# 不再只保留 dimtype 为0/1的线性标注，角度(2/5)、直径(3)、半径(4)、坐标(6)标注也一并解析。
+# 各类标注的测量值在表上批量计算：角度由定义点求方向角之差，半径/直径由圆心和弦上点求距离。
+
+DIM_LINEAR = 0
+DIM_ALIGNED = 1
+DIM_ANGULAR = 2
+DIM_DIAMETER = 3
+DIM_RADIUS = 4
+DIM_ANGULAR_3P = 5
+DIM_ORDINATE = 6
+
+LINEAR_TYPES = {DIM_LINEAR, DIM_ALIGNED}
+ANGLE_TYPES = {DIM_ANGULAR, DIM_DIAMETER, DIM_RADIUS, DIM_ANGULAR_3P}
+
+DIMENSION_TYPE_NAMES = {
+    DIM_LINEAR: "Linear Dimension",
+    DIM_ALIGNED: "Aligned Dimension",
+    DIM_ANGULAR: "Angular Dimension",
+    DIM_DIAMETER: "Diameter Dimension",
+    DIM_RADIUS: "Radius Dimension",
+    DIM_ANGULAR_3P: "Angular 3P Dimension",
+    DIM_ORDINATE: "Ordinate Dimension",
+}
+
+# 定义点在表中的列顺序：defpoints[:, i] 对应 DEFPOINT_NAMES[i]
+DEFPOINT_NAMES = ("defpoint", "defpoint2", "defpoint3", "defpoint4", "defpoint5")
+
+NUMBER_PATTERN = re.compile(r"[-+]?\d+(?:\.\d+)?")
+
+
+def get_dimension_scale(doc, entity):
+    """获取DIMENSION实体的比例因子"""
+    # 优先取实体上的标注样式覆盖值（图中显示的数值以它为准）
+    try:
+        return entity.override().get('dimlfac', 1.0)
+    except Exception:
+        pass
+    # 如果覆盖值读取失败，尝试从标注样式中获取
+    dim_style = doc.dimstyles.get(entity.dxf.dimstyle)
+    if dim_style:
+        return dim_style.dxf.dimlfac
+    # 如果都不存在，返回默认比例因子1
+    return 1.0
+
+
+def parse_dimension_text(text):
+    """从标注的替代文字中取出数值，没有显式数值时返回None"""
+    if text is None or text.strip() in {'', '<>', ' '}:
+        return None
+    if '<>' in text:
+        return None
+    match = NUMBER_PATTERN.search(text)
+    if match is None:
+        return None
+    return float(match.group())
+
+
+def read_dimension_row(doc, entity):
+    """读取一个DIMENSION实体的一行：(句柄, 替代文字, 原始dimtype, 转角, 比例因子, 定义点)"""
+    raw_type = entity.dxf.get('dimtype', 0)
+    defpoints = np.zeros((len(DEFPOINT_NAMES), 3))
+    for i, name in enumerate(DEFPOINT_NAMES):
+        point = entity.dxf.get(name, None)
+        if point is not None:
+            defpoints[i] = (point[0], point[1], point[2])
+    return (entity.dxf.handle, entity.dxf.get('text', None), raw_type, entity.dxf.get('angle', 0.0),
+            get_dimension_scale(doc, entity), defpoints)
+
+
+def build_dimension_table(doc):
+    """一次遍历模型空间，把所有类型的DIMENSION读入按列存放的标注表"""
+    msp = doc.modelspace()
+    # 每行整体读完再收下，读到一半出错的实体整行跳过，各列不会错位
+    rows = []
+    for entity in msp.query('DIMENSION'):
+        try:
+            rows.append(read_dimension_row(doc, entity))
+        except AttributeError as e:
+            print(f"AttributeError: {e}")
+        except Exception as e:
+            print(f"Unexpected error: {e}")
+
+    n = len(rows)
+    raw_types = np.array([row[2] for row in rows], dtype=np.int64)
+    table = {
+        "handle": [row[0] for row in rows],
+        "text": [row[1] for row in rows],
+        "dimtype": (raw_types & 15).astype(np.int16),
+        "flags": (raw_types & ~15).astype(np.int16),
+        "angle": np.array([row[3] for row in rows], dtype=np.float64),
+        "dimlfac": np.array([row[4] for row in rows], dtype=np.float64),
+        "defpoints": np.array([row[5] for row in rows], dtype=np.float64).reshape(n, len(DEFPOINT_NAMES), 3),
+    }
+
+    compute_dimension_measurements(table)
+    return table
+
+
+def compute_dimension_measurements(table):
+    """在整张标注表上批量计算测量值、半径/直径的圆心以及最终标注值"""
+    dimtype = table["dimtype"]
+    p0, p2, p3, p4 = (table["defpoints"][:, i, :2] for i in (0, 1, 2, 3))
+    n = len(dimtype)
+    measurement = np.full(n, np.nan)
+    center = np.full((n, 2), np.nan)
+
+    # 转角线性标注：两条尺寸界线原点之差投影到标注方向上
+    mask = dimtype == DIM_LINEAR
+    rad = np.radians(table["angle"][mask])
+    delta = p3[mask] - p2[mask]
+    measurement[mask] = np.abs(delta[:, 0] * np.cos(rad) + delta[:, 1] * np.sin(rad))
+
+    # 对齐标注：两条尺寸界线原点的直线距离
+    mask = dimtype == DIM_ALIGNED
+    measurement[mask] = np.hypot(*(p3[mask] - p2[mask]).T)
+
+    # 两线角度标注：第一条线 defpoint2->defpoint3，第二条线 defpoint4->defpoint
+    mask = dimtype == DIM_ANGULAR
+    measurement[mask] = angle_between(p3[mask] - p2[mask], p0[mask] - p4[mask])
+    center[mask] = line_intersections(p2[mask], p3[mask], p4[mask], p0[mask])
+
+    # 三点角度标注：顶点为 defpoint4
+    mask = dimtype == DIM_ANGULAR_3P
+    measurement[mask] = angle_between(p2[mask] - p4[mask], p3[mask] - p4[mask])
+    center[mask] = p4[mask]
+
+    # 半径标注：defpoint 为圆心，defpoint4 为弦上点
+    mask = dimtype == DIM_RADIUS
+    measurement[mask] = np.hypot(*(p4[mask] - p0[mask]).T)
+    center[mask] = p0[mask]
+
+    # 直径标注：defpoint 与 defpoint4 为直径两端点，圆心取中点
+    mask = dimtype == DIM_DIAMETER
+    measurement[mask] = np.hypot(*(p4[mask] - p0[mask]).T)
+    center[mask] = (p0[mask] + p4[mask]) / 2
+
+    # 坐标标注：标注点相对原点的x或y坐标（标志位64表示x坐标标注）
+    mask = dimtype == DIM_ORDINATE
+    feature = p2[mask] - p0[mask]
+    is_x_type = (table["flags"][mask] & 64) != 0
+    measurement[mask] = np.abs(np.where(is_x_type, feature[:, 0], feature[:, 1]))
+
+    # 角度不乘比例因子，其余长度类标注乘 dimlfac
+    is_angle = np.isin(dimtype, [DIM_ANGULAR, DIM_ANGULAR_3P])
+    scaled = np.where(is_angle, measurement, measurement * table["dimlfac"])
+
+    # 有显式数字替代文字的以文字为准
+    override = np.array([parse_dimension_text(text) for text in table["text"]], dtype=np.float64).reshape(n)
+    value = np.where(np.isnan(override), scaled, override)
+
+    table["measurement"] = measurement
+    table["center"] = center
+    table["value"] = np.round(value, 2)
+    return table
+
+
+def angle_between(v1, v2):
+    """批量计算从v1逆时针转到v2的角度（度，0~360）"""
+    a1 = np.degrees(np.arctan2(v1[:, 1], v1[:, 0]))
+    a2 = np.degrees(np.arctan2(v2[:, 1], v2[:, 0]))
+    return np.mod(a2 - a1, 360.0)
+
+
+def line_intersections(a1, a2, b1, b2):
+    """批量求直线a1a2与直线b1b2的交点，平行时返回nan"""
+    d1 = a2 - a1
+    d2 = b2 - b1
+    denom = d1[:, 0] * d2[:, 1] - d1[:, 1] * d2[:, 0]
+    diff = b1 - a1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (diff[:, 0] * d2[:, 1] - diff[:, 1] * d2[:, 0]) / denom
+    t = np.where(np.abs(denom) < 1e-12, np.nan, t)
+    return a1 + d1 * t[:, None]
+
+
+def point_to_dict(point):
+    return {"x": float(point[0]), "y": float(point[1]), "z": float(point[2])}
+
+
+def dimension_records(table, dimtypes, rows=None):
+    """把标注表中指定类型的行（给出 rows 时只在这些行中取）转换成与 linear_dimensions.json 相同风格的字典列表"""
+    records = []
+    selected = np.isin(table["dimtype"], list(dimtypes))
+    rows = np.flatnonzero(selected) if rows is None else np.asarray(rows, dtype=np.int64)[selected[rows]]
+    for row in rows:
+        dimtype = int(table["dimtype"][row])
+        defpoints = table["defpoints"][row]
+        value = float(table["value"][row])
+        info = {
+            "type": DIMENSION_TYPE_NAMES[dimtype],
+            "handle": table["handle"][row],
+            "text": str(value),
+            "measurement": value,
+        }
+        if dimtype in LINEAR_TYPES:
+            info["start_point"] = point_to_dict(defpoints[1])
+            info["end_point"] = point_to_dict(defpoints[2])
+            info["dimension_line_position"] = point_to_dict(defpoints[0])
+        elif dimtype in {DIM_ANGULAR, DIM_ANGULAR_3P}:
+            info["angle"] = float(table["measurement"][row])
+            info["vertex"] = {"x": float(table["center"][row, 0]), "y": float(table["center"][row, 1])}
+            info["start_point"] = point_to_dict(defpoints[1])
+            info["end_point"] = point_to_dict(defpoints[2])
+            arc_location = defpoints[4] if dimtype == DIM_ANGULAR else defpoints[0]
+            info["dimension_line_position"] = point_to_dict(arc_location)
+        elif dimtype in {DIM_RADIUS, DIM_DIAMETER}:
+            key = "radius" if dimtype == DIM_RADIUS else "diameter"
+            info[key] = value
+            info["center"] = {"x": float(table["center"][row, 0]), "y": float(table["center"][row, 1])}
+            info["chord_point"] = point_to_dict(defpoints[3])
+        else:
+            info["feature_point"] = point_to_dict(defpoints[1])
+            info["leader_end_point"] = point_to_dict(defpoints[2])
+            info["origin"] = point_to_dict(defpoints[0])
+        records.append(info)
+    return records
+
+
+def save_to_json(data, output_filename):
+    try:
+        with open(output_filename, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        print(f"Dimensions successfully saved to {output_filename}")
+    except Exception as e:
+        print(f"An error occurred while saving to JSON: {e}")
+
+
+def extract_dimensions(dxf_file_path, linear_json_path, angle_json_path):
+    """一次读取图纸，线性标注与角度/半径/直径标注分别输出到两个JSON文件"""
+    try:
+        if not os.path.isfile(dxf_file_path):
+            raise FileNotFoundError(f"The file {dxf_file_path} does not exist.")
+        doc = ezdxf.readfile(dxf_file_path)
+    except FileNotFoundError as fnf_error:
+        print(fnf_error)
+        return None
+    except ezdxf.DXFStructureError as dxf_error:
+        print(f"DXFStructureError: {dxf_error}")
+        return None
+
+    table = build_dimension_table(doc)
+    save_to_json(dimension_records(table, LINEAR_TYPES), linear_json_path)
+    save_to_json(dimension_records(table, ANGLE_TYPES), angle_json_path)
+    return table
+
+
+if __name__ == "__main__":
+    # 示例用法
+    dxf_file_path = r"C:\Users\Lenovo\Desktop\水闸纵剖面图\cad解析\9#口门水工施工图.dxf"
+    extract_dimensions(dxf_file_path, 'linear_dimensions.json', 'angle_dimensions.json')
@@ -0,0 +1,156 @@
+import re
+import json
+import numpy as np
+import entity_store as es
+import spatial_index as si
+import text_index as ti
+import faces as fc
+
+# 版本说明：水闸剖面图上的标高符号（小三角形 + 数字）要和几何核对，以前没有提取，只能手动框选后人工读数。
+# 这里把尺寸接近字高的短线段（LINE、多段线、块展开出的几何）拼成闭合面，取其中的三角形作为标高符号，
+# 再用文字空间索引一次批量查找每个三角形附近的数字文字配对。三角形尖端的 y 为标高所在位置，
+# 结果按 y 排序成标高表，“某条线处的标高”用二分查找即可得到；同时按 y 与标高值线性拟合，
+# 偏离拟合直线的标高（写错或位置画错）单独列出。
+
+ELEVATION_PATTERN = re.compile(r"^\s*[▽▼]?\s*([-+±]?\d+(?:\.\d+)?)\s*[mM]?\s*$")
+
+# 三角形边长上限 = 该倍数 × 文字中位字高
+SYMBOL_SIZE_FACTOR = 3.0
+
+# 配对文字的搜索半径 = 该倍数 × 三角形大小
+TEXT_SEARCH_FACTOR = 2.5
+
+
+def parse_elevation(text):
+    match = ELEVATION_PATTERN.match(text or '')
+    if match is None:
+        return None
+    value = match.group(1)
+    # ±0.00 即 0
+    return float(value.lstrip('±'))
+
+
+def find_triangles(store, max_size, layer=None, bbox=None):
+    """在短线段拼成的闭合面中找三角形，返回 (k, 3, 2) 顶点数组"""
+    rows = es.query_entities(store, dxftype=['LINE', 'LWPOLYLINE', 'POLYLINE', 'INSERT'], layer=layer, bbox=bbox)
+    boxes = store["bbox"][rows]
+    small = (boxes[:, 2] - boxes[:, 0] <= max_size) & (boxes[:, 3] - boxes[:, 1] <= max_size)
+    ids = np.flatnonzero(np.isin(store["segment_row"], rows[small]))
+    segments = store["segments"][ids]
+    triangles = []
+    for face in fc.extract_faces(segments):
+        points = np.array(face["points"])
+        # 去掉共线的中间点（三角形的边可能被打断）
+        prev, nxt = np.roll(points, 1, axis=0), np.roll(points, -1, axis=0)
+        cross = (points[:, 0] - prev[:, 0]) * (nxt[:, 1] - points[:, 1]) - \
+                (points[:, 1] - prev[:, 1]) * (nxt[:, 0] - points[:, 0])
+        scale = np.hypot(*(nxt - prev).T).max() ** 2
+        corners = points[np.abs(cross) > 1e-6 * scale]
+        if len(corners) == 3:
+            triangles.append(corners)
+    return np.array(triangles).reshape(-1, 3, 2)
+
+
+def extract_elevations(store, layer=None, bbox=None):
+    """提取标高符号并与数字文字配对，返回按 y 排序的标高表"""
+    texts = store["texts"]
+    if len(texts["text"]) == 0:
+        return empty_table()
+    max_size = SYMBOL_SIZE_FACTOR * float(np.median(texts["height"]))
+    triangles = find_triangles(store, max_size, layer, bbox)
+    if len(triangles) == 0:
+        return empty_table()
+
+    # 尖端：离另外两点连线最远的那个顶点在竖直方向上单独的一个（倒三角的下尖、正三角的上尖）
+    ys = triangles[:, :, 1]
+    lone = np.argmax(np.abs(ys - np.median(ys, axis=1, keepdims=True)), axis=1)
+    tip = triangles[np.arange(len(triangles)), lone]
+    size = np.hypot(*(triangles.max(axis=1) - triangles.min(axis=1)).T)
+    center = triangles.mean(axis=1)
+
+    index = ti.build_text_index(store)
+    values = np.array([np.nan if v is None else v for v in map(parse_elevation, index["text"])])
+    tri_ids, text_ids, distance = si.query_radius_batch(index["spatial"], center, TEXT_SEARCH_FACTOR * size)
+    keep = ~np.isnan(values[text_ids])
+    tri_ids, text_ids, distance = tri_ids[keep], text_ids[keep], distance[keep]
+    # 每个三角形取最近的数字文字，同一文字只配给离它最近的三角形
+    order = np.lexsort((distance, tri_ids))
+    first = order[np.r_[True, tri_ids[order][1:] != tri_ids[order][:-1]]] if len(order) else order
+    tri_ids, text_ids, distance = tri_ids[first], text_ids[first], distance[first]
+    order = np.lexsort((distance, text_ids))
+    first = order[np.r_[True, text_ids[order][1:] != text_ids[order][:-1]]] if len(order) else order
+    tri_ids, text_ids = tri_ids[first], text_ids[first]
+
+    order = np.argsort(tip[tri_ids, 1], kind='stable')
+    tri_ids, text_ids = tri_ids[order], text_ids[order]
+    return {
+        "y": tip[tri_ids, 1],
+        "x": tip[tri_ids, 0],
+        "value": values[text_ids],
+        "text": [index["text"][i] for i in text_ids],
+        "handle": [index["handle"][i] for i in text_ids],
+        "triangle": triangles[tri_ids],
+    }
+
+
+def empty_table():
+    return {"y": np.zeros(0), "x": np.zeros(0), "value": np.zeros(0), "text": [], "handle": [],
+            "triangle": np.zeros((0, 3, 2))}
+
+
+def elevation_at(table, y, tol=None):
+    """二分查找 y 处的标高：在 tol 以内有标高符号时返回其标高，否则按相邻两个符号线性插值"""
+    ys, values = table["y"], table["value"]
+    if len(ys) == 0:
+        return None
+    pos = np.searchsorted(ys, y)
+    if tol is not None:
+        for k in (pos - 1, pos):
+            if 0 <= k < len(ys) and abs(ys[k] - y) <= tol:
+                return float(values[k])
+    if pos == 0 or pos == len(ys):
+        return None
+    lo, hi = pos - 1, pos
+    if ys[hi] == ys[lo]:
+        return float(values[lo])
+    return float(values[lo] + (values[hi] - values[lo]) * (y - ys[lo]) / (ys[hi] - ys[lo]))
+
+
+def check_elevations(table, tol=0.01):
+    """按 value = a * y + b 做稳健拟合（取两两斜率的中位数），列出偏离拟合直线超过 tol 的标高。
+    同一张图中不同比例的视图应分区域分别检查"""
+    ys, values = table["y"], table["value"]
+    if len(np.unique(ys)) < 2:
+        return None, []
+    i, j = np.triu_indices(len(ys), 1)
+    valid = ys[j] != ys[i]
+    slope = float(np.median((values[j] - values[i])[valid] / (ys[j] - ys[i])[valid]))
+    intercept = float(np.median(values - slope * ys))
+    residual = values - (slope * ys + intercept)
+    outliers = [{"text": table["text"][k], "handle": table["handle"][k], "y": float(ys[k]),
+                 "expected": round(float(slope * ys[k] + intercept), 3)}
+                for k in np.flatnonzero(np.abs(residual) > tol)]
+    return (slope, intercept), outliers
+
+
+def elevation_records(table):
+    return [{"value": float(table["value"][k]), "text": table["text"][k], "handle": table["handle"][k],
+             "location": [float(table["x"][k]), float(table["y"][k])]} for k in range(len(table["y"]))]
+
+
+def save_to_json(data, output_filename):
+    try:
+        with open(output_filename, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        print(f"Elevations successfully saved to {output_filename}")
+    except Exception as e:
+        print(f"An error occurred while saving to JSON: {e}")
+
+
+if __name__ == "__main__":
+    # 示例用法
+    dxf_file_path = r"C:\Users\Lenovo\Desktop\水闸纵剖面图\cad解析\剖面底板厚度.dxf"
+    store = es.load_entity_store(dxf_file_path)
+    if store is not None:
+        table = extract_elevations(store)
+        save_to_json(elevation_records(table), r"C:\\Users\\Lenovo\\Desktop\\水闸纵剖面图\\elevations.json")
@@ -0,0 +1,561 @@
+import ezdxf
+import os
+import json
+import numpy as np
+import mtext_decode as md
+from ezdxf import bbox as ezbbox
+from ezdxf import path as ezpath
+from ezdxf.colors import DXF_DEFAULT_COLORS, int2rgb
+
+# 版本说明：把模型空间一次读入按列存放的实体表（每个实体一行，行号即实体id），
+# 线类实体统一展开成线段表，文字单独成表（MTEXT 在加载时解码成纯文本）。加载时同时建立 颜色/图层/线型/实体类型 -> 行号 的倒排索引，
+# BYLAYER 颜色和线型通过图层表解析成实际值，
+# 这样“图层X上的绿色TEXT且在框内”这类查询只需对索引集合求交集，不用再逐个实体扫描。
+# INSERT 引用的块定义只解码一次（嵌套块同样缓存），同一个块的全部插入（含缩放、旋转、阵列）
+# 用一次批量矩阵乘法变换到模型空间，展开后的线段和文字记在对应INSERT的行号下。
+# 块内的 SOLID/TRACE/HATCH 展开成轮廓线段，其余不展开的内容用 ezdxf 的范围作为包围盒。
+# 圆弧、圆另外按行记下圆心、半径和起止角（store["arc"]），不必从展开后的线段反推。
+
+# 曲线（圆弧、圆、样条、带凸度的多段线）展开成线段时的最大弦高
+FLATTEN_DISTANCE = 0.5
+
+CURVE_TYPES = {'ARC', 'CIRCLE', 'ELLIPSE', 'SPLINE'}
+POLYLINE_TYPES = {'LWPOLYLINE', 'POLYLINE'}
+TEXT_TYPES = {'TEXT', 'MTEXT'}
+# 块内的填充类实体（箭头、标高符号常用 SOLID 画）只取轮廓线
+FILL_TYPES = {'SOLID', 'TRACE', '3DFACE', 'HATCH'}
+
+COLOR_NAMES = {
+    "red": 1,
+    "yellow": 2,
+    "green": 3,
+    "cyan": 4,
+    "blue": 5,
+    "magenta": 6,
+    "white": 7,
+}
+
+BYBLOCK = 0
+BYLAYER = 256
+
+# ACI 1~255 的默认RGB值，用于把真彩色归到最接近的ACI颜色号
+ACI_PALETTE = np.array([int2rgb(value) for value in DXF_DEFAULT_COLORS], dtype=np.float64)
+
+
+def nearest_aci(rgb):
+    """把RGB真彩色归到最接近的ACI颜色号（1~255）"""
+    distance = np.sum((ACI_PALETTE[1:] - np.asarray(rgb, dtype=np.float64)) ** 2, axis=1)
+    return int(np.argmin(distance)) + 1
+
+
+def read_layer_table(doc):
+    """读取图层表：图层名 -> (颜色号, 线型)"""
+    layers = {}
+    for layer in doc.layers:
+        color = abs(layer.dxf.get('color', 7))  # 关闭的图层颜色号为负
+        if layer.dxf.hasattr('true_color'):
+            color = nearest_aci(int2rgb(layer.dxf.true_color))
+        layers[layer.dxf.name] = (color, layer.dxf.get('linetype', 'Continuous'))
+    return layers
+
+
+def resolve_color(entity, layers):
+    """解析实体的实际ACI颜色号：真彩色取最接近的ACI，BYLAYER取图层颜色"""
+    if entity.dxf.hasattr('true_color'):
+        return nearest_aci(int2rgb(entity.dxf.true_color))
+    color = entity.dxf.get('color', BYLAYER)
+    if color == BYLAYER:
+        return layers.get(entity.dxf.get('layer', '0'), (7, None))[0]
+    if color == BYBLOCK:
+        return 7  # 模型空间中的BYBLOCK按白色处理
+    return color
+
+
+def resolve_linetype(entity, layers):
+    """解析实体的实际线型，BYLAYER取图层线型"""
+    linetype = entity.dxf.get('linetype', 'BYLAYER')
+    if linetype.upper() == 'BYLAYER':
+        return layers.get(entity.dxf.get('layer', '0'), (None, 'Continuous'))[1]
+    return linetype
+
+
+def entity_vertices(entity, flatten_distance=FLATTEN_DISTANCE):
+    """把线类实体转换成顶点序列(k, 2)，非线类实体返回None"""
+    dxftype = entity.dxftype()
+    if dxftype == 'LINE':
+        start, end = entity.dxf.start, entity.dxf.end
+        return np.array([[start.x, start.y], [end.x, end.y]])
+    if dxftype in POLYLINE_TYPES:
+        points = list(ezpath.make_path(entity).flattening(flatten_distance))
+    elif dxftype in CURVE_TYPES:
+        points = list(entity.flattening(flatten_distance))
+    else:
+        return None
+    if len(points) < 2:
+        return None
+    return np.array([(point.x, point.y) for point in points])
+
+
+def outline_vertices(entity, flatten_distance=FLATTEN_DISTANCE):
+    """填充类实体的轮廓，返回顶点序列(k, 2)的列表（HATCH 每条边界一个），其他实体返回空列表"""
+    dxftype = entity.dxftype()
+    if dxftype in {'SOLID', 'TRACE', '3DFACE'}:
+        outlines = [entity.vertices(close=True)]
+    elif dxftype == 'HATCH':
+        outlines = [list(path.flattening(flatten_distance)) for path in ezpath.from_hatch(entity)]
+    else:
+        return []
+    return [np.array([(point.x, point.y) for point in points]) for points in outlines if len(points) >= 2]
+
+
+def arc_parameters(entity):
+    """ARC/CIRCLE 在模型空间（WCS）中的 (圆心x, 圆心y, 半径, 逆时针起始角, 终止角)，角度为度，圆为 0~360。
+    拉伸方向为 (0, 0, -1) 的镜像圆弧按 x 取反换算"""
+    center = entity.dxf.center
+    radius = entity.dxf.radius
+    mirrored = entity.dxf.get('extrusion', (0, 0, 1))[2] < 0
+    x = -center.x if mirrored else center.x
+    if entity.dxftype() == 'CIRCLE':
+        return x, center.y, radius, 0.0, 360.0
+    start, end = entity.dxf.start_angle, entity.dxf.end_angle
+    if mirrored:
+        start, end = 180.0 - end, 180.0 - start
+    return x, center.y, radius, start % 360.0, end % 360.0
+
+
+def text_content(entity):
+    """读取TEXT/MTEXT的文字内容，MTEXT 解码成纯文本（按内容缓存）"""
+    if entity.dxftype() == 'MTEXT':
+        return md.decode_mtext_cached(entity.text)
+    return md.decode_special_chars(entity.dxf.get('text', ''))
+
+
+def text_box(entity, content):
+    """估算文字的包围盒（按插入点、字高和字数估算，不做字体排版）"""
+    insert = entity.dxf.insert
+    if entity.dxftype() == 'MTEXT':
+        height = entity.dxf.get('char_height', 2.5)
+        lines = content.split('\n') or ['']
+        width = entity.dxf.get('width', 0) or height * max(len(line) for line in lines)
+        # MTEXT 的插入点默认在左上角
+        return insert.x, insert.y - height * len(lines), insert.x + width, insert.y
+    height = entity.dxf.get('height', 2.5)
+    width = height * entity.dxf.get('width', 1.0) * len(content)
+    return insert.x, insert.y, insert.x + width, insert.y + height
+
+
+def build_inverted_index(values):
+    """建立 值 -> 行号数组（升序） 的倒排索引"""
+    values = np.asarray(values)
+    if len(values) == 0:
+        return {}
+    keys, inverse = np.unique(values, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.searchsorted(inverse[order], np.arange(len(keys) + 1))
+    return {key.item(): order[bounds[i]:bounds[i + 1]] for i, key in enumerate(keys)}
+
+
+def build_entity_store(doc, flatten_distance=FLATTEN_DISTANCE, expand_blocks=True):
+    """一次遍历模型空间，建立按列存放的实体表、线段表、文字表和倒排索引"""
+    layers = read_layer_table(doc)
+    msp = doc.modelspace()
+
+    handles, dxftypes, layer_names, colors, linetypes, block_names = [], [], [], [], [], []
+    vertex_blocks, vertex_rows = [], []
+    segment_blocks, segment_rows = [], []
+    text_rows, text_values, text_inserts, text_heights = [], [], [], []
+    arc_rows, arc_values = [], []
+    inserts = []
+
+    def add_text(row, entity):
+        content = text_content(entity)
+        insert = entity.dxf.insert
+        text_rows.append(row)
+        text_values.append(content)
+        text_inserts.append((insert.x, insert.y))
+        text_heights.append(entity.dxf.get('char_height' if entity.dxftype() == 'MTEXT' else 'height', 2.5))
+        x1, y1, x2, y2 = text_box(entity, content)
+        return np.array([[x1, y1], [x2, y2]])
+
+    for row, entity in enumerate(msp):
+        dxftype = entity.dxftype()
+        handles.append(entity.dxf.handle)
+        dxftypes.append(dxftype)
+        layer_names.append(entity.dxf.get('layer', '0'))
+        colors.append(resolve_color(entity, layers))
+        linetypes.append(resolve_linetype(entity, layers))
+        block_names.append(entity.dxf.name if dxftype == 'INSERT' else '')
+
+        try:
+            if dxftype in TEXT_TYPES:
+                vertices = add_text(row, entity)
+            elif dxftype == 'POINT':
+                location = entity.dxf.location
+                vertices = np.array([[location.x, location.y]])
+            elif dxftype == 'INSERT' and expand_blocks:
+                # 块内几何在遍历结束后按块名成批展开，属性文字直接进文字表
+                inserts.append((row, entity))
+                attrib_boxes = [add_text(row, attrib) for attrib in entity.attribs]
+                vertices = np.vstack(attrib_boxes) if attrib_boxes else None
+            else:
+                vertices = entity_vertices(entity, flatten_distance)
+                if dxftype in {'ARC', 'CIRCLE'}:
+                    arc_rows.append(row)
+                    arc_values.append(arc_parameters(entity))
+                if vertices is not None:
+                    segment_blocks.append(np.hstack([vertices[:-1], vertices[1:]]))
+                    segment_rows.append(np.full(len(vertices) - 1, row))
+                elif dxftype in {'INSERT', 'DIMENSION', 'HATCH'}:
+                    extents = ezbbox.extents([entity], fast=True)
+                    if extents.has_data:
+                        vertices = np.array([[extents.extmin.x, extents.extmin.y],
+                                             [extents.extmax.x, extents.extmax.y]])
+        except Exception as e:
+            print(f"Skipped geometry of {dxftype} {entity.dxf.handle}: {e}")
+            vertices = None
+
+        if vertices is not None:
+            vertex_blocks.append(vertices)
+            vertex_rows.append(np.full(len(vertices), row))
+
+    block_memo = {}
+    if inserts:
+        expanded = expand_inserts(doc, inserts, block_memo, flatten_distance)
+        segment_blocks.append(expanded["segments"])
+        segment_rows.append(expanded["segment_row"])
+        vertex_blocks.append(expanded["segments"][:, :2])
+        vertex_blocks.append(expanded["segments"][:, 2:])
+        vertex_rows.extend([expanded["segment_row"]] * 2)
+        text_rows.extend(expanded["text_row"])
+        text_values.extend(expanded["text"])
+        text_inserts.extend(map(tuple, expanded["insert"]))
+        text_heights.extend(expanded["height"])
+        vertex_blocks.append(expanded["insert"])
+        vertex_rows.append(expanded["text_row"])
+        # 展开后没有任何线段和文字的插入（块里只有图像、区域等不展开的实体）退回到 ezdxf 的范围
+        insert_rows = np.array([row for row, _ in inserts], dtype=np.int64)
+        empty = ~np.isin(insert_rows, np.concatenate(vertex_rows))
+        for row, entity in (inserts[k] for k in np.flatnonzero(empty)):
+            extents = ezbbox.extents([entity], fast=True)
+            if extents.has_data:
+                vertex_blocks.append(np.array([[extents.extmin.x, extents.extmin.y],
+                                               [extents.extmax.x, extents.extmax.y]]))
+                vertex_rows.append(np.full(2, row))
+
+    n = len(handles)
+    store = {
+        "handle": np.array(handles, dtype=object),
+        "dxftype": np.array(dxftypes, dtype=object),
+        "layer": np.array(layer_names, dtype=object),
+        "color": np.array(colors, dtype=np.int16),
+        "linetype": np.array(linetypes, dtype=object),
+        "block": np.array(block_names, dtype=object),
+        "bbox": compute_row_bboxes(n, vertex_blocks, vertex_rows),
+        "blocks": block_memo,
+    }
+    # 线段表、文字表都按实体行号排序，便于按行号二分查找
+    if segment_blocks:
+        segment_row = np.concatenate(segment_rows)
+        order = np.argsort(segment_row, kind='stable')
+        store["segments"] = np.vstack(segment_blocks)[order]
+        store["segment_row"] = segment_row[order]
+    else:
+        store["segments"] = np.zeros((0, 4))
+        store["segment_row"] = np.zeros(0, dtype=np.int64)
+    text_rows = np.array(text_rows, dtype=np.int64)
+    order = np.argsort(text_rows, kind='stable')
+    store["texts"] = {
+        "row": text_rows[order],
+        "text": [text_values[i] for i in order],
+        "insert": np.array(text_inserts, dtype=np.float64).reshape(-1, 2)[order],
+        "height": np.array(text_heights, dtype=np.float64)[order],
+    }
+    # 圆弧表：每行 (圆心x, 圆心y, 半径, 起始角, 终止角)，不是 ARC/CIRCLE 的行为nan
+    store["arc"] = np.full((n, 5), np.nan)
+    store["arc"][np.array(arc_rows, dtype=np.int64)] = np.array(arc_values, dtype=np.float64).reshape(-1, 5)
+    store["handle_row"] = {handle: row for row, handle in enumerate(handles)}
+    build_store_indexes(store)
+    return store
+
+
+def compute_row_bboxes(n, vertex_blocks, vertex_rows):
+    """按行号分组求每个实体的包围盒，没有几何的实体为nan"""
+    bbox = np.full((n, 4), np.nan)
+    if not vertex_blocks:
+        return bbox
+    rows = np.concatenate(vertex_rows)
+    order = np.argsort(rows, kind='stable')
+    vertices = np.vstack(vertex_blocks)[order]
+    rows = rows[order]
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    owner = rows[starts]
+    bbox[owner, 0] = np.minimum.reduceat(vertices[:, 0], starts)
+    bbox[owner, 1] = np.minimum.reduceat(vertices[:, 1], starts)
+    bbox[owner, 2] = np.maximum.reduceat(vertices[:, 0], starts)
+    bbox[owner, 3] = np.maximum.reduceat(vertices[:, 1], starts)
+    return bbox
+
+
+def empty_geometry():
+    return {
+        "segments": np.zeros((0, 4)),
+        "text": [],
+        "insert": np.zeros((0, 2)),
+        "height": np.zeros(0),
+    }
+
+
+def insert_transforms(inserts, base_point):
+    """批量构造一组INSERT的仿射变换 p' = A·p + t（含缩放、旋转和MINSERT阵列），
+    返回 A (K, 2, 2)、t (K, 2) 以及每个变换对应的INSERT序号"""
+    attribs = np.array([
+        (e.dxf.insert.x, e.dxf.insert.y, e.dxf.get('rotation', 0.0),
+         e.dxf.get('xscale', 1.0), e.dxf.get('yscale', 1.0),
+         e.dxf.get('column_count', 1), e.dxf.get('row_count', 1),
+         e.dxf.get('column_spacing', 0.0), e.dxf.get('row_spacing', 0.0))
+        for e in inserts
+    ], dtype=np.float64).reshape(-1, 9)
+    cols = np.maximum(attribs[:, 5].astype(np.int64), 1)
+    rows = np.maximum(attribs[:, 6].astype(np.int64), 1)
+    counts = cols * rows
+    owner = np.repeat(np.arange(len(attribs)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    a = attribs[owner]
+
+    # 阵列偏移在块的旋转坐标系中，不受缩放影响
+    offset = np.stack([local % cols[owner] * a[:, 7], local // cols[owner] * a[:, 8]], axis=1)
+    rad = np.radians(a[:, 2])
+    cos, sin = np.cos(rad), np.sin(rad)
+    rotation = np.stack([np.stack([cos, -sin], axis=1), np.stack([sin, cos], axis=1)], axis=1)
+    scale = a[:, 3:5]
+    A = rotation * scale[:, None, :]
+    # p' = insert + R·(offset + S·(p - base)) = A·p + insert + R·offset - A·base
+    base = np.array([base_point[0], base_point[1]], dtype=np.float64)
+    t = a[:, :2] + np.einsum('kij,kj->ki', rotation, offset) - A @ base
+    return A, t, owner
+
+
+def transform_geometry(geometry, A, t):
+    """把一份块几何一次矩阵乘法变换到全部K个插入位置"""
+    segments = geometry["segments"]
+    m = len(segments)
+    points = segments.reshape(-1, 2)
+    moved = np.einsum('kij,mj->kmi', A, points) + t[:, None, :]
+    inserts = np.einsum('kij,mj->kmi', A, geometry["insert"]) + t[:, None, :]
+    # 文字高度按块y方向的缩放比例变化
+    y_scale = np.hypot(A[:, 0, 1], A[:, 1, 1])
+    return {
+        "segments": moved.reshape(len(A) * m, 4),
+        "text": geometry["text"] * len(A),
+        "insert": inserts.reshape(-1, 2),
+        "height": (y_scale[:, None] * geometry["height"][None, :]).ravel(),
+    }
+
+
+def decode_block(doc, name, memo, flatten_distance=FLATTEN_DISTANCE, active=None):
+    """把块定义解码成块坐标系下的线段和文字，嵌套块按块名缓存，每个块只解码一次"""
+    if name in memo:
+        return memo[name]
+    active = set() if active is None else active
+    block = doc.blocks.get(name)
+    if block is None or name in active:
+        return empty_geometry()
+    active.add(name)
+
+    segment_blocks, texts, inserts_by_name = [], [], {}
+    for entity in block:
+        dxftype = entity.dxftype()
+        try:
+            if dxftype in TEXT_TYPES:
+                insert = entity.dxf.insert
+                height = entity.dxf.get('char_height' if dxftype == 'MTEXT' else 'height', 2.5)
+                texts.append((text_content(entity), insert.x, insert.y, height))
+            elif dxftype == 'INSERT':
+                inserts_by_name.setdefault(entity.dxf.name, []).append(entity)
+                for attrib in entity.attribs:
+                    insert = attrib.dxf.insert
+                    texts.append((text_content(attrib), insert.x, insert.y, attrib.dxf.get('height', 2.5)))
+            elif dxftype in FILL_TYPES:
+                for vertices in outline_vertices(entity, flatten_distance):
+                    segment_blocks.append(np.hstack([vertices[:-1], vertices[1:]]))
+            else:
+                vertices = entity_vertices(entity, flatten_distance)
+                if dxftype in {'ARC', 'CIRCLE'}:
+                    arc_rows.append(row)
+                    arc_values.append(arc_parameters(entity))
+                if vertices is not None:
+                    segment_blocks.append(np.hstack([vertices[:-1], vertices[1:]]))
+        except Exception as e:
+            print(f"Skipped geometry of {dxftype} in block {name}: {e}")
+
+    geometry = empty_geometry()
+    if segment_blocks:
+        geometry["segments"] = np.vstack(segment_blocks)
+    if texts:
+        geometry["text"] = [t[0] for t in texts]
+        geometry["insert"] = np.array([t[1:3] for t in texts], dtype=np.float64)
+        geometry["height"] = np.array([t[3] for t in texts], dtype=np.float64)
+
+    # 嵌套块：同名子块一次解码、一次批量变换
+    parts = [geometry]
+    for child_name, child_inserts in inserts_by_name.items():
+        child_block = doc.blocks.get(child_name)
+        if child_block is None:
+            continue
+        child = decode_block(doc, child_name, memo, flatten_distance, active)
+        A, t, _ = insert_transforms(child_inserts, child_block.block.dxf.base_point)
+        parts.append(transform_geometry(child, A, t))
+    geometry = {
+        "segments": np.vstack([p["segments"] for p in parts]),
+        "text": [text for p in parts for text in p["text"]],
+        "insert": np.vstack([p["insert"] for p in parts]),
+        "height": np.concatenate([p["height"] for p in parts]),
+    }
+    active.discard(name)
+    memo[name] = geometry
+    return geometry
+
+
+def expand_inserts(doc, inserts, memo, flatten_distance=FLATTEN_DISTANCE):
+    """展开模型空间中的INSERT：按块名分组，每个块解码一次，再对该块的全部插入做一次批量变换"""
+    groups = {}
+    for row, entity in inserts:
+        groups.setdefault(entity.dxf.name, []).append((row, entity))
+
+    segments, segment_rows = [np.zeros((0, 4))], [np.zeros(0, dtype=np.int64)]
+    texts, text_inserts, heights, text_rows = [], [np.zeros((0, 2))], [np.zeros(0)], [np.zeros(0, dtype=np.int64)]
+    for name, members in groups.items():
+        block = doc.blocks.get(name)
+        if block is None:
+            continue
+        geometry = decode_block(doc, name, memo, flatten_distance)
+        rows = np.array([row for row, _ in members], dtype=np.int64)
+        A, t, owner = insert_transforms([entity for _, entity in members], block.block.dxf.base_point)
+        moved = transform_geometry(geometry, A, t)
+        segments.append(moved["segments"])
+        segment_rows.append(np.repeat(rows[owner], len(geometry["segments"])))
+        texts.extend(moved["text"])
+        text_inserts.append(moved["insert"])
+        heights.append(moved["height"])
+        text_rows.append(np.repeat(rows[owner], len(geometry["text"])))
+    return {
+        "segments": np.vstack(segments),
+        "segment_row": np.concatenate(segment_rows),
+        "text": texts,
+        "insert": np.vstack(text_inserts),
+        "height": np.concatenate(heights),
+        "text_row": np.concatenate(text_rows),
+    }
+
+
+def build_store_indexes(store):
+    """为颜色、图层、线型、实体类型建立倒排索引。替换了实体表中的数组后也要调用，
+    同时丢掉 bbox_clip.drawing_hash 记下的旧哈希"""
+    store.pop("hash", None)
+    store["index"] = {
+        "color": build_inverted_index(store["color"]),
+        "layer": build_inverted_index(store["layer"].astype(str)),
+        "linetype": build_inverted_index(store["linetype"].astype(str)),
+        "dxftype": build_inverted_index(store["dxftype"].astype(str)),
+    }
+    return store
+
+
+def load_entity_store(filename, flatten_distance=FLATTEN_DISTANCE, expand_blocks=True):
+    try:
+        if not os.path.isfile(filename):
+            raise FileNotFoundError(f"The file {filename} does not exist.")
+        doc = ezdxf.readfile(filename)
+        return build_entity_store(doc, flatten_distance, expand_blocks)
+    except FileNotFoundError as fnf_error:
+        print(fnf_error)
+        return None
+    except ezdxf.DXFStructureError as dxf_error:
+        print(f"DXFStructureError: {dxf_error}")
+        return None
+
+
+def index_lookup(store, key, value):
+    """取一个索引条件对应的行号集合；value 可以是单个值或多个值"""
+    index = store["index"][key]
+    if key == "color" and isinstance(value, str):
+        value = COLOR_NAMES[value.lower()]
+    if isinstance(value, (list, tuple, set)):
+        parts = [index.get(v, np.zeros(0, dtype=np.int64)) for v in value]
+        return np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+    return index.get(value, np.zeros(0, dtype=np.int64))
+
+
+def bbox_overlaps(boxes, bbox):
+    """批量判断包围盒是否与查询框相交"""
+    min_x, min_y, max_x, max_y = bbox
+    return (boxes[:, 0] <= max_x) & (boxes[:, 2] >= min_x) & (boxes[:, 1] <= max_y) & (boxes[:, 3] >= min_y)
+
+
+def query_entities(store, dxftype=None, color=None, layer=None, linetype=None, bbox=None):
+    """按索引求交集查询实体行号，bbox 只在交集结果上做一次批量包围盒判断"""
+    rows = None
+    for key, value in (("dxftype", dxftype), ("color", color), ("layer", layer), ("linetype", linetype)):
+        if value is None:
+            continue
+        found = index_lookup(store, key, value)
+        rows = found if rows is None else np.intersect1d(rows, found, assume_unique=True)
+        if len(rows) == 0:
+            return rows
+    if rows is None:
+        rows = np.arange(len(store["handle"]))
+    if bbox is not None:
+        rows = rows[bbox_overlaps(store["bbox"][rows], bbox)]
+    return rows
+
+
+def entity_records(store, rows):
+    """把实体行转换成可以写入JSON的字典列表"""
+    texts = store["texts"]
+    segment_row = store["segment_row"]
+    records = []
+    for row in rows:
+        info = {
+            "type": store["dxftype"][row],
+            "handle": store["handle"][row],
+            "layer": store["layer"][row],
+            "color": int(store["color"][row]),
+            "linetype": store["linetype"][row],
+            "bbox": [float(v) for v in store["bbox"][row]],
+        }
+        t = np.searchsorted(texts["row"], row)
+        if t < len(texts["row"]) and texts["row"][t] == row:
+            info["text"] = texts["text"][t]
+            info["location"] = [float(v) for v in texts["insert"][t]]
+            info["height"] = float(texts["height"][t])
+        lo, hi = np.searchsorted(segment_row, [row, row + 1])
+        if hi > lo:
+            info["segments"] = store["segments"][lo:hi].tolist()
+        records.append(info)
+    return records
+
+
+def save_to_json(data, output_filename):
+    try:
+        with open(output_filename, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        print(f"Coordinates successfully saved to {output_filename}")
+    except Exception as e:
+        print(f"An error occurred while saving to JSON: {e}")
+
+
+def extract_green_annotations(dxf_file_path, output_json_path, layer=None, dxftype=None, bbox=None):
+    """提取绿色（ACI 3，含BYLAYER解析后为绿色）的标注实体并保存为JSON"""
+    store = load_entity_store(dxf_file_path)
+    if store is None:
+        return None
+    rows = query_entities(store, dxftype=dxftype, color="green", layer=layer, bbox=bbox)
+    records = entity_records(store, rows)
+    save_to_json(records, output_json_path)
+    return records
+
+
+if __name__ == "__main__":
+    # 示例用法
+    dxf_file_path = r"C:\Users\Lenovo\Desktop\水闸纵剖面图\cad解析\9#口门水工施工图.dxf"
+    extract_green_annotations(dxf_file_path, 'green_annotations.json')
@@ -0,0 +1,203 @@
+import json
+import numpy as np
+import entity_store as es
+import spatial_index as si
+import topology as tp
+
+# 版本说明：原来只有 is_closed 的 LWPOLYLINE 才计算面积，而剖面（例如 剖面底板厚度.dxf 中的底板）
+# 大多是用零散的 LINE 画的，真实面积一直算不出来。
+# 这里先把线段在交点、T形接头处打断，再按容差合并端点得到平面图，
+# 用半边结构（每个节点的出边按角度排序，next = 对边在终点处顺时针方向的下一条出边）找出全部最小闭合面，
+# 输出每个面的面积、周长和包围盒。主要步骤都是排序和数组运算，整张图纸 O(n log n)。
+
+# 面积小于该值的面视为退化面（重合线、极短线造成），不输出
+MIN_FACE_AREA = 1e-6
+
+
+def split_at_intersections(segments, tol=tp.SNAP_TOLERANCE):
+    """在交点和T形接头处打断线段，返回新线段以及每条新线段来自的原线段编号"""
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    m = len(segments)
+    if m == 0:
+        return segments, np.zeros(0, dtype=np.int64)
+    boxes = np.stack([np.minimum(segments[:, 0], segments[:, 2]) - tol,
+                      np.minimum(segments[:, 1], segments[:, 3]) - tol,
+                      np.maximum(segments[:, 0], segments[:, 2]) + tol,
+                      np.maximum(segments[:, 1], segments[:, 3]) + tol], axis=1)
+    pairs = si.overlapping_pairs(si.build_grid_index(boxes))
+    a, b = pairs[:, 0], pairs[:, 1]
+    p, r = segments[a, :2], segments[a, 2:] - segments[a, :2]
+    q, s = segments[b, :2], segments[b, 2:] - segments[b, :2]
+
+    cut_seg, cut_t = [], []
+    # 1. 非平行线段的真实交点
+    denom = r[:, 0] * s[:, 1] - r[:, 1] * s[:, 0]
+    diff = q - p
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (diff[:, 0] * s[:, 1] - diff[:, 1] * s[:, 0]) / denom
+        u = (diff[:, 0] * r[:, 1] - diff[:, 1] * r[:, 0]) / denom
+    crossing = (np.abs(denom) > 1e-12) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+    cut_seg.extend([a[crossing], b[crossing]])
+    cut_t.extend([t[crossing], u[crossing]])
+
+    # 2. 一条线段的端点落在另一条线段上（带容差的T形接头、共线重叠）
+    for host, other in ((a, b), (b, a)):
+        origin = segments[host, :2]
+        direction = segments[host, 2:] - origin
+        length2 = np.einsum('ij,ij->i', direction, direction)
+        for end in (segments[other, :2], segments[other, 2:]):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = np.einsum('ij,ij->i', end - origin, direction) / length2
+            foot = origin + direction * t[:, None]
+            on = (length2 > 0) & (t > 0) & (t < 1) & (np.hypot(*(end - foot).T) <= tol)
+            cut_seg.append(host[on])
+            cut_t.append(t[on])
+
+    cut_seg = np.concatenate(cut_seg + [np.arange(m), np.arange(m)])
+    cut_t = np.concatenate(cut_t + [np.zeros(m), np.ones(m)])
+    order = np.lexsort((cut_t, cut_seg))
+    cut_seg, cut_t = cut_seg[order], cut_t[order]
+    # 同一条线段上相邻的两个打断点之间为一条新线段
+    same = cut_seg[1:] == cut_seg[:-1]
+    owner = cut_seg[:-1][same]
+    t0, t1 = cut_t[:-1][same], cut_t[1:][same]
+    start = segments[owner, :2] + (segments[owner, 2:] - segments[owner, :2]) * t0[:, None]
+    end = segments[owner, :2] + (segments[owner, 2:] - segments[owner, :2]) * t1[:, None]
+    pieces = np.hstack([start, end])
+    keep = np.hypot(*(end - start).T) > tol
+    return pieces[keep], owner[keep]
+
+
+def trace_half_edges(nodes, edges):
+    """由无向边建立半边结构并找出全部环，返回每条半边所在的环编号、next 指针和半边的起终点"""
+    # 去掉自环和重复边
+    edges = np.sort(edges, axis=1)
+    edges = np.unique(edges[edges[:, 0] != edges[:, 1]], axis=0)
+    k = len(edges)
+    origin = np.concatenate([edges[:, 0], edges[:, 1]])
+    target = np.concatenate([edges[:, 1], edges[:, 0]])
+    twin = np.concatenate([np.arange(k, 2 * k), np.arange(k)])
+    vec = nodes[target] - nodes[origin]
+    angle = np.arctan2(vec[:, 1], vec[:, 0])
+
+    # 按起点、角度排序，得到每个节点周围逆时针排列的出边
+    order = np.lexsort((angle, origin))
+    position = np.empty(2 * k, dtype=np.int64)
+    position[order] = np.arange(2 * k)
+    counts = np.bincount(origin, minlength=len(nodes))
+    first = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    # next(h)：到达终点后，取对边在终点出边中顺时针方向的下一条，面始终在行进方向左侧
+    t = twin
+    node = origin[t]
+    slot = position[t] - first[node]
+    next_slot = (slot - 1) % counts[node]
+    nxt = order[first[node] + next_slot]
+
+    # 指针倍增求每个环中最小的半边编号作为环编号
+    label = np.arange(2 * k)
+    jump = nxt.copy()
+    for _ in range(int(np.ceil(np.log2(max(2 * k, 2)))) + 1):
+        label = np.minimum(label, label[jump])
+        jump = jump[jump]
+    return label, nxt, origin, target
+
+
+def polygon_contains(polygon, point):
+    """射线法判断点是否在多边形内"""
+    x, y = point
+    xi, yi = polygon[:, 0], polygon[:, 1]
+    xj, yj = np.roll(xi, 1), np.roll(yi, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cross = ((yi > y) != (yj > y)) & (x < (xj - xi) * (y - yi) / (yj - yi) + xi)
+    return bool(np.count_nonzero(cross) % 2)
+
+
+def extract_faces(segments, tol=tp.SNAP_TOLERANCE, min_area=MIN_FACE_AREA):
+    """从线段中提取全部最小闭合面，返回面列表（面积已扣除内部孤岛）"""
+    pieces, owner = split_at_intersections(segments, tol)
+    topology = tp.build_segment_topology(pieces, tol)
+    nodes = topology["nodes"]
+    label, nxt, origin, target = trace_half_edges(nodes, topology["edges"])
+    if len(label) == 0:
+        return []
+
+    faces_id, face_of = np.unique(label, return_inverse=True)
+    x0, y0 = nodes[origin, 0], nodes[origin, 1]
+    x1, y1 = nodes[target, 0], nodes[target, 1]
+    signed_area = np.bincount(face_of, x0 * y1 - x1 * y0) / 2
+    # 面内的悬挂边两侧的半边属于同一个面，不计入周长（半边 h 与 h ± k 互为对边）
+    half = len(label) // 2
+    twin = np.concatenate([np.arange(half, 2 * half), np.arange(half)])
+    perimeter = np.bincount(face_of, np.hypot(x1 - x0, y1 - y0) * (label[twin] != label))
+    order = np.argsort(face_of, kind='stable')
+    starts = np.searchsorted(face_of[order], np.arange(len(faces_id)))
+    bbox = np.stack([np.minimum.reduceat(x0[order], starts), np.minimum.reduceat(y0[order], starts),
+                     np.maximum.reduceat(x0[order], starts), np.maximum.reduceat(y0[order], starts)], axis=1)
+
+    def ring(face):
+        """沿 next 指针取出环的顶点序列"""
+        start = h = int(faces_id[face])
+        points = []
+        while True:
+            points.append(nodes[origin[h]])
+            h = int(nxt[h])
+            if h == start:
+                return np.array(points)
+
+    bounded = np.flatnonzero(signed_area > min_area)
+    outer = np.flatnonzero(signed_area < -min_area)
+    faces = []
+    rings = {}
+    for face in bounded:
+        rings[face] = ring(face)
+        faces.append({
+            "area": float(signed_area[face]),
+            "net_area": float(signed_area[face]),
+            "perimeter": float(perimeter[face]),
+            "bbox": bbox[face].tolist(),
+            "points": rings[face].tolist(),
+            "holes": [],
+        })
+
+    # 连通块的外边界（负面积环）落在另一个连通块的某个面内部时是该面的孤岛，从所在最小的面中扣除
+    component = tp.component_labels(topology)
+    face_component = component[origin[faces_id]]
+    face_index = {face: i for i, face in enumerate(bounded)}
+    bounded_boxes = bbox[bounded]
+    for hole in outer:
+        point = nodes[origin[int(faces_id[hole])]]
+        inside_box = (bounded_boxes[:, 0] <= point[0]) & (bounded_boxes[:, 2] >= point[0]) & \
+                     (bounded_boxes[:, 1] <= point[1]) & (bounded_boxes[:, 3] >= point[1])
+        candidates = [face for face in bounded[inside_box]
+                      if face_component[face] != face_component[hole]
+                      and polygon_contains(rings[face], point)]
+        if candidates:
+            host = min(candidates, key=lambda f: signed_area[f])
+            faces[face_index[host]]["net_area"] += float(signed_area[hole])
+            faces[face_index[host]]["holes"].append(bbox[hole].tolist())
+    return faces
+
+
+def extract_faces_from_store(store, layer=None, bbox=None, tol=tp.SNAP_TOLERANCE):
+    """按图层/范围从实体表取线段并提取闭合面"""
+    rows = es.query_entities(store, dxftype=list(tp.LINEWORK_TYPES), layer=layer, bbox=bbox)
+    segments = store["segments"][np.isin(store["segment_row"], rows)]
+    return extract_faces(segments, tol)
+
+
+def save_to_json(data, output_filename):
+    try:
+        with open(output_filename, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        print(f"Faces successfully saved to {output_filename}")
+    except Exception as e:
+        print(f"An error occurred while saving to JSON: {e}")
+
+
+if __name__ == "__main__":
+    # 示例用法
+    dxf_file_path = r"C:\Users\Lenovo\Desktop\水闸纵剖面图\cad解析\剖面底板厚度.dxf"
+    store = es.load_entity_store(dxf_file_path)
+    if store is not None:
+        faces = extract_faces_from_store(store, layer='SG001轮廓')
+        save_to_json(faces, r"C:\\Users\\Lenovo\\Desktop\\水闸纵剖面图\\faces.json")
@@ -0,0 +1,88 @@
+import re
+from functools import lru_cache
+
+# 版本说明：MTEXT 的 entity.text 带有内联格式码（\P 换段、\f...; 字体、{\H...} 字高、\S...; 堆叠分数等），
+# 在加载时一次解码成纯文本并按原始内容缓存，后续的文字检索和匹配直接用干净的字符串，
+# 不用每次查询再做正则剥离。TEXT 里的 %%c、%%d、%%p 特殊字符也在这里一并转换。
+
+# 一次匹配所有需要处理的 MTEXT 控制序列
+MTEXT_TOKEN = re.compile(
+    r"\\[PN]"                           # 换段 / 分栏
+    r"|\\S(?P<stack>[^;]*);"            # 堆叠分数 \Sa^b; \Sa/b; \Sa#b;
+    r"|\\U\+(?P<unicode>[0-9A-Fa-f]{4})"  # Unicode 字符
+    r"|\\M\+[0-9A-Fa-f]{5}"             # 多字节字符（按代码页编码，无法还原，直接去掉）
+    r"|\\[fFHWQTACcp][^;]*;"            # 带参数的格式码：字体、字高、宽度、倾斜、间距、对齐、颜色、段落
+    r"|\\[LlOoKkX]"                     # 下划线 / 上划线 / 删除线开关
+    r"|\\~"                             # 不间断空格
+    r"|\\(?P<escaped>[\\{}])"           # 转义的反斜杠和大括号
+    r"|[{}]"                            # 格式分组
+)
+
+SPECIAL_CHARS = re.compile(r"%%([cCdDpPuUoO%]|\d{3})")
+
+SPECIAL_CHAR_MAP = {
+    'c': 'Ø',
+    'd': '°',
+    'p': '±',
+    'u': '',
+    'o': '',
+    '%': '%',
+}
+
+# 堆叠分数前的占位符：格式码全部去掉后，紧跟在数字后面的分数前补一个空格（1\S1/2; -> 1 1/2，而不是 11/2）
+STACK_MARK = '\x00'
+STACK_AFTER_DIGIT = re.compile(r"(?<=\d)\x00")
+
+# 已解码的 MTEXT 缓存条数。按原始内容缓存（不同图纸的句柄会重复），批量处理很多图纸时也不会无限增长
+MTEXT_CACHE_SIZE = 4096
+
+
+def replace_special_char(match):
+    code = match.group(1)
+    if code.isdigit():
+        return chr(int(code))
+    return SPECIAL_CHAR_MAP[code.lower()]
+
+
+def decode_special_chars(text):
+    """转换 %%c、%%d、%%p 等控制码"""
+    if '%%' not in text:
+        return text
+    return SPECIAL_CHARS.sub(replace_special_char, text)
+
+
+def replace_mtext_token(match):
+    token = match.group(0)
+    if token in ('\\P', '\\N'):
+        return '\n'
+    if token == '\\~':
+        return ' '
+    if match.group('escaped'):
+        return match.group('escaped')
+    if match.group('unicode'):
+        return chr(int(match.group('unicode'), 16))
+    stack = match.group('stack')
+    if stack is not None:
+        # 分数、公差、斜分数统一规范成 “分子/分母”
+        parts = re.split(r"[\^/#]", stack, maxsplit=1)
+        if len(parts) == 2:
+            return f"{STACK_MARK}{parts[0].strip()}/{parts[1].strip()}"
+        return STACK_MARK + stack
+    return ''
+
+
+def decode_mtext(raw):
+    """把 MTEXT 原始内容解码成纯文本，各段之间以换行分隔"""
+    if not raw:
+        return ''
+    text = MTEXT_TOKEN.sub(replace_mtext_token, raw)
+    text = STACK_AFTER_DIGIT.sub(' ', text).replace(STACK_MARK, '')
+    text = decode_special_chars(text)
+    lines = [line.strip() for line in text.split('\n')]
+    return '\n'.join(line for line in lines if line)
+
+
+@lru_cache(maxsize=MTEXT_CACHE_SIZE)
+def decode_mtext_cached(raw):
+    """带 LRU 缓存的 decode_mtext，相同的原始内容只解码一次"""
+    return decode_mtext(raw)
@@ -0,0 +1,212 @@
+import os
+import json
+import cv2
+import numpy as np
+from multiprocessing import Pool
+import entity_store as es
+
+# 版本说明：项目目标是用 AI 审图，但提取出的 DXF 几何没有办法渲染成图片做训练样本。
+# 实体表里直线、多段线、圆弧、样条（已按 flatten_distance 展平）都已经是一张线段表，文字有插入点和字高，
+# 这里把线段和文字框一次性换算到像素坐标，按固定大小的块批量分配（向量化展开每条线段覆盖的块），
+# 每块只调用一次 cv2.polylines 画出全部线段、一次画出全部文字框，不逐个实体调用绘图函数。
+# 每块输出一张 PNG 和一个对齐的标注 JSON（块内像素坐标下的线段、所属实体句柄/类型、文字框和文字），多进程并行渲染。
+
+# 块大小（像素）
+TILE_SIZE = 512
+
+# 相邻块之间的重叠（像素）
+TILE_OVERLAP = 0
+
+# 未指定分辨率时，整张图长边对应的像素数
+DEFAULT_LONG_SIDE = 8192
+
+LINE_THICKNESS = 1
+
+# cv2 绘图的亚像素位数：坐标乘 2**SHIFT 取整后传入，线段端点不被取整到整像素
+SHIFT = 4
+
+
+def text_boxes(store, rows=None):
+    """每条文字的包围盒 (t, 4) 和文字行号。单独的 TEXT/MTEXT 取实体表里的包围盒，
+    块内的文字（行号是 INSERT）按插入点、字高和字数估算"""
+    texts = store["texts"]
+    ids = np.arange(len(texts["row"])) if rows is None else np.flatnonzero(np.isin(texts["row"], rows))
+    row = texts["row"][ids]
+    insert, height = texts["insert"][ids], texts["height"][ids]
+    length = np.array([max(len(texts["text"][i]), 1) for i in ids], dtype=np.float64)
+    estimated = np.stack([insert[:, 0], insert[:, 1], insert[:, 0] + height * length, insert[:, 1] + height], axis=1)
+    own = np.isin(store["dxftype"][row], list(es.TEXT_TYPES)) if len(row) else np.zeros(0, dtype=bool)
+    boxes = np.where(own[:, None], store["bbox"][row], estimated) if len(row) else estimated.reshape(-1, 4)
+    return boxes, ids
+
+
+def drawing_extent(store, bbox=None):
+    if bbox is not None:
+        return np.asarray(bbox, dtype=np.float64)
+    boxes = store["bbox"][~np.isnan(store["bbox"]).any(axis=1)]
+    return np.array([boxes[:, 0].min(), boxes[:, 1].min(), boxes[:, 2].max(), boxes[:, 3].max()])
+
+
+def pixel_scale(extent, long_side=DEFAULT_LONG_SIDE):
+    """整张图长边缩放到 long_side 像素时每个图纸单位对应的像素数"""
+    return long_side / max(extent[2] - extent[0], extent[3] - extent[1])
+
+
+def to_pixels(points, extent, pixels_per_unit):
+    """图纸坐标 -> 像素坐标（原点在范围左上角，y 轴向下）"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return np.stack([(points[:, 0] - extent[0]) * pixels_per_unit,
+                     (extent[3] - points[:, 1]) * pixels_per_unit], axis=1)
+
+
+def draw_geometry(image, segments, boxes, thickness=LINE_THICKNESS):
+    """一次 polylines 画出全部线段，一次画出全部文字框（坐标为 image 内的像素坐标）"""
+    factor = 1 << SHIFT
+    if len(segments):
+        lines = np.round(segments * factor).astype(np.int32).reshape(-1, 2, 2)
+        cv2.polylines(image, lines, False, 0, thickness, cv2.LINE_8, SHIFT)
+    if len(boxes):
+        x0, y0, x1, y1 = boxes.T
+        corners = np.stack([x0, y0, x1, y0, x1, y1, x0, y1], axis=1)
+        rectangles = np.round(corners * factor).astype(np.int32).reshape(-1, 4, 2)
+        cv2.polylines(image, rectangles, True, 0, thickness, cv2.LINE_8, SHIFT)
+    return image
+
+
+def render_image(store, pixels_per_unit=None, bbox=None, dxftype=None, layer=None, thickness=LINE_THICKNESS,
+                 draw_text=True):
+    """把实体表渲染成一整张灰度图（白底黑线），返回 (图像, 范围, 每单位像素数)"""
+    extent = drawing_extent(store, bbox)
+    if pixels_per_unit is None:
+        pixels_per_unit = pixel_scale(extent)
+    width = int(np.ceil((extent[2] - extent[0]) * pixels_per_unit)) + 1
+    height = int(np.ceil((extent[3] - extent[1]) * pixels_per_unit)) + 1
+    rows = es.query_entities(store, dxftype=dxftype, layer=layer, bbox=bbox)
+    segments = store["segments"][np.isin(store["segment_row"], rows)]
+    image = np.full((height, width), 255, dtype=np.uint8)
+    boxes = text_boxes(store, rows)[0] if draw_text else np.zeros((0, 4))
+    pixel_boxes = to_pixels(boxes[:, [0, 3, 2, 1]].reshape(-1, 2), extent, pixels_per_unit).reshape(-1, 4)
+    draw_geometry(image, to_pixels(segments.reshape(-1, 2), extent, pixels_per_unit).reshape(-1, 4),
+                  pixel_boxes, thickness)
+    return image, extent, pixels_per_unit
+
+
+def assign_tiles(boxes, tile_size, overlap, n_cols, n_rows):
+    """像素包围盒 (n, 4) 批量展开到它覆盖的全部块，返回 (成员编号, 块编号)，块编号 = 行 * n_cols + 列"""
+    stride = tile_size - overlap
+    c0 = np.clip(np.floor((boxes[:, 0] - overlap) / stride).astype(np.int64), 0, n_cols - 1)
+    c1 = np.clip(np.floor(boxes[:, 2] / stride).astype(np.int64), 0, n_cols - 1)
+    r0 = np.clip(np.floor((boxes[:, 1] - overlap) / stride).astype(np.int64), 0, n_rows - 1)
+    r1 = np.clip(np.floor(boxes[:, 3] / stride).astype(np.int64), 0, n_rows - 1)
+    ncol = c1 - c0 + 1
+    counts = ncol * (r1 - r0 + 1)
+    item = np.repeat(np.arange(len(boxes)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    tile = (r0[item] + local // ncol[item]) * n_cols + c0[item] + local % ncol[item]
+    return item, tile
+
+
+def render_tile(task):
+    """进程池中渲染一块并写出 PNG 和标注 JSON，返回该块的索引记录"""
+    name, origin, tile_size, segments, labels, boxes, texts, thickness, output_dir, world_bbox = task
+    image = np.full((tile_size, tile_size), 255, dtype=np.uint8)
+    segments = segments - np.tile(origin, 2)
+    boxes = boxes - np.tile(origin, 2)
+    draw_geometry(image, segments, boxes, thickness)
+    cv2.imwrite(os.path.join(output_dir, name + '.png'), image)
+    annotation = {
+        "tile": name,
+        "origin": [float(v) for v in origin],
+        "bbox": world_bbox,
+        "segments": np.round(segments, 2).tolist(),
+        "handles": labels["handle"],
+        "dxftypes": labels["dxftype"],
+        "layers": labels["layer"],
+        "text_boxes": np.round(boxes, 2).tolist(),
+        "texts": texts,
+    }
+    with open(os.path.join(output_dir, name + '.json'), 'w', encoding='utf-8') as f:
+        json.dump(annotation, f, ensure_ascii=False, separators=(',', ':'))
+    return {"tile": name, "bbox": world_bbox, "segments": len(segments), "texts": len(texts)}
+
+
+def render_tiles(store, output_dir, pixels_per_unit=None, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, bbox=None,
+                 dxftype=None, layer=None, thickness=LINE_THICKNESS, skip_empty=True, processes=None):
+    """把实体表渲染成固定大小的块（PNG + 对齐的标注 JSON），多进程并行，返回块索引列表并写出 tiles.json"""
+    extent = drawing_extent(store, bbox)
+    if pixels_per_unit is None:
+        pixels_per_unit = pixel_scale(extent)
+    width = (extent[2] - extent[0]) * pixels_per_unit
+    height = (extent[3] - extent[1]) * pixels_per_unit
+    stride = tile_size - overlap
+    n_cols = max(int(np.ceil((width - overlap) / stride)), 1)
+    n_rows = max(int(np.ceil((height - overlap) / stride)), 1)
+
+    rows = es.query_entities(store, dxftype=dxftype, layer=layer, bbox=bbox)
+    seg_ids = np.flatnonzero(np.isin(store["segment_row"], rows))
+    segments = to_pixels(store["segments"][seg_ids].reshape(-1, 2), extent, pixels_per_unit).reshape(-1, 4)
+    seg_boxes = np.stack([np.minimum(segments[:, 0], segments[:, 2]), np.minimum(segments[:, 1], segments[:, 3]),
+                          np.maximum(segments[:, 0], segments[:, 2]), np.maximum(segments[:, 1], segments[:, 3])],
+                         axis=1)
+    world_boxes, text_ids = text_boxes(store, rows)
+    boxes = to_pixels(world_boxes[:, [0, 3, 2, 1]].reshape(-1, 2), extent, pixels_per_unit).reshape(-1, 4)
+
+    # 线段和文字框批量分配到块，按块编号排序后每块取一段
+    seg_item, seg_tile = assign_tiles(seg_boxes, tile_size, overlap, n_cols, n_rows)
+    box_item, box_tile = assign_tiles(boxes, tile_size, overlap, n_cols, n_rows)
+    seg_order = np.argsort(seg_tile, kind='stable')
+    box_order = np.argsort(box_tile, kind='stable')
+    seg_item, seg_tile = seg_item[seg_order], seg_tile[seg_order]
+    box_item, box_tile = box_item[box_order], box_tile[box_order]
+    all_tiles = np.arange(n_rows * n_cols)
+    seg_bounds = np.searchsorted(seg_tile, np.r_[all_tiles, len(all_tiles)])
+    box_bounds = np.searchsorted(box_tile, np.r_[all_tiles, len(all_tiles)])
+
+    segment_rows = store["segment_row"][seg_ids]
+    texts = store["texts"]
+    os.makedirs(output_dir, exist_ok=True)
+
+    def tasks():
+        for tile in all_tiles:
+            s = seg_item[seg_bounds[tile]:seg_bounds[tile + 1]]
+            b = box_item[box_bounds[tile]:box_bounds[tile + 1]]
+            if skip_empty and len(s) == 0 and len(b) == 0:
+                continue
+            r, c = divmod(int(tile), n_cols)
+            origin = np.array([c * stride, r * stride], dtype=np.float64)
+            x0 = extent[0] + origin[0] / pixels_per_unit
+            y1 = extent[3] - origin[1] / pixels_per_unit
+            world_bbox = [float(x0), float(y1 - tile_size / pixels_per_unit),
+                          float(x0 + tile_size / pixels_per_unit), float(y1)]
+            entity = segment_rows[s]
+            labels = {
+                "handle": store["handle"][entity].tolist(),
+                "dxftype": store["dxftype"][entity].tolist(),
+                "layer": store["layer"][entity].tolist(),
+            }
+            yield (f"tile_{r}_{c}", origin, tile_size, segments[s], labels, boxes[b],
+                   [texts["text"][text_ids[i]] for i in b], thickness, output_dir, world_bbox)
+
+    with Pool(processes) as pool:
+        index = list(pool.imap(render_tile, tasks(), chunksize=8))
+    meta = {"extent": extent.tolist(), "pixels_per_unit": pixels_per_unit, "tile_size": tile_size,
+            "overlap": overlap, "tiles": index}
+    save_to_json(meta, os.path.join(output_dir, 'tiles.json'))
+    return meta
+
+
+def save_to_json(data, output_filename):
+    try:
+        with open(output_filename, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        print(f"Tiles successfully saved to {output_filename}")
+    except Exception as e:
+        print(f"An error occurred while saving to JSON: {e}")
+
+
+if __name__ == "__main__":
+    # 示例用法：整张图渲染成 512x512 的训练块
+    dxf_file_path = r"C:\Users\Lenovo\Desktop\水闸纵剖面图\cad解析\剖面底板厚度.dxf"
+    store = es.load_entity_store(dxf_file_path)
+    if store is not None:
+        render_tiles(store, r"C:\Users\Lenovo\Desktop\水闸纵剖面图\tiles")
@@ -0,0 +1,210 @@
+import re
+import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import entity_store as es
+import spatial_index as si
+import topology as tp
+
+# 版本说明：每个脚本开头都是 input("Enter xmin, ymin, xmax, ymax")，要人先在图上把每个视图的范围找出来。
+# 这里在实体表上做网格密度聚类：实体包围盒登记到均匀网格，占用数达到阈值的网格为稠密网格，
+# 相距不超过 gap 个网格的稠密网格连成一片，每一片就是一个候选视图/剖面/图签区域。
+# 再根据区域内的文字给区域打标签（剖面、平面、立面、说明、图签），输出带标签的候选包围盒，
+# 整张图纸可以无人值守地按视图并行处理。
+
+# 包围盒宽或高超过图纸范围该比例的实体视为图框，不参与聚类
+FRAME_FRACTION = 0.6
+
+# 默认网格数（图纸长边方向）
+GRID_RESOLUTION = 200
+
+TITLE_KEYWORDS = ('设计', '审核', '校核', '审定', '制图', '图名', '图号', '比例', '日期', '批准')
+
+# 图框只可能是多段线或图框块
+FRAME_TYPES = es.POLYLINE_TYPES | {'INSERT'}
+LABEL_PATTERNS = [
+    ("section", re.compile(r"剖面|断面|剖视|([A-Z0-9])\s*[-－—]\s*\1")),
+    ("plan", re.compile(r"平面")),
+    ("elevation", re.compile(r"立面|纵剖|侧视")),
+    ("detail", re.compile(r"详图|大样")),
+    ("notes", re.compile(r"说明|注[:：]")),
+]
+
+
+def cluster_cells(keys, gap):
+    """稠密网格按切比雪夫距离 gap 连通，返回每个网格所属的簇编号"""
+    n = len(keys)
+    pair_i, pair_j = [], []
+    for dx in range(-gap, gap + 1):
+        for dy in range(-gap, gap + 1):
+            if (dx, dy) <= (0, 0):
+                continue
+            wanted = keys + dx * si.KEY_STRIDE + dy
+            pos = np.minimum(np.searchsorted(keys, wanted), n - 1)
+            found = keys[pos] == wanted
+            pair_i.append(np.flatnonzero(found))
+            pair_j.append(pos[found])
+    labels = tp.connected_labels(n, np.concatenate(pair_i), np.concatenate(pair_j))
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def label_region(texts):
+    """按区域内的文字判断区域类型，返回 (标签, 标题文字)"""
+    joined = " ".join(texts)
+    if sum(keyword in joined for keyword in TITLE_KEYWORDS) >= 2:
+        return "title_block", None
+    for label, pattern in LABEL_PATTERNS:
+        for text in texts:
+            if pattern.search(text):
+                return label, text
+    return "view", None
+
+
+def attach_captions(regions):
+    """以文字为主的小区域（图名、比例）与离它最近的无标签视图合并，视图取得图名作为标签"""
+    views = [r for r in regions if not r["caption"]]
+    result = list(views)
+    if views:
+        boxes = np.array([r["bbox"] for r in views])
+    for region in regions:
+        if not region["caption"]:
+            continue
+        host = None
+        if views and region["label"] not in ("view", "title_block"):
+            x0, y0, x1, y1 = region["bbox"]
+            dx = np.maximum(np.maximum(boxes[:, 0] - x1, x0 - boxes[:, 2]), 0)
+            dy = np.maximum(np.maximum(boxes[:, 1] - y1, y0 - boxes[:, 3]), 0)
+            distance = np.hypot(dx, dy)
+            # 图名离视图的距离不超过图名自身的宽度
+            candidates = np.flatnonzero((distance <= x1 - x0) & np.array([v["label"] == "view" for v in views]))
+            if len(candidates):
+                host = views[candidates[np.argmin(distance[candidates])]]
+        if host is None:
+            result.append(region)
+            continue
+        host["label"], host["title"] = region["label"], region["title"]
+        host["bbox"] = [min(host["bbox"][0], region["bbox"][0]), min(host["bbox"][1], region["bbox"][1]),
+                        max(host["bbox"][2], region["bbox"][2]), max(host["bbox"][3], region["bbox"][3])]
+        host["handles"] += region["handles"]
+        host["entity_count"] += region["entity_count"]
+    for region in result:
+        region.pop("caption")
+    return result
+
+
+def discover_regions(store, cell_size=None, gap=2, min_count=1, min_entities=5, frame_fraction=FRAME_FRACTION):
+    """对实体表做网格密度聚类，返回带标签的候选区域列表（按面积从大到小）"""
+    bboxes = store["bbox"]
+    rows = np.flatnonzero(~np.isnan(bboxes).any(axis=1))
+    if len(rows) == 0:
+        return []
+    boxes = bboxes[rows]
+    sheet = np.array([boxes[:, 0].min(), boxes[:, 1].min(), boxes[:, 2].max(), boxes[:, 3].max()])
+    width, height = sheet[2] - sheet[0], sheet[3] - sheet[1]
+    frame = np.isin(store["dxftype"][rows], list(FRAME_TYPES)) & \
+        (((boxes[:, 2] - boxes[:, 0]) > frame_fraction * width) |
+         ((boxes[:, 3] - boxes[:, 1]) > frame_fraction * height))
+    regions = [{"label": "frame", "bbox": store["bbox"][row].tolist(), "title": None,
+                "handles": [store["handle"][row]], "entity_count": 1} for row in rows[frame]]
+    rows, boxes = rows[~frame], boxes[~frame]
+    if len(rows) == 0:
+        return regions
+
+    if cell_size is None:
+        cell_size = max(width, height) / GRID_RESOLUTION
+    index = si.build_grid_index(boxes, cell_size)
+    keys, starts, items = index["keys"], index["starts"], index["items"]
+    occupancy = np.diff(starts)
+    dense = np.flatnonzero(occupancy >= min_count)
+    if len(dense) == 0:
+        return regions
+    cluster_of_dense = cluster_cells(keys[dense], gap)
+    cell_cluster = np.full(len(keys), -1)
+    cell_cluster[dense] = cluster_of_dense
+
+    # 实体归入其登记网格所在的簇（一个实体覆盖的网格彼此相邻，必在同一簇中）
+    item_cluster = np.full(len(rows), -1)
+    cell_of_slot = np.repeat(np.arange(len(keys)), occupancy)
+    np.maximum.at(item_cluster, items, cell_cluster[cell_of_slot])
+    # 跨网格过多的长线按其包围盒中心落在哪个簇的网格上归类
+    for item in index["oversized"]:
+        cx, cy = si.cell_coords(index, (boxes[item, 0] + boxes[item, 2]) / 2, (boxes[item, 1] + boxes[item, 3]) / 2)
+        pos = np.searchsorted(keys, cx * si.KEY_STRIDE + cy)
+        if pos < len(keys) and keys[pos] == cx * si.KEY_STRIDE + cy:
+            item_cluster[item] = cell_cluster[pos]
+
+    assigned = np.flatnonzero(item_cluster >= 0)
+    n_clusters = int(cluster_of_dense.max()) + 1
+    counts = np.bincount(item_cluster[assigned], minlength=n_clusters)
+    region_box = np.tile([np.inf, np.inf, -np.inf, -np.inf], (n_clusters, 1))
+    for k, reduce in ((0, np.minimum), (1, np.minimum), (2, np.maximum), (3, np.maximum)):
+        reduce.at(region_box[:, k], item_cluster[assigned], boxes[assigned, k])
+
+    texts = store["texts"]
+    order = np.argsort(item_cluster[assigned], kind='stable')
+    members = np.split(rows[assigned[order]], np.cumsum(counts)[:-1])
+    found = []
+    for c in np.flatnonzero(counts >= min_entities):
+        text_ids = np.flatnonzero(np.isin(texts["row"], members[c]))
+        # 按字高从大到小判断，图名通常是区域里最大的字
+        text_ids = text_ids[np.argsort(-texts["height"][text_ids], kind='stable')]
+        label, title = label_region([texts["text"][i] for i in text_ids])
+        found.append({
+            "label": label,
+            "bbox": region_box[c].tolist(),
+            "title": title,
+            "handles": [store["handle"][row] for row in members[c]],
+            "entity_count": int(counts[c]),
+            # 以文字为主的小区域是图名/比例/附注，稍后并入所属视图
+            "caption": bool(counts[c] < 4 * min_entities and
+                            np.isin(store["dxftype"][members[c]], list(es.TEXT_TYPES)).mean() >= 0.5),
+        })
+    regions.extend(attach_captions(found))
+    regions.sort(key=lambda r: -(r["bbox"][2] - r["bbox"][0]) * (r["bbox"][3] - r["bbox"][1]))
+    return regions
+
+
+_worker_store = None
+
+
+def _init_worker(dxf_file_path, flatten_distance):
+    global _worker_store
+    _worker_store = es.load_entity_store(dxf_file_path, flatten_distance)
+
+
+def _run_region(func, region):
+    return func(_worker_store, tuple(region["bbox"]))
+
+
+def process_regions(dxf_file_path, regions, func, processes=None, flatten_distance=es.FLATTEN_DISTANCE):
+    """按区域并行处理：每个进程读一次图纸，func(store, bbox) 需为模块级函数，结果顺序与 regions 一致"""
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(dxf_file_path, flatten_distance)) as pool:
+        futures = [pool.submit(_run_region, func, region) for region in regions]
+        return [future.result() for future in futures]
+
+
+def save_to_json(data, output_filename):
+    try:
+        with open(output_filename, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        print(f"Regions successfully saved to {output_filename}")
+    except Exception as e:
+        print(f"An error occurred while saving to JSON: {e}")
+
+
+if __name__ == "__main__":
+    # 示例用法：自动找出各视图范围，不再手动输入 xmin, ymin, xmax, ymax
+    import bbox_clip as bc
+    dxf_file_path = r"C:\Users\Lenovo\Desktop\水闸纵剖面图\cad解析\剖面底板厚度.dxf"
+    store = es.load_entity_store(dxf_file_path)
+    if store is not None:
+        regions = discover_regions(store)
+        for region in regions:
+            print(region["label"], region["title"], [round(v, 2) for v in region["bbox"]])
+        views = [region for region in regions if region["label"] != "frame"]
+        results = process_regions(dxf_file_path, views, bc.extract_coordinates_in_bbox)
+        save_to_json(regions, r"C:\\Users\\Lenovo\\Desktop\\水闸纵剖面图\\regions.json")
+        # 各视图框内的几何与文字，按视图分别保存
+        save_to_json([dict(view, coordinates=coordinates) for view, coordinates in zip(views, results)],
+                     r"C:\\Users\\Lenovo\\Desktop\\水闸纵剖面图\\region_coordinates.json")
@@ -0,0 +1,346 @@
+import json
+import numpy as np
+import entity_store as es
+import spatial_index as si
+import topology as tp
+import dimension_geometry as dg
+
+# 版本说明：很多图纸同时有扫描件和 DXF，但 IRtext1 提取的像素线段和 extract_coordinates 的图纸坐标之间没有任何对应，
+# 扫描件上的批注无法定位到 DXF 里。这里取两边最长的若干条线段，两两配对计算与比例、旋转、平移无关的描述量
+# （两条线的夹角、长度之比的对数、交点在两条线段上的相对位置），取整后哈希；像素侧与图纸侧哈希值相同的线段对作为候选对应。
+# 候选对应按夹角差（旋转）和长度比（比例）投票，票数多的组成候选池；每个候选给出两条线所在直线的交点
+# （交点不受线段检测不完整的影响），两点 RANSAC 每次取两个候选的交点求相似变换，在网格空间索引上批量统计内点，
+# 再用“像素线段端点变换后落在对应图纸线段所在直线上”的约束做最小二乘，求出仿射变换并给出逐条线段的对应关系。
+
+# 参与描述量配对的最长线段数（两侧各取）
+DESCRIPTOR_SEGMENTS = 100
+
+# 描述量取整步长：夹角（度）、长度比的对数、交点在线段上的位置（相对半长）。
+# 检测出的线段常比实际短一截，长度比和位置取得较粗，查询时也查相邻的格
+DESCRIPTOR_ANGLE_STEP = 2.0
+DESCRIPTOR_RATIO_STEP = 0.2
+DESCRIPTOR_POSITION_STEP = 0.25
+
+# 候选对应按（旋转角, 比例的对数）投票，票数多的先试；投票格的大小
+VOTE_ANGLE_STEP = 2.0
+VOTE_SCALE_STEP = 0.1
+
+# 两条线夹角小于该值（度）时交点不稳定，不作为描述量
+MIN_PAIR_ANGLE = 10.0
+
+RANSAC_ITERATIONS = 2000
+
+# 参与两点采样的候选对应数（按投票数从高到低取）
+CANDIDATE_POOL = 400
+
+# 两点样本求出的比例与长度比给出的比例之间允许的偏差（对数）
+MAX_LOG_SCALE_ERROR = 0.5
+
+# 内点判定：变换后像素线段中点到图纸线段所在直线的距离（按像素计）与方向差（度）。
+# 交点受线段端点噪声影响，RANSAC 计分时用较宽的 COARSE_TOLERANCE，精化时逐轮收紧到 PIXEL_TOLERANCE
+COARSE_TOLERANCE = 10.0
+PIXEL_TOLERANCE = 3.0
+ANGLE_TOLERANCE = 2.0
+
+# 最小二乘精化的轮数
+REFINE_ITERATIONS = 4
+
+# 最终对上的线段少于该数时认为配准失败（仿射变换有 6 个参数），affine 返回 None
+MIN_INLIERS = 6
+
+
+def segment_geometry(segments):
+    """线段中点、方向角（0~180度）和长度"""
+    mid = (segments[:, :2] + segments[:, 2:]) / 2
+    d = segments[:, 2:] - segments[:, :2]
+    angle = np.degrees(np.arctan2(d[:, 1], d[:, 0])) % 180.0
+    return mid, angle, np.hypot(d[:, 0], d[:, 1])
+
+
+def distinct_long_segments(segments, angle, length, count, tol):
+    """按长度从大到小取 count 条线段，与更长的线段方向相同、相距不超过 tol 且互相重叠的视为重复
+    （扫描件线宽的两条边缘常被检测成两条线段），跳过不取"""
+    ids = np.argsort(-length)[:4 * count]
+    seg = segments[ids]
+    mid = (seg[:, :2] + seg[:, 2:]) / 2
+    unit = (seg[:, 2:] - seg[:, :2]) / np.maximum(length[ids], 1e-12)[:, None]
+    # k 行 l 列：l 相对更长的 k 的法向距离、沿 k 方向的投影和方向差
+    rel = mid[None, :, :] - seg[:, None, :2]
+    distance = np.abs(rel[:, :, 0] * unit[:, None, 1] - rel[:, :, 1] * unit[:, None, 0])
+    along = np.einsum('klj,kj->kl', rel, unit)
+    diff = np.abs(angle[ids][:, None] - angle[ids][None, :])
+    diff = np.minimum(diff, 180.0 - diff)
+    duplicate = (diff <= ANGLE_TOLERANCE) & (distance <= tol) & (along >= 0) & (along <= length[ids][:, None])
+    duplicate = np.triu(duplicate, 1).any(axis=0)
+    return ids[~duplicate][:count]
+
+
+def descriptor_key(angle_bin, ratio_bin, position_i, position_j):
+    return ((angle_bin * 256 + ratio_bin + 128) * 64 + position_i) * 64 + position_j
+
+
+def pair_descriptors(segments, angle, length, ids):
+    """ids 中线段两两（有序）配对，返回 (i, j, 夹角格, 长度比格, 交点位置格 i, 交点位置格 j)。
+    交点位置为交点到线段中点的距离与半长之比，线段端点顺序、相似变换都不影响它"""
+    i, j = np.meshgrid(ids, ids, indexing='ij')
+    i, j = i.ravel(), j.ravel()
+    relative = (angle[j] - angle[i]) % 180.0
+    keep = (i != j) & (relative >= MIN_PAIR_ANGLE) & (relative <= 180.0 - MIN_PAIR_ANGLE)
+    i, j, relative = i[keep], j[keep], relative[keep]
+    ratio = np.clip(np.log(length[j] / length[i]), -100 * DESCRIPTOR_RATIO_STEP, 100 * DESCRIPTOR_RATIO_STEP)
+    cross = line_intersections(segments, i, j)
+    positions = []
+    for k in (i, j):
+        mid = (segments[k, :2] + segments[k, 2:]) / 2
+        position = 2 * np.hypot(*(cross - mid).T) / length[k]
+        positions.append(np.round(np.minimum(position, 60 * DESCRIPTOR_POSITION_STEP) /
+                                  DESCRIPTOR_POSITION_STEP).astype(np.int64) + 1)
+    return (i, j, np.round(relative / DESCRIPTOR_ANGLE_STEP).astype(np.int64),
+            np.round(ratio / DESCRIPTOR_RATIO_STEP).astype(np.int64), positions[0], positions[1])
+
+
+def line_intersections(segments, i, j):
+    """第 i 条与第 j 条线段所在直线的交点"""
+    p, r = segments[i, :2], segments[i, 2:] - segments[i, :2]
+    q, s = segments[j, :2], segments[j, 2:] - segments[j, :2]
+    cross = r[:, 0] * s[:, 1] - r[:, 1] * s[:, 0]
+    t = ((q[:, 0] - p[:, 0]) * s[:, 1] - (q[:, 1] - p[:, 1]) * s[:, 0]) / cross
+    return p + r * t[:, None]
+
+
+def apply_affine(affine, points):
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return points @ affine[:, :2].T + affine[:, 2]
+
+
+def transform_segments(affine, segments):
+    return apply_affine(affine, segments.reshape(-1, 2)).reshape(-1, 4)
+
+
+def match_lines(segments, world, index, tol, angle_tol=ANGLE_TOLERANCE):
+    """已变换到图纸坐标的线段逐条找对应的图纸线段：中点到图纸线段所在直线的距离不超过 tol、
+    中点投影落在图纸线段上（容差内）且方向差不超过 angle_tol。返回每条线段对应的图纸线段编号（没有为 -1）和距离"""
+    mid, angle, _ = segment_geometry(segments)
+    best = np.full(len(segments), -1)
+    best_distance = np.full(len(segments), np.inf)
+    point_ids, seg, _ = si.query_radius_batch(index, mid, tol)
+    if len(point_ids) == 0:
+        return best, best_distance
+    w0, wd = world[seg, :2], world[seg, 2:] - world[seg, :2]
+    w_len = np.hypot(wd[:, 0], wd[:, 1])
+    unit = wd / np.maximum(w_len, 1e-12)[:, None]
+    rel = mid[point_ids] - w0
+    along = np.einsum('ij,ij->i', rel, unit)
+    distance = np.abs(rel[:, 0] * unit[:, 1] - rel[:, 1] * unit[:, 0])
+    w_angle = np.degrees(np.arctan2(wd[:, 1], wd[:, 0])) % 180.0
+    diff = np.abs(angle[point_ids] - w_angle)
+    diff = np.minimum(diff, 180.0 - diff)
+    keep = (distance <= tol) & (along >= -tol) & (along <= w_len + tol) & (diff <= angle_tol)
+    point_ids, seg, distance = point_ids[keep], seg[keep], distance[keep]
+    order = np.lexsort((distance, point_ids))
+    first = order[np.r_[True, point_ids[order][1:] != point_ids[order][:-1]]] if len(order) else order
+    best[point_ids[first]] = seg[first]
+    best_distance[point_ids[first]] = distance[first]
+    return best, best_distance
+
+
+def fit_affine(pixel, world, matched):
+    """最小二乘求仿射变换：每条匹配上的像素线段的两个端点变换后应落在对应图纸线段所在直线上，
+    每个端点给出一个线性方程 n · (A p + t) = n · q"""
+    ids = np.flatnonzero(matched >= 0)
+    seg = matched[ids]
+    wd = world[seg, 2:] - world[seg, :2]
+    normal = np.stack([-wd[:, 1], wd[:, 0]], axis=1) / np.maximum(np.hypot(wd[:, 0], wd[:, 1]), 1e-12)[:, None]
+    normal = np.repeat(normal, 2, axis=0)
+    q = np.repeat(world[seg, :2], 2, axis=0)
+    p = pixel[ids].reshape(-1, 2)
+    # 未知数顺序：a11 a12 t1 a21 a22 t2
+    design = np.stack([normal[:, 0] * p[:, 0], normal[:, 0] * p[:, 1], normal[:, 0],
+                       normal[:, 1] * p[:, 0], normal[:, 1] * p[:, 1], normal[:, 1]], axis=1)
+    rhs = np.einsum('ij,ij->i', normal, q)
+    solution, *_ = np.linalg.lstsq(design, rhs, rcond=None)
+    return solution.reshape(2, 3)
+
+
+def estimate_affine(pixel_segments, world_segments, flip_y=True, iterations=RANSAC_ITERATIONS,
+                    pixel_tol=PIXEL_TOLERANCE, seed=0):
+    """由像素线段和图纸线段估计像素 -> 图纸的仿射变换。flip_y=True 表示图像 y 轴向下。
+    返回 {"affine", "matched", "distance", "inliers", "rms"}，matched 为每条像素线段对应的图纸线段编号（-1 为无）。
+    对上的线段少于 MIN_INLIERS 时 affine 为 None、matched 全为 -1"""
+    pixel = np.asarray(pixel_segments, dtype=np.float64).reshape(-1, 4)
+    world = np.asarray(world_segments, dtype=np.float64).reshape(-1, 4)
+    flip = np.array([[1.0, 0.0, 0.0], [0.0, -1.0 if flip_y else 1.0, 0.0]])
+    flipped = transform_segments(flip, pixel)
+    _, p_angle, p_len = segment_geometry(flipped)
+    _, w_angle, w_len = segment_geometry(world)
+    p_long = distinct_long_segments(flipped, p_angle, p_len, DESCRIPTOR_SEGMENTS, pixel_tol)
+    w_long = np.argsort(-w_len)[:DESCRIPTOR_SEGMENTS]
+    pi, pj, *p_bins = pair_descriptors(flipped, p_angle, p_len, p_long)
+    wi, wj, *w_bins = pair_descriptors(world, w_angle, w_len, w_long)
+    result = {"affine": None, "matched": np.full(len(pixel), -1), "distance": np.full(len(pixel), np.inf),
+              "inliers": 0, "rms": None}
+
+    # 哈希连接：像素侧每个线段对连同相邻的格一起查图纸侧键相同的线段对
+    w_key = descriptor_key(*w_bins)
+    order = np.argsort(w_key, kind='stable')
+    w_key, wi, wj = w_key[order], wi[order], wj[order]
+    pair_parts, slot_parts = [], []
+    for shift in np.array(np.meshgrid(*[(-1, 0, 1)] * 4)).reshape(4, -1).T:
+        p_key = descriptor_key(*(bins + delta for bins, delta in zip(p_bins, shift)))
+        lo = np.searchsorted(w_key, p_key, 'left')
+        counts = np.searchsorted(w_key, p_key, 'right') - lo
+        pair_parts.append(np.repeat(np.arange(len(p_key)), counts))
+        slot_parts.append(np.repeat(lo, counts) + np.arange(counts.sum()) -
+                          np.repeat(np.cumsum(counts) - counts, counts))
+    pair, slot = np.concatenate(pair_parts), np.concatenate(slot_parts)
+    if len(pair) == 0:
+        return result
+    a, b = pi[pair], pj[pair]
+    c, d = wi[slot], wj[slot]
+
+    # 正确的候选对应给出的旋转（夹角差）和比例（长度比）都相近，按 (旋转, 比例) 投票，
+    # 票数多的格里的候选组成候选池
+    theta = (w_angle[c] - p_angle[a]) % 180.0
+    log_scale = 0.5 * np.log(w_len[c] * w_len[d] / (p_len[a] * p_len[b]))
+    vote = np.round(theta / VOTE_ANGLE_STEP).astype(np.int64) % int(round(180.0 / VOTE_ANGLE_STEP)) * (1 << 20) + \
+        np.round(log_scale / VOTE_SCALE_STEP).astype(np.int64)
+    _, vote_id, votes = np.unique(vote, return_inverse=True, return_counts=True)
+    rng = np.random.default_rng(seed)
+    pool = np.lexsort((rng.random(len(pair)), -votes[vote_id.ravel()]))[:CANDIDATE_POOL]
+    p_cross = line_intersections(flipped, a[pool], b[pool])
+    w_cross = line_intersections(world, c[pool], d[pool])
+
+    # 两点 RANSAC：池中任取两个候选，两对交点确定一个相似变换（z = (Y2 - Y1) / (X2 - X1)，复数表示旋转和比例）。
+    # 比例不用检测长度（检测出的线段常短一截），旋转与夹角差不一致、比例与长度比相差太大的样本直接丢弃
+    u = rng.integers(0, len(pool), iterations)
+    v = rng.integers(0, len(pool), iterations)
+    px = (p_cross[:, 0] + 1j * p_cross[:, 1])
+    wx = (w_cross[:, 0] + 1j * w_cross[:, 1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (wx[v] - wx[u]) / (px[v] - px[u])
+        scale_error = np.abs(np.log(np.abs(z)) - log_scale[pool][u])
+    rotation = np.degrees(np.angle(z)) % 180.0
+    rotation_error = np.abs(rotation - theta[pool][u])
+    rotation_error = np.minimum(rotation_error, 180.0 - rotation_error)
+    valid = (u != v) & np.isfinite(z) & (np.abs(px[v] - px[u]) > 0) & \
+        (rotation_error <= VOTE_ANGLE_STEP) & (scale_error <= MAX_LOG_SCALE_ERROR)
+    z, t = z[valid], wx[u[valid]] - z[valid] * px[u[valid]]
+    scale = np.abs(z)
+    cos, sin, tx, ty = z.real, z.imag, t.real, t.imag
+
+    index = si.build_grid_index(dg.segment_boxes(world))
+    probe = flipped[p_long]
+    best_score, best = -1.0, None
+    for k in range(len(z)):
+        similarity = np.array([[cos[k], -sin[k], tx[k]], [sin[k], cos[k], ty[k]]])
+        matched, _ = match_lines(transform_segments(similarity, probe), world, index, COARSE_TOLERANCE * scale[k])
+        # 按像素线段长度计分，长线对上比短线对上更可信
+        score = p_len[p_long][matched >= 0].sum()
+        if score > best_score:
+            best_score, best = score, (similarity, scale[k])
+    if best is None:
+        return result
+
+    # 在全部像素线段上精化：匹配 -> 最小二乘仿射 -> 重新匹配，容差逐轮收紧
+    similarity, scale = best
+    affine = similarity
+    for tol in np.geomspace(COARSE_TOLERANCE, pixel_tol, REFINE_ITERATIONS):
+        matched, distance = match_lines(transform_segments(affine, flipped), world, index, tol * scale)
+        if (matched >= 0).sum() < 3:
+            break
+        affine = fit_affine(flipped, world, matched)
+        scale = np.sqrt(abs(np.linalg.det(affine[:, :2])))
+    matched, distance = match_lines(transform_segments(affine, flipped), world, index, pixel_tol * scale)
+    inliers = matched >= 0
+    if inliers.sum() < MIN_INLIERS:
+        return result
+    # 合成图像 y 轴翻转，得到直接作用于原始像素坐标的仿射变换
+    full = affine[:, :2] @ flip[:, :2]
+    result.update(affine=np.hstack([full, affine[:, 2:]]), matched=matched, distance=distance,
+                  inliers=int(inliers.sum()), rms=float(np.sqrt(np.mean(distance[inliers] ** 2))))
+    return result
+
+
+def register_scan(pixel_segments, store, dxftypes=tp.LINEWORK_TYPES, layer=None, bbox=None, flip_y=True):
+    """把扫描件线段（IRtext1 输出的像素坐标）配准到实体表：返回仿射变换和逐条线段的对应，
+    对应关系中给出图纸线段编号、实体行号和句柄"""
+    rows = es.query_entities(store, dxftype=list(dxftypes), layer=layer, bbox=bbox)
+    segment_ids = np.flatnonzero(np.isin(store["segment_row"], rows))
+    result = estimate_affine(pixel_segments, store["segments"][segment_ids], flip_y=flip_y)
+    matched = result["matched"]
+    segment = np.where(matched >= 0, segment_ids[np.maximum(matched, 0)], -1)
+    row = np.where(segment >= 0, store["segment_row"][np.maximum(segment, 0)], -1)
+    result.update(segment=segment, row=row)
+    return result
+
+
+def registered_affine(registration):
+    affine = registration["affine"]
+    if affine is None:
+        raise ValueError(f"Registration failed ({registration['inliers']} matched lines), no pixel/world transform")
+    return affine
+
+
+def pixel_to_world(registration, points):
+    """像素坐标 -> 图纸坐标"""
+    return apply_affine(registered_affine(registration), points)
+
+
+def world_to_pixel(registration, points):
+    """图纸坐标 -> 像素坐标"""
+    affine = registered_affine(registration)
+    inverse = np.linalg.inv(affine[:, :2])
+    return (np.asarray(points, dtype=np.float64).reshape(-1, 2) - affine[:, 2]) @ inverse.T
+
+
+def load_pixel_segments(json_path):
+    """读取 IRtext1.main（start/end 字典列表）或 IRbatch（segments 数组）输出的像素线段，返回 (n, 4)"""
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return np.asarray(data["segments"], dtype=np.float64).reshape(-1, 4)
+    return np.array([[s["start"]["x"], s["start"]["y"], s["end"]["x"], s["end"]["y"]] for s in data],
+                    dtype=np.float64).reshape(-1, 4)
+
+
+def registration_records(store, registration):
+    """可以写入 JSON 的配准结果：仿射变换和每条像素线段对应的实体"""
+    records = []
+    for k, row in enumerate(registration["row"]):
+        records.append(None if row < 0 else {
+            "pixel_segment": k,
+            "segment": int(registration["segment"][k]),
+            "row": int(row),
+            "handle": store["handle"][row],
+            "distance": float(registration["distance"][k]),
+        })
+    return {
+        "affine": None if registration["affine"] is None else registration["affine"].tolist(),
+        "inliers": registration["inliers"],
+        "rms": registration["rms"],
+        "lines": [record for record in records if record is not None],
+    }
+
+
+def save_to_json(data, output_filename):
+    try:
+        with open(output_filename, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        print(f"Registration successfully saved to {output_filename}")
+    except Exception as e:
+        print(f"An error occurred while saving to JSON: {e}")
+
+
+if __name__ == "__main__":
+    # 示例用法：IRtext1 提取的扫描件线段配准到同一张图的 DXF
+    dxf_file_path = r"C:\Users\Lenovo\Desktop\水闸纵剖面图\cad解析\剖面底板厚度.dxf"
+    pixel_json = r"C:\Users\Lenovo\Desktop\水闸纵剖面图\cad解析\text2.1.json"
+    store = es.load_entity_store(dxf_file_path)
+    if store is not None:
+        registration = register_scan(load_pixel_segments(pixel_json), store)
+        if registration["affine"] is None:
+            print("Registration failed: too few lines matched the drawing")
+        else:
+            print(f"Matched {registration['inliers']} lines, rms {registration['rms']}")
+        save_to_json(registration_records(store, registration),
+                     r"C:\\Users\\Lenovo\\Desktop\\水闸纵剖面图\\registration.json")
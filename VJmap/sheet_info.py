@@ -0,0 +1,266 @@
+import os
+import re
+import json
+import hashlib
+import numpy as np
+import entity_store as es
+import spatial_index as si
+import text_index as ti
+import topology as tp
+import faces as fc
+import bbox_clip as bc
+
+# 版本说明：图纸比例、图号、单位都写在图签里，但以前每次运行都读不到，只能靠 get_dimension_scale 里的 dimlfac 猜。
+# 这里先找出图中所有闭合矩形（闭合多段线），面积最大的是图框；图签外框常和图框共用边，
+# 所以在图框角部的线条拼成的闭合面中找包含图签栏目名（图名、图号、比例……）的面作为图签，
+# 栏目名右侧的取值通过文字空间索引查找。比例文字 1:100 解析成数值，
+# 说明中的“尺寸单位为mm，高程单位为m”解析成单位。结果按图纸文件的哈希缓存到同名的 .sheet.json 旁路文件里，
+# 图纸不变时各提取脚本直接读缓存即可拿到比例和单位。
+# 图框、图签画在块里（INSERT）时同样从块展开出的线段中查找。
+
+SHEET_INFO_VERSION = 2
+
+# 多边形面积与包围盒面积之比不低于该值视为矩形
+RECTANGLE_FILL = 0.98
+
+# 找图签时在栏目名范围外侧留出的余量（栏目名字高的倍数），要够一格的宽度和一行的高度，
+# 图签最外一圈格子的边线才在查找范围内
+TITLE_BLOCK_PAD = 10.0
+
+SCALE_PATTERN = re.compile(r"1\s*[:：]\s*(\d+(?:\.\d+)?)")
+UNIT_PATTERNS = {
+    "length_unit": re.compile(r"尺寸单位[为以:：]?\s*(mm|cm|m|毫米|厘米|米)", re.IGNORECASE),
+    "elevation_unit": re.compile(r"高程单位[为以:：]?\s*(mm|cm|m|毫米|厘米|米)", re.IGNORECASE),
+}
+UNIT_NAMES = {"毫米": "mm", "厘米": "cm", "米": "m"}
+
+# 图签栏目名 -> 输出字段
+TITLE_FIELDS = {
+    "图名": "sheet_name",
+    "图号": "sheet_number",
+    "比例": "scale_text",
+    "日期": "date",
+    "设计": "designer",
+    "校核": "checker",
+    "审核": "reviewer",
+}
+
+
+def file_hash(filename):
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def closed_runs(segments):
+    """把首尾相接的线段切成若干条连续折线，返回其中闭合的 (起, 止) 下标区间"""
+    if len(segments) == 0:
+        return []
+    breaks = np.r_[True, ~(segments[1:, :2] == segments[:-1, 2:]).all(axis=1)]
+    starts = np.flatnonzero(breaks)
+    ends = np.r_[starts[1:], len(segments)]
+    return [(lo, hi) for lo, hi in zip(starts, ends)
+            if hi - lo >= 3 and np.allclose(segments[lo, :2], segments[hi - 1, 2:])]
+
+
+def find_rectangles(store):
+    """取出全部近似矩形的闭合多段线（包括块内的闭合多段线，记在 INSERT 的行号下），
+    返回 (行号, 包围盒)，按面积从大到小排列"""
+    rows = es.query_entities(store, dxftype=list(es.POLYLINE_TYPES) + ['INSERT'])
+    found = []
+    for row in rows:
+        lo, hi = np.searchsorted(store["segment_row"], [row, row + 1])
+        segments = store["segments"][lo:hi]
+        for start, end in closed_runs(segments):
+            run = segments[start:end]
+            x0, y0 = np.minimum(run[:, :2], run[:, 2:]).min(axis=0)
+            x1, y1 = np.maximum(run[:, :2], run[:, 2:]).max(axis=0)
+            box_area = (x1 - x0) * (y1 - y0)
+            # 鞋带公式
+            area = abs(np.sum(run[:, 0] * run[:, 3] - run[:, 2] * run[:, 1])) / 2
+            if box_area > 0 and area / box_area >= RECTANGLE_FILL:
+                found.append((row, np.array([x0, y0, x1, y1])))
+    found.sort(key=lambda item: -(item[1][2] - item[1][0]) * (item[1][3] - item[1][1]))
+    return found
+
+
+def is_title_label(normalized):
+    """图签栏目名：单独的关键字，或关键字后直接跟冒号/取值（比例1:100）"""
+    for keyword in TITLE_FIELDS:
+        rest = normalized[len(keyword):]
+        if normalized.startswith(keyword) and (rest == '' or rest[0] in ':：' or rest[0].isdigit()):
+            return True
+    return False
+
+
+def parse_scale(text):
+    """'1:100' / '1：100' -> 100.0，没有比例时返回 None"""
+    match = SCALE_PATTERN.search(text or '')
+    return float(match.group(1)) if match else None
+
+
+def title_field_values(index, ids):
+    """图签内的栏目名取同一行右侧最近的文字作为取值；栏目名和取值写在一起（比例 1:100）时直接拆开"""
+    values = {}
+    inserts, heights = index["insert"], index["height"]
+    labels = {i for i in ids if is_title_label(index["normalized"][i])}
+    for i in labels:
+        text = index["normalized"][i]
+        keyword = next(k for k in TITLE_FIELDS if text.startswith(k))
+        rest = index["text"][i].replace(' ', '')[len(keyword):].lstrip(':：')
+        if rest:
+            values[TITLE_FIELDS[keyword]] = rest
+            continue
+        others = np.array([j for j in ids if j not in labels], dtype=np.int64)
+        if len(others) == 0:
+            continue
+        dx = inserts[others, 0] - inserts[i, 0]
+        dy = np.abs(inserts[others, 1] - inserts[i, 1])
+        same_row = np.flatnonzero((dx > 0) & (dy <= heights[i]))
+        if len(same_row):
+            values[TITLE_FIELDS[keyword]] = index["text"][others[same_row[np.argmin(dx[same_row])]]]
+    return values
+
+
+def detect_sheet_info(store):
+    """找图框、图签并解析比例、图号、单位"""
+    index = ti.build_text_index(store)
+    rectangles = find_rectangles(store)
+    info = {
+        "frame": None,
+        "inner_frame": None,
+        "title_block": None,
+        "fields": {},
+        "scale": None,
+        "view_scales": [],
+        "length_unit": None,
+        "elevation_unit": None,
+    }
+    if rectangles:
+        info["frame"] = rectangles[0][1].tolist()
+        x0, y0, x1, y1 = rectangles[0][1]
+        inner = [box for _, box in rectangles[1:] if box[0] >= x0 and box[1] >= y0 and box[2] <= x1 and box[3] <= y1]
+        if inner:
+            info["inner_frame"] = inner[0].tolist()
+
+    # 图签：包含图签栏目名（图名、图号、比例……）的闭合面的并集。
+    # 图签外框常与图框共用边，不一定是独立的闭合多段线，所以在线条拼成的闭合面上找
+    keyword_ids = [i for i in range(len(index["text"])) if is_title_label(index["normalized"][i])]
+    keyword_points = index["insert"][keyword_ids]
+    if len(keyword_ids) >= 2:
+        lo, hi = keyword_points.min(axis=0), keyword_points.max(axis=0)
+        frame_box = info["inner_frame"] or info["frame"]
+        # 栏目名范围向外留出余量，靠近图框的一侧直接延伸到图框边（图签外框常与图框共用边）
+        pad = TITLE_BLOCK_PAD * float(index["height"][keyword_ids].max())
+        area = [lo[0] - pad, lo[1] - pad, hi[0] + pad, hi[1] + pad]
+        if frame_box is not None:
+            if frame_box[2] - hi[0] < lo[0] - frame_box[0]:
+                area[2] = frame_box[2]
+            else:
+                area[0] = frame_box[0]
+            if frame_box[3] - hi[1] < lo[1] - frame_box[1]:
+                area[3] = frame_box[3]
+            else:
+                area[1] = frame_box[1]
+            area = [max(area[0], frame_box[0]), max(area[1], frame_box[1]),
+                    min(area[2], frame_box[2]), min(area[3], frame_box[3])]
+        # 块内的图签线条记在 INSERT 行下，一并参与拼面
+        _, segments = bc.segments_in_bbox(store, area, dxftypes=list(tp.LINEWORK_TYPES) + ['INSERT'])
+        faces = fc.extract_faces(segments)
+        frame_area = None if frame_box is None else (frame_box[2] - frame_box[0]) * (frame_box[3] - frame_box[1])
+        faces = [face for face in faces if frame_area is None or face["area"] <= 0.5 * frame_area]
+        if faces:
+            # 图签 = 含栏目名的格子以及与它们相邻（包围盒相接）的格子连成的整块
+            boxes = np.array([face["bbox"] for face in faces], dtype=np.float64)
+            has_label = np.array([any(fc.polygon_contains(np.array(face["points"]), point) for point in keyword_points)
+                                  for face in faces])
+            tol = tp.SNAP_TOLERANCE
+            pairs = si.overlapping_pairs(si.build_grid_index(boxes + [-tol, -tol, tol, tol]))
+            labels = tp.connected_labels(len(faces), pairs[:, 0], pairs[:, 1])
+            boxes = boxes[np.isin(labels, labels[has_label])]
+        else:
+            boxes = np.zeros((0, 4))
+        if len(boxes):
+            info["title_block"] = [float(v) for v in (*boxes[:, :2].min(axis=0), *boxes[:, 2:].max(axis=0))]
+        else:
+            info["title_block"] = [float(v) for v in (*lo, *hi)]
+
+    if info["title_block"] is not None:
+        ids = si.query_bbox(index["spatial"], info["title_block"])
+        info["fields"] = title_field_values(index, ids)
+        for i in ids:
+            if info["scale"] is None:
+                info["scale"] = parse_scale(index["text"][i])
+        if info["scale"] is None and "scale_text" in info["fields"]:
+            info["scale"] = parse_scale(info["fields"]["scale_text"])
+
+    # 视图下方单独写的比例（如 伸缩缝大样图 1:20）
+    title_ids = set(si.query_bbox(index["spatial"], info["title_block"]).tolist()) if info["title_block"] else set()
+    for i in ti.match_text_ids(index, SCALE_PATTERN.pattern, regex=True):
+        text = index["text"][i]
+        # 坡比（1:2、1:0.4）和比例写法相同，只收比例数值为不小于5的整数的文字
+        value = parse_scale(text)
+        if i in title_ids or value is None or value != int(value) or value < 5:
+            continue
+        info["view_scales"].append({"text": text, "scale": value, "location": index["insert"][i].tolist()})
+
+    # 图签里没有比例时取各视图比例中出现最多的一个
+    info["scale_source"] = "title_block" if info["scale"] is not None else None
+    if info["scale"] is None and info["view_scales"]:
+        values, counts = np.unique([v["scale"] for v in info["view_scales"]], return_counts=True)
+        info["scale"] = float(values[np.argmax(counts)])
+        info["scale_source"] = "views"
+
+    for text in index["text"]:
+        for key, pattern in UNIT_PATTERNS.items():
+            match = pattern.search(text or '')
+            if match and info[key] is None:
+                unit = match.group(1).lower()
+                info[key] = UNIT_NAMES.get(unit, unit)
+    return info
+
+
+def sidecar_path(dxf_file_path):
+    return dxf_file_path + '.sheet.json'
+
+
+def load_sheet_info(dxf_file_path, store=None):
+    """读取图签信息：旁路缓存中的哈希与图纸一致时直接返回，否则重新识别并写回缓存"""
+    digest = file_hash(dxf_file_path)
+    cache_file = sidecar_path(dxf_file_path)
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get("hash") == digest and cached.get("version") == SHEET_INFO_VERSION:
+                return cached["info"]
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable sheet cache {cache_file}: {e}")
+    if store is None:
+        store = es.load_entity_store(dxf_file_path)
+        if store is None:
+            return None
+    info = detect_sheet_info(store)
+    try:
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump({"hash": digest, "version": SHEET_INFO_VERSION, "info": info}, f, ensure_ascii=False, indent=4)
+    except OSError as e:
+        print(f"An error occurred while saving sheet cache: {e}")
+    return info
+
+
+def load_store_with_sheet(dxf_file_path, flatten_distance=es.FLATTEN_DISTANCE):
+    """读取实体表并附上图签信息（store["sheet"]），各提取脚本直接取比例和单位"""
+    store = es.load_entity_store(dxf_file_path, flatten_distance)
+    if store is not None:
+        store["sheet"] = load_sheet_info(dxf_file_path, store)
+    return store
+
+
+if __name__ == "__main__":
+    # 示例用法
+    dxf_file_path = r"C:\Users\Lenovo\Desktop\水闸纵剖面图\cad解析\剖面底板厚度.dxf"
+    info = load_sheet_info(dxf_file_path)
+    print(json.dumps(info, ensure_ascii=False, indent=4))
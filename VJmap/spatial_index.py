@@ -0,0 +1,221 @@
+import numpy as np
+
+# 版本说明：均匀网格空间索引。每个包围盒按覆盖到的网格登记，
+# 网格键排序后以 CSR 形式（键数组 + 起始位置 + 成员数组）存放，查询时只取覆盖到的网格里的成员再做精确判断。
+# 覆盖网格过多的大实体（图框、长剖面线）单独放在 oversized 列表里，每次查询直接判断，避免索引膨胀。
+
+# 单个包围盒最多登记的网格数，超过的放入 oversized
+MAX_CELLS_PER_ITEM = 64
+
+# 网格键 = ix * KEY_STRIDE + iy
+KEY_STRIDE = np.int64(1) << 32
+
+
+def auto_cell_size(bboxes):
+    """按包围盒尺寸的中位数和总范围估算网格大小"""
+    valid = bboxes[~np.isnan(bboxes).any(axis=1)]
+    if len(valid) == 0:
+        return 1.0
+    sizes = np.maximum(valid[:, 2] - valid[:, 0], valid[:, 3] - valid[:, 1])
+    extent = max(valid[:, 2].max() - valid[:, 0].min(), valid[:, 3].max() - valid[:, 1].min())
+    # 至少保证总范围大约被分成 sqrt(n) x sqrt(n) 个网格
+    by_count = extent / max(np.sqrt(len(valid)), 1.0)
+    cell = max(float(np.median(sizes)) * 2, by_count)
+    return cell if cell > 0 else 1.0
+
+
+def cell_coords(index, x, y):
+    """坐标 -> 网格行列号"""
+    ox, oy = index["origin"]
+    size = index["cell_size"]
+    return np.floor((x - ox) / size).astype(np.int64), np.floor((y - oy) / size).astype(np.int64)
+
+
+def build_grid_index(bboxes, cell_size=None):
+    """为 (n, 4) 包围盒数组建立网格索引，nan 包围盒不登记"""
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    if cell_size is None:
+        cell_size = auto_cell_size(bboxes)
+    valid = ~np.isnan(bboxes).any(axis=1)
+    origin = (bboxes[valid, 0].min(), bboxes[valid, 1].min()) if valid.any() else (0.0, 0.0)
+    index = {
+        "cell_size": float(cell_size),
+        "origin": origin,
+        "bboxes": bboxes,
+    }
+
+    ids = np.flatnonzero(valid)
+    ix0, iy0 = cell_coords(index, bboxes[ids, 0], bboxes[ids, 1])
+    ix1, iy1 = cell_coords(index, bboxes[ids, 2], bboxes[ids, 3])
+    nx = ix1 - ix0 + 1
+    ny = iy1 - iy0 + 1
+    counts = nx * ny
+    oversized = counts > MAX_CELLS_PER_ITEM
+    index["oversized"] = ids[oversized]
+
+    ids, ix0, iy0, nx, ny, counts = (a[~oversized] for a in (ids, ix0, iy0, nx, ny, counts))
+    # 把每个包围盒展开成它覆盖的全部网格
+    owner = np.repeat(np.arange(len(ids)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cx = ix0[owner] + local // ny[owner]
+    cy = iy0[owner] + local % ny[owner]
+    keys = cx * KEY_STRIDE + cy
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    index["items"] = ids[owner[order]]
+    index["keys"], index["starts"] = np.unique(keys, return_index=True)
+    index["starts"] = np.append(index["starts"], len(keys))
+    return index
+
+
+def candidate_ids(index, bbox):
+    """取查询框覆盖到的网格中登记的全部成员（未去重，未做精确判断）"""
+    min_x, min_y, max_x, max_y = bbox
+    ix0, iy0 = cell_coords(index, min_x, min_y)
+    ix1, iy1 = cell_coords(index, max_x, max_y)
+    keys = index["keys"]
+    if len(keys) == 0:
+        return index["oversized"]
+    # 查询框太大时，直接在键数组上按范围过滤，不逐个网格查找
+    if (ix1 - ix0 + 1) * (iy1 - iy0 + 1) > len(keys):
+        kx = keys // KEY_STRIDE
+        ky = keys % KEY_STRIDE
+        hit = np.flatnonzero((kx >= ix0) & (kx <= ix1) & (ky >= iy0) & (ky <= iy1))
+    else:
+        gx, gy = np.meshgrid(np.arange(ix0, ix1 + 1), np.arange(iy0, iy1 + 1), indexing='ij')
+        wanted = (gx * KEY_STRIDE + gy).ravel()
+        pos = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        hit = pos[keys[pos] == wanted]
+    starts = index["starts"]
+    parts = [index["items"][starts[h]:starts[h + 1]] for h in hit]
+    parts.append(index["oversized"])
+    return np.concatenate(parts)
+
+
+def query_bbox(index, bbox):
+    """查询与 bbox 相交的成员编号（升序）"""
+    ids = np.unique(candidate_ids(index, bbox))
+    boxes = index["bboxes"][ids]
+    min_x, min_y, max_x, max_y = bbox
+    keep = (boxes[:, 0] <= max_x) & (boxes[:, 2] >= min_x) & (boxes[:, 1] <= max_y) & (boxes[:, 3] >= min_y)
+    return ids[keep]
+
+
+def bbox_distance(boxes, point):
+    """批量计算点到包围盒的距离（点在框内为0）"""
+    x, y = point
+    dx = np.maximum(np.maximum(boxes[:, 0] - x, x - boxes[:, 2]), 0)
+    dy = np.maximum(np.maximum(boxes[:, 1] - y, y - boxes[:, 3]), 0)
+    return np.hypot(dx, dy)
+
+
+def query_radius(index, point, radius):
+    """查询到 point 距离不超过 radius 的成员编号及距离"""
+    x, y = point
+    ids = query_bbox(index, (x - radius, y - radius, x + radius, y + radius))
+    distance = bbox_distance(index["bboxes"][ids], point)
+    keep = distance <= radius
+    return ids[keep], distance[keep]
+
+
+def query_nearest(index, point, k=1, max_radius=None):
+    """由近到远扩大搜索半径，返回距离 point 最近的 k 个成员编号及距离"""
+    bboxes = index["bboxes"]
+    valid = ~np.isnan(bboxes).any(axis=1)
+    if not valid.any():
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    if max_radius is None:
+        extent = max(bboxes[valid, 2].max() - bboxes[valid, 0].min(),
+                     bboxes[valid, 3].max() - bboxes[valid, 1].min())
+        x, y = point
+        ox, oy = index["origin"]
+        max_radius = extent + abs(x - ox) + abs(y - oy) + index["cell_size"]
+    radius = index["cell_size"]
+    while True:
+        ids, distance = query_radius(index, point, radius)
+        # 搜索圆内找到k个就是真正最近的k个（圆外的成员距离都大于radius）
+        if len(ids) >= k or radius >= max_radius:
+            order = np.argsort(distance, kind='stable')[:k]
+            return ids[order], distance[order]
+        radius *= 2
+
+
+def overlapping_pairs(index):
+    """求索引中包围盒两两相交的全部成员对 (i < j)，只在同一网格内配对，不做全体两两比较。
+    网格内按 x 最小值排序后扫描：每个成员只与排在它之后、x 最小值不超过它 x 最大值的成员配对，
+    成员很多的网格也不会展开成 sizes × sizes 对"""
+    keys, starts, items = index["keys"], index["starts"], index["items"]
+    sizes = np.diff(starts)
+    boxes = index["bboxes"]
+    cell = np.repeat(np.arange(len(sizes)), sizes)
+    member = boxes[items]
+    # x 坐标换成整数秩，(网格, 秩) 合成一个可以直接 searchsorted 的整数键
+    values = np.unique(np.concatenate([member[:, 0], member[:, 2]]))
+    span = len(values) + 1
+    key = cell * span + np.searchsorted(values, member[:, 0])
+    order = np.argsort(key, kind='stable')
+    key, sorted_items = key[order], items[order]
+    bound = cell[order] * span + np.searchsorted(values, member[order, 2])
+    counts = np.searchsorted(key, bound, 'right') - np.arange(len(key)) - 1
+    first = np.repeat(np.arange(len(key)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    parts_i, parts_j = [sorted_items[first]], [sorted_items[first + 1 + local]]
+    # 大实体逐个与其包围盒范围内的成员配对
+    for item in index["oversized"]:
+        found = query_bbox(index, index["bboxes"][item])
+        parts_i.append(np.full(len(found), item))
+        parts_j.append(found)
+    i = np.concatenate(parts_i)
+    j = np.concatenate(parts_j)
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    keep = i < j
+    pairs = np.unique(np.stack([i[keep], j[keep]], axis=1), axis=0)
+    a, b = boxes[pairs[:, 0]], boxes[pairs[:, 1]]
+    overlap = (a[:, 0] <= b[:, 2]) & (a[:, 2] >= b[:, 0]) & (a[:, 1] <= b[:, 3]) & (a[:, 3] >= b[:, 1])
+    return pairs[overlap]
+
+
+def query_radius_batch(index, points, radius):
+    """批量查询多个点各自半径范围内的成员，返回 (点编号, 成员编号, 距离) 三个数组。
+    所有点覆盖到的网格一次展开、一次 searchsorted，不逐点查询"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    radius = np.broadcast_to(np.asarray(radius, dtype=np.float64), (len(points),))
+    keys, starts, items = index["keys"], index["starts"], index["items"]
+    ix0, iy0 = cell_coords(index, points[:, 0] - radius, points[:, 1] - radius)
+    ix1, iy1 = cell_coords(index, points[:, 0] + radius, points[:, 1] + radius)
+    if len(keys):
+        # 网格范围截到索引实际登记过的行列号内，半径很大时也不会展开出大量空网格
+        kx, ky = keys // KEY_STRIDE, keys % KEY_STRIDE
+        ix0, ix1 = np.maximum(ix0, kx.min()), np.minimum(ix1, kx.max())
+        iy0, iy1 = np.maximum(iy0, ky.min()), np.minimum(iy1, ky.max())
+    ny = np.maximum(iy1 - iy0 + 1, 0)
+    counts = np.maximum(ix1 - ix0 + 1, 0) * ny
+    # 每个点展开成它覆盖的全部网格
+    owner = np.repeat(np.arange(len(points)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    wanted = (ix0[owner] + local // ny[owner]) * KEY_STRIDE + iy0[owner] + local % ny[owner]
+    parts_point, parts_item = [], []
+    if len(keys):
+        pos = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        found = keys[pos] == wanted
+        owner, pos = owner[found], pos[found]
+        # 每个命中网格展开成其中登记的成员
+        sizes = starts[pos + 1] - starts[pos]
+        slot = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        parts_point.append(np.repeat(owner, sizes))
+        parts_item.append(items[np.repeat(starts[pos], sizes) + slot])
+    oversized = index["oversized"]
+    parts_point.append(np.repeat(np.arange(len(points)), len(oversized)))
+    parts_item.append(np.tile(oversized, len(points)))
+    point_ids = np.concatenate(parts_point)
+    item_ids = np.concatenate(parts_item)
+    # 同一成员可能登记在多个网格中，去重后再按真实距离过滤
+    pairs = np.unique(np.stack([point_ids, item_ids], axis=1), axis=0)
+    point_ids, item_ids = pairs[:, 0], pairs[:, 1]
+    boxes = index["bboxes"][item_ids]
+    x, y = points[point_ids, 0], points[point_ids, 1]
+    dx = np.maximum(np.maximum(boxes[:, 0] - x, x - boxes[:, 2]), 0)
+    dy = np.maximum(np.maximum(boxes[:, 1] - y, y - boxes[:, 3]), 0)
+    distance = np.hypot(dx, dy)
+    keep = distance <= radius[point_ids]
+    return point_ids[keep], item_ids[keep], distance[keep]
@@ -0,0 +1,226 @@
+import json
+import numpy as np
+import entity_store as es
+import spatial_index as si
+import topology as tp
+import thickness as th
+
+# 版本说明：材料表、钢筋表都是用 LINE 画的格子加 TEXT，原来的输出只有零散的线和文字列表。
+# 这里把水平线、竖线分别按所在的 y / x 排序并合并成若干条“格线”（同一高度的首尾相接线段合并成区间），
+# 所有格线的 y、x 值构成基本网格；某条基本网格边是否画出，用按 (格线, 起点) 排序的区间表做二分查找（区间树的静态形式）。
+# 没画出的边两侧的基本格合并成一个单元格（合并单元格），文字按插入点二分查找落在哪个基本格，再映射到单元格，
+# 最后按行输出结构化表格。全程只有排序和二分查找，大表也接近线性时间。
+
+# 线段方向偏离水平/竖直不超过该角度（度）才作为表格线
+AXIS_ANGLE_TOLERANCE = 0.5
+
+# 表格至少需要的水平线、竖线条数
+MIN_GRID_LINES = 3
+
+# 单元格数占基本格数的最小比例（剖面图等线条拼出的“网格”里绝大部分基本格都被合并掉）
+MIN_CELL_RATIO = 0.5
+
+# 有文字的单元格所占的最小比例
+MIN_TEXT_RATIO = 0.5
+
+
+def axis_lines(segments, tol):
+    """取出水平线和竖线并按所在坐标合并共线区间，返回两组 {level, a0, a1}（按 level、a0 排序）"""
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    dx = segments[:, 2] - segments[:, 0]
+    dy = segments[:, 3] - segments[:, 1]
+    angle = np.degrees(np.arctan2(np.abs(dy), np.abs(dx)))
+    result = []
+    for mask, level_col, a_cols in ((angle <= AXIS_ANGLE_TOLERANCE, (1, 3), (0, 2)),
+                                    (angle >= 90 - AXIS_ANGLE_TOLERANCE, (0, 2), (1, 3))):
+        s = segments[mask]
+        level = (s[:, level_col[0]] + s[:, level_col[1]]) / 2
+        a0 = np.minimum(s[:, a_cols[0]], s[:, a_cols[1]])
+        a1 = np.maximum(s[:, a_cols[0]], s[:, a_cols[1]])
+        merged = th.merge_collinear(np.zeros(len(s), dtype=np.int64), level, a0, a1, np.arange(len(s)), tol)
+        result.append({"level": merged["offset"], "a0": merged["a0"], "a1": merged["a1"]})
+    return result
+
+
+def cluster_levels(values, tol):
+    """排序后相邻差不超过 tol 的坐标归为同一条格线，返回格线坐标（升序）和每个值所属格线"""
+    order = np.argsort(values, kind='stable')
+    new = np.r_[True, np.diff(values[order]) > tol]
+    group = np.empty(len(values), dtype=np.int64)
+    group[order] = np.cumsum(new) - 1
+    levels = np.bincount(group, values) / np.bincount(group)
+    return levels, group
+
+
+def covered(lines, line_group, stab_group, stab_at, tol):
+    """区间覆盖查询：格线 stab_group 上的位置 stab_at 是否被某条线段区间覆盖。
+    区间按 (格线, 起点) 排序后，取起点不超过查询位置的最后一个区间，看其终点是否越过查询位置"""
+    order = np.lexsort((lines["a0"], line_group))
+    g, a0 = line_group[order], lines["a0"][order]
+    # 同一格线上的区间合并后可能重叠，用前缀最大终点判断
+    span = (np.nanmax(lines["a1"]) - np.nanmin(lines["a0"]) + 1.0) if len(a0) else 1.0
+    base = np.nanmin(lines["a0"]) if len(a0) else 0.0
+    reach = np.maximum.accumulate(lines["a1"][order] - base + g * span) - g * span + base
+    key = g * span + (a0 - base)
+    pos = np.searchsorted(key, stab_group * span + (stab_at - base) + tol, side='right') - 1
+    valid = pos >= 0
+    hit = np.zeros(len(stab_at), dtype=bool)
+    hit[valid] = (g[pos[valid]] == stab_group[valid]) & (reach[pos[valid]] >= stab_at[valid] - tol)
+    return hit
+
+
+def extract_table(segments, texts, tol=tp.SNAP_TOLERANCE * 10):
+    """由一组线段和文字（text, point）构建表格，返回 {bbox, rows: [[cell, ...], ...]}；不是表格时返回 None"""
+    horizontal, vertical = axis_lines(segments, tol)
+    if len(horizontal["level"]) < MIN_GRID_LINES or len(vertical["level"]) < MIN_GRID_LINES:
+        return None
+    ys, h_group = cluster_levels(horizontal["level"], tol)
+    xs, v_group = cluster_levels(vertical["level"], tol)
+    nx, ny = len(xs) - 1, len(ys) - 1
+    if nx < 1 or ny < 1:
+        return None
+
+    # 基本格 (i, k)：x 在 xs[i]~xs[i+1]，y 在 ys[k]~ys[k+1]；编号 i * ny + k
+    cx = (xs[:-1] + xs[1:]) / 2
+    cy = (ys[:-1] + ys[1:]) / 2
+    # 内部竖边 (i 与 i+1 之间，第 k 行) 是否画出：竖格线 i+1 在 cy[k] 处是否被覆盖
+    ii, kk = np.meshgrid(np.arange(nx - 1), np.arange(ny), indexing='ij')
+    v_edge = covered(vertical, v_group, (ii + 1).ravel(), cy[kk.ravel()], tol)
+    ii2, kk2 = np.meshgrid(np.arange(nx), np.arange(ny - 1), indexing='ij')
+    h_edge = covered(horizontal, h_group, (kk2 + 1).ravel(), cx[ii2.ravel()], tol)
+    a = np.concatenate([(ii * ny + kk).ravel()[~v_edge], (ii2 * ny + kk2).ravel()[~h_edge]])
+    b = np.concatenate([((ii + 1) * ny + kk).ravel()[~v_edge], (ii2 * ny + kk2 + 1).ravel()[~h_edge]])
+    # 外框四条边必须完整画出
+    border = np.concatenate([
+        covered(vertical, v_group, np.zeros(ny, dtype=np.int64), cy, tol),
+        covered(vertical, v_group, np.full(ny, nx), cy, tol),
+        covered(horizontal, h_group, np.zeros(nx, dtype=np.int64), cx, tol),
+        covered(horizontal, h_group, np.full(nx, ny), cx, tol),
+    ])
+    if not border.all():
+        return None
+    labels = tp.connected_labels(nx * ny, a, b)
+    cell_ids, cell_of = np.unique(labels, return_inverse=True)
+
+    # 每个单元格的行列范围
+    gi = np.arange(nx * ny) // ny
+    gk = np.arange(nx * ny) % ny
+    n_cells = len(cell_ids)
+    col0 = np.full(n_cells, nx)
+    col1 = np.full(n_cells, -1)
+    row0 = np.full(n_cells, ny)
+    row1 = np.full(n_cells, -1)
+    np.minimum.at(col0, cell_of, gi)
+    np.maximum.at(col1, cell_of, gi)
+    np.minimum.at(row0, cell_of, gk)
+    np.maximum.at(row1, cell_of, gk)
+
+    # 文字按位置二分查找所在基本格
+    cell_texts = [[] for _ in range(n_cells)]
+    if len(texts):
+        points = np.array([point for _, point in texts], dtype=np.float64).reshape(-1, 2)
+        ti = np.searchsorted(xs, points[:, 0]) - 1
+        tk = np.searchsorted(ys, points[:, 1]) - 1
+        inside = (ti >= 0) & (ti < nx) & (tk >= 0) & (tk < ny)
+        # 同一单元格内的文字按从上到下、从左到右排列
+        order = np.lexsort((points[:, 0], -points[:, 1]))
+        for t in order[inside[order]]:
+            cell_texts[cell_of[ti[t] * ny + tk[t]]].append(texts[t][0])
+
+    # 表格从上往下读：行号按 y 从大到小
+    rows = {}
+    for c in range(n_cells):
+        top = ny - 1 - row1[c]
+        rows.setdefault(top, []).append({
+            "row": int(top),
+            "col": int(col0[c]),
+            "rowspan": int(row1[c] - row0[c] + 1),
+            "colspan": int(col1[c] - col0[c] + 1),
+            "bbox": [float(xs[col0[c]]), float(ys[row0[c]]), float(xs[col1[c] + 1]), float(ys[row1[c] + 1])],
+            "text": "".join(cell_texts[c]) if len(cell_texts[c]) <= 1 else " ".join(cell_texts[c]),
+        })
+    return {
+        "bbox": [float(xs[0]), float(ys[0]), float(xs[-1]), float(ys[-1])],
+        "n_rows": ny,
+        "n_cols": nx,
+        "rows": [sorted(rows[r], key=lambda cell: cell["col"]) for r in sorted(rows)],
+    }
+
+
+def is_table(table):
+    """至少两行两列，单元格没有被大量合并，且多数单元格里有文字"""
+    if table["n_rows"] < 2 or table["n_cols"] < 2:
+        return False
+    cells = [cell for row in table["rows"] for cell in row]
+    filled = sum(1 for cell in cells if cell["text"])
+    return len(cells) >= MIN_CELL_RATIO * table["n_rows"] * table["n_cols"] and filled >= MIN_TEXT_RATIO * len(cells)
+
+
+def text_points(store, bbox=None):
+    """文字的定位点：插入点向右上各偏半个字高，落在第一个字内，不受对齐方式影响"""
+    texts = store["texts"]
+    ids = np.arange(len(texts["text"]))
+    if bbox is not None:
+        min_x, min_y, max_x, max_y = bbox
+        p = texts["insert"]
+        ids = ids[(p[:, 0] >= min_x) & (p[:, 0] <= max_x) & (p[:, 1] >= min_y) & (p[:, 1] <= max_y)]
+    half = texts["height"][ids, None] / 2
+    return [(texts["text"][i], point) for i, point in zip(ids, texts["insert"][ids] + half)]
+
+
+def extract_tables(store, bbox=None, layer=None, tol=tp.SNAP_TOLERANCE * 10):
+    """在实体表中自动找出全部表格：水平/竖直线按包围盒相交连成若干组，每组单独建表"""
+    rows = es.query_entities(store, dxftype=['LINE', 'LWPOLYLINE', 'POLYLINE'], layer=layer, bbox=bbox)
+    ids = np.flatnonzero(np.isin(store["segment_row"], rows))
+    segments = store["segments"][ids]
+    dx = segments[:, 2] - segments[:, 0]
+    dy = segments[:, 3] - segments[:, 1]
+    angle = np.degrees(np.arctan2(np.abs(dy), np.abs(dx)))
+    segments = segments[(angle <= AXIS_ANGLE_TOLERANCE) | (angle >= 90 - AXIS_ANGLE_TOLERANCE)]
+    if len(segments) == 0:
+        return []
+    boxes = np.stack([np.minimum(segments[:, 0], segments[:, 2]) - tol, np.minimum(segments[:, 1], segments[:, 3]) - tol,
+                      np.maximum(segments[:, 0], segments[:, 2]) + tol, np.maximum(segments[:, 1], segments[:, 3]) + tol],
+                     axis=1)
+    pairs = si.overlapping_pairs(si.build_grid_index(boxes))
+    labels = tp.connected_labels(len(segments), pairs[:, 0], pairs[:, 1])
+    _, group = np.unique(labels, return_inverse=True)
+    order = np.argsort(group, kind='stable')
+    parts = np.split(order, np.flatnonzero(np.diff(group[order])) + 1)
+
+    tables = []
+    for part in parts:
+        if len(part) < 2 * MIN_GRID_LINES:
+            continue
+        part_segments = segments[part]
+        box = (part_segments[:, [0, 2]].min(), part_segments[:, [1, 3]].min(),
+               part_segments[:, [0, 2]].max(), part_segments[:, [1, 3]].max())
+        table = extract_table(part_segments, text_points(store, box), tol)
+        if table is not None and is_table(table):
+            tables.append(table)
+    return tables
+
+
+def table_values(table):
+    """只取每行单元格的文字，得到二维列表"""
+    return [[cell["text"] for cell in row] for row in table["rows"]]
+
+
+def save_to_json(data, output_filename):
+    try:
+        with open(output_filename, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        print(f"Tables successfully saved to {output_filename}")
+    except Exception as e:
+        print(f"An error occurred while saving to JSON: {e}")
+
+
+if __name__ == "__main__":
+    # 示例用法
+    dxf_file_path = r"C:\Users\Lenovo\Desktop\水闸纵剖面图\cad解析\剖面底板厚度.dxf"
+    store = es.load_entity_store(dxf_file_path)
+    if store is not None:
+        tables = extract_tables(store)
+        for table in tables:
+            print(table_values(table))
+        save_to_json(tables, r"C:\\Users\\Lenovo\\Desktop\\水闸纵剖面图\\tables.json")
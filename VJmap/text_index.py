@@ -0,0 +1,193 @@
+import re
+import json
+import numpy as np
+import entity_store as es
+import spatial_index as si
+
+# 版本说明：对TEXT/MTEXT的文字内容建立 n-gram 倒排索引（单字 + 相邻两字），同时保存插入点坐标和网格空间索引。
+# “标高”“底板”“1:100”这类标签直接从索引取候选再核对，配合半径/最近距离查询，
+# 不再像 train4.0-2.py 那样反复平移框并整图重扫（找不到文字时还会死循环）。
+
+# 正则里的元字符，提取正则中的字面片段做预筛选时以它们为分隔
+REGEX_META = set('.^$*+?{}[]\\|()')
+
+
+def normalize_text(text):
+    """索引和查询共用的规范化：去掉空白并转成小写"""
+    return re.sub(r'\s+', '', text or '').lower()
+
+
+def text_grams(text):
+    """取出文字的全部单字和相邻两字（去重）"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+def build_text_index(store):
+    """在实体表的文字表上建立 n-gram 倒排索引和插入点空间索引"""
+    texts = store["texts"]
+    normalized = [normalize_text(text) for text in texts["text"]]
+
+    gram_ids = {}
+    for text_id, text in enumerate(normalized):
+        for gram in text_grams(text):
+            gram_ids.setdefault(gram, []).append(text_id)
+
+    inserts = texts["insert"]
+    return {
+        "text": texts["text"],
+        "normalized": normalized,
+        "row": texts["row"],
+        "handle": store["handle"][texts["row"]] if len(texts["row"]) else np.zeros(0, dtype=object),
+        "insert": inserts,
+        "height": texts["height"],
+        "postings": {gram: np.array(ids, dtype=np.int64) for gram, ids in gram_ids.items()},
+        "spatial": si.build_grid_index(np.hstack([inserts, inserts])),
+    }
+
+
+def literal_fragments(pattern):
+    """从正则表达式中取出必须出现的字面片段（含分支或分组的正则不做预筛选）"""
+    if '|' in pattern or '(' in pattern:
+        return []
+    fragments, current, i = [], '', 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == '\\' and i + 1 < len(pattern):
+            nxt = pattern[i + 1]
+            # \. \: 这类转义字符按字面处理，\d \s 这类字符类中断片段
+            if nxt.isalnum():
+                fragments.append(current)
+                current = ''
+            else:
+                current += nxt
+            i += 2
+            continue
+        if ch in REGEX_META:
+            # 量词会让前一个字符变成可选，把它从片段中去掉
+            if ch in '*?{' and current:
+                current = current[:-1]
+            fragments.append(current)
+            current = ''
+            # 跳过字符集 [...] 和量词 {m,n} 的内容
+            closing = {'[': ']', '{': '}'}.get(ch)
+            if closing:
+                i = pattern.find(closing, i + 1)
+                if i < 0:
+                    return []
+        else:
+            current += ch
+        i += 1
+    fragments.append(current)
+    return [normalize_text(f) for f in fragments if normalize_text(f)]
+
+
+def candidate_text_ids(index, fragments):
+    """对每个片段的 n-gram 倒排表求交集，得到候选文字编号"""
+    ids = None
+    for fragment in fragments:
+        grams = [fragment] if len(fragment) == 1 else [fragment[i:i + 2] for i in range(len(fragment) - 1)]
+        for gram in grams:
+            posting = index["postings"].get(gram)
+            if posting is None:
+                return np.zeros(0, dtype=np.int64)
+            ids = posting if ids is None else np.intersect1d(ids, posting, assume_unique=True)
+            if len(ids) == 0:
+                return ids
+    if ids is None:
+        return np.arange(len(index["text"]))
+    return ids
+
+
+def match_text_ids(index, pattern, regex=False):
+    """返回内容匹配 pattern 的文字编号；regex=False 时按子串匹配"""
+    if regex:
+        compiled = re.compile(pattern, re.IGNORECASE)
+        ids = candidate_text_ids(index, literal_fragments(pattern))
+        # 正则在去掉空白前的原文上核对
+        keep = [i for i in ids if compiled.search(index["text"][i] or '')]
+        return np.array(keep, dtype=np.int64)
+    needle = normalize_text(pattern)
+    ids = candidate_text_ids(index, [needle] if needle else [])
+    keep = [i for i in ids if needle in index["normalized"][i]]
+    return np.array(keep, dtype=np.int64)
+
+
+def text_records(index, ids, distance=None):
+    records = []
+    for k, i in enumerate(ids):
+        info = {
+            "text": index["text"][i],
+            "handle": index["handle"][i],
+            "location": [float(v) for v in index["insert"][i]],
+            "height": float(index["height"][i]),
+        }
+        if distance is not None:
+            info["distance"] = float(distance[k])
+        records.append(info)
+    return records
+
+
+def search_texts(index, pattern=None, center=None, radius=None, regex=False):
+    """查询匹配 pattern 且（可选）插入点在 center 周围 radius 以内的文字，按距离排序"""
+    ids = match_text_ids(index, pattern, regex) if pattern else np.arange(len(index["text"]))
+    if center is None:
+        return text_records(index, ids)
+    if radius is not None:
+        near, _ = si.query_radius(index["spatial"], center, radius)
+        ids = np.intersect1d(ids, near)
+    distance = np.hypot(*(index["insert"][ids] - np.asarray(center, dtype=np.float64)).T) if len(ids) else np.zeros(0)
+    order = np.argsort(distance, kind='stable')
+    return text_records(index, ids[order], distance[order])
+
+
+def point_bbox_distance(points, bbox):
+    """批量计算点到 bbox 的距离（框内为0）"""
+    min_x, min_y, max_x, max_y = bbox
+    dx = np.maximum(np.maximum(min_x - points[:, 0], points[:, 0] - max_x), 0)
+    dy = np.maximum(np.maximum(min_y - points[:, 1], points[:, 1] - max_y), 0)
+    return np.hypot(dx, dy)
+
+
+def nearest_text(index, bbox, pattern=None, regex=False, k=1):
+    """查找插入点离 bbox 最近的 k 条文字（框内的距离为0），可以附加内容条件"""
+    if pattern:
+        ids = match_text_ids(index, pattern, regex)
+    else:
+        # 不带内容条件时在空间索引上由近到远搜索：先找离框中心最近的k个点，
+        # 更近于框的点一定落在 “第k个点的距离 + 半条对角线” 的圆内，再在圆内精确排序
+        min_x, min_y, max_x, max_y = bbox
+        center = ((min_x + max_x) / 2, (min_y + max_y) / 2)
+        ids, distance = si.query_nearest(index["spatial"], center, k=k)
+        if len(ids):
+            reach = distance[-1] + np.hypot(max_x - min_x, max_y - min_y) / 2
+            ids, _ = si.query_radius(index["spatial"], center, reach)
+    if len(ids) == 0:
+        return []
+    distance = point_bbox_distance(index["insert"][ids], bbox)
+    order = np.argsort(distance, kind='stable')[:k]
+    return text_records(index, ids[order], distance[order])
+
+
+def save_to_json(data, output_filename):
+    try:
+        with open(output_filename, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        print(f"Texts successfully saved to {output_filename}")
+    except Exception as e:
+        print(f"An error occurred while saving to JSON: {e}")
+
+
+if __name__ == "__main__":
+    # 示例用法
+    dxf_file_path = r"C:\Users\Lenovo\Desktop\水闸纵剖面图\cad解析\9#口门水工施工图.dxf"
+    store = es.load_entity_store(dxf_file_path)
+    if store is not None:
+        index = build_text_index(store)
+        labels = {
+            "标高": search_texts(index, "标高"),
+            "底板": search_texts(index, "底板"),
+            "比例": search_texts(index, r"1\s*:\s*\d+", regex=True),
+        }
+        save_to_json(labels, r"C:\\Users\\Lenovo\\Desktop\\水闸纵剖面图\\text_labels.json")
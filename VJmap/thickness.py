@@ -0,0 +1,242 @@
+import json
+import numpy as np
+import entity_store as es
+import spatial_index as si
+import topology as tp
+import dimension_table as dt
+import faces as fc
+
+# 版本说明：剖面底板厚度图纸需要量出底板、墙体的厚度，原来 train7.0.py 只能在框附近找标注。
+# 这里把线段按方向角分桶（近似平行的线落在同一桶），同一桶内按法向偏移排序，
+# 先把同一偏移上首尾相接/重叠的共线线段合并，再在每个桶（连同相邻桶，换算到本桶的方向上）内
+# 按沿线方向的起点排序扫描，只配对沿线方向投影有重叠的边，取投影重叠足够的最近一条作为对面边，
+# 两者的偏移差即厚度。不对全部线段两两比较。结果可以按闭合面汇总，并与最近的线性标注核对。
+
+ANGLE_STEP = 1.0        # 方向分桶的角度步长（度）
+MIN_OVERLAP_RATIO = 0.5  # 两条边投影重叠长度占较短边的最小比例
+
+
+def direction_buckets(segments, angle_step=ANGLE_STEP):
+    """按方向角（0~180度）分桶，返回桶编号和桶的方向角（弧度）"""
+    dx = segments[:, 2] - segments[:, 0]
+    dy = segments[:, 3] - segments[:, 1]
+    angle = np.degrees(np.arctan2(dy, dx)) % 180.0
+    n_buckets = int(round(180.0 / angle_step))
+    bucket = np.round(angle / angle_step).astype(np.int64) % n_buckets
+    return bucket, np.radians(bucket * angle_step)
+
+
+def merge_collinear(bucket, offset, a0, a1, source, tol):
+    """同一桶内偏移相同（容差内）且沿方向相接/重叠的线段合并成一条"""
+    level = np.round(offset / tol).astype(np.int64)
+    order = np.lexsort((a0, level, bucket))
+    bucket, level, offset, a0, a1, source = (v[order] for v in (bucket, level, offset, a0, a1, source))
+    # 同组内按起点排序后，起点超过此前最远终点（加容差）时开始新的一段
+    group_start = np.r_[True, (bucket[1:] != bucket[:-1]) | (level[1:] != level[:-1])]
+    group_id = np.cumsum(group_start) - 1
+    # 各组抬高一个足够大的台阶，整体一次 maximum.accumulate 即得到组内的前缀最大值
+    span = (a1.max() - a0.min() + 1.0) if len(a1) else 1.0
+    reach = np.maximum.accumulate(a1 - a0.min() + group_id * span) - group_id * span + a0.min()
+    new_piece = group_start.copy()
+    new_piece[1:] |= a0[1:] > reach[:-1] + tol
+    piece = np.cumsum(new_piece) - 1
+    starts = np.flatnonzero(new_piece)
+    merged = {
+        "bucket": bucket[starts],
+        "offset": np.bincount(piece, offset) / np.bincount(piece),
+        "a0": np.minimum.reduceat(a0, starts),
+        "a1": np.maximum.reduceat(a1, starts),
+        "group": group_id[starts],
+    }
+    merged["sources"] = np.split(source, starts[1:])
+    return merged
+
+
+def interval_pairs(group, start, end):
+    """同组区间 [start, end] 两两相交的全部 (p, q)：按 (组, 起点) 排序后扫描，
+    每个区间只与排在它之后、起点不超过它终点的区间配对"""
+    values = np.unique(np.concatenate([start, end]))
+    span = len(values) + 1
+    key = group * span + np.searchsorted(values, start)
+    order = np.argsort(key, kind='stable')
+    bound = group[order] * span + np.searchsorted(values, end[order])
+    counts = np.searchsorted(key[order], bound, 'right') - np.arange(len(key)) - 1
+    first = np.repeat(np.arange(len(key)), counts)
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return order[first], order[first + 1 + local]
+
+
+def measure_thickness(segments, rows=None, angle_step=ANGLE_STEP, max_thickness=None,
+                      min_overlap_ratio=MIN_OVERLAP_RATIO, tol=tp.SNAP_TOLERANCE):
+    """对线段数组测量相对平行边之间的垂直距离，返回每对相对边的记录"""
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    rows = np.full(len(segments), -1) if rows is None else np.asarray(rows)
+    length = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+    keep = length > tol
+    segments, rows = segments[keep], rows[keep]
+    if len(segments) == 0:
+        return []
+
+    bucket, theta = direction_buckets(segments, angle_step)
+    direction = np.stack([np.cos(theta), np.sin(theta)], axis=1)
+    normal = np.stack([-direction[:, 1], direction[:, 0]], axis=1)
+    mid = (segments[:, :2] + segments[:, 2:]) / 2
+    offset = np.einsum('ij,ij->i', mid, normal)
+    t_start = np.einsum('ij,ij->i', segments[:, :2], direction)
+    t_end = np.einsum('ij,ij->i', segments[:, 2:], direction)
+    lines = merge_collinear(bucket, offset, np.minimum(t_start, t_end), np.maximum(t_start, t_end),
+                            np.arange(len(segments)), tol)
+
+    # 每个桶连同下一个桶（方向差不到两个步长，换算到本桶的方向上）一起扫描，
+    # 分桶边界两侧的近似平行边也能配对
+    b, o, a0, a1 = lines["bucket"], lines["offset"], lines["a0"], lines["a1"]
+    n_buckets = int(round(180.0 / angle_step))
+    n = len(b)
+    rad = np.radians(b * angle_step)
+    d = np.stack([np.cos(rad), np.sin(rad)], axis=1)
+    nrm = np.stack([-d[:, 1], d[:, 0]], axis=1)
+    ends = np.stack([d * a0[:, None] + nrm * o[:, None], d * a1[:, None] + nrm * o[:, None]], axis=1)
+    frame = np.concatenate([b, (b - 1) % n_buckets])
+    line = np.concatenate([np.arange(n), np.arange(n)])
+    shifted = np.r_[np.zeros(n, dtype=bool), np.ones(n, dtype=bool)]
+    frame_rad = np.radians(frame * angle_step)
+    fd = np.stack([np.cos(frame_rad), np.sin(frame_rad)], axis=1)
+    fn = np.stack([-fd[:, 1], fd[:, 0]], axis=1)
+    t = np.einsum('kpj,kj->kp', ends[line], fd)
+    fo = np.einsum('kpj,kj->kp', ends[line], fn).mean(axis=1)
+    f0, f1 = t.min(axis=1), t.max(axis=1)
+
+    p, q = interval_pairs(frame, f0, f1)
+    # 两条都来自下一个桶的配对在那个桶自己的扫描里已经有了
+    keep = ~(shifted[p] & shifted[q])
+    p, q = p[keep], q[keep]
+    # 偏移小的一条为 i，对面边 j 在其法向正侧
+    swap = fo[q] < fo[p]
+    p, q = np.where(swap, q, p), np.where(swap, p, q)
+    overlap = np.minimum(f1[p], f1[q]) - np.maximum(f0[p], f0[q])
+    shorter = np.minimum(f1[p] - f0[p], f1[q] - f0[q])
+    gap = fo[q] - fo[p]
+    valid = (gap > tol) & (overlap >= min_overlap_ratio * shorter)
+    if max_thickness is not None:
+        valid &= gap <= max_thickness
+    p, q, gap = p[valid], q[valid], gap[valid]
+    # 每条边取偏移差最小的一条对面边
+    order = np.lexsort((gap, line[p]))
+    first = order[np.r_[True, line[p][order][1:] != line[p][order][:-1]]] if len(order) else order
+    found = p[first], q[first]
+
+    pairs = []
+    for i, j in zip(*found):
+        angle = float(frame[i] * angle_step)
+        s0, s1 = max(f0[i], f0[j]), min(f1[i], f1[j])
+        # 两条边之间重叠部分的矩形（厚度方向的条带）
+        corners = np.array([fd[i] * s0 + fn[i] * fo[i], fd[i] * s1 + fn[i] * fo[i],
+                            fd[i] * s0 + fn[i] * fo[j], fd[i] * s1 + fn[i] * fo[j]])
+        src_i = lines["sources"][line[i]]
+        src_j = lines["sources"][line[j]]
+        pairs.append({
+            "thickness": float(fo[j] - fo[i]),
+            "angle": angle,
+            "overlap": float(s1 - s0),
+            "offsets": [float(fo[i]), float(fo[j])],
+            "center": corners.mean(axis=0).tolist(),
+            "bbox": [float(v) for v in (*corners.min(axis=0), *corners.max(axis=0))],
+            "edge_rows": [sorted(set(int(r) for r in rows[src_i])), sorted(set(int(r) for r in rows[src_j]))],
+        })
+    return pairs
+
+
+def measure_store_thickness(store, layer=None, bbox=None, **kwargs):
+    """按图层/范围从实体表取线段测量厚度，边的实体行号换成句柄"""
+    rows = es.query_entities(store, dxftype=list(tp.LINEWORK_TYPES), layer=layer, bbox=bbox)
+    ids = np.flatnonzero(np.isin(store["segment_row"], rows))
+    pairs = measure_thickness(store["segments"][ids], store["segment_row"][ids], **kwargs)
+    for pair in pairs:
+        pair["edge_handles"] = [[store["handle"][r] for r in side] for side in pair.pop("edge_rows")]
+    return pairs
+
+
+def attach_nearest_dimensions(pairs, dimension_table, angle_tolerance=2.0, k=16, offset_tolerance=0.05):
+    """为每对相对边找最近的、正好标在这两条边上的线性标注：
+    测量方向垂直于边，且两个尺寸界线原点投影到法向上分别落在两条边的偏移处。
+    记录标注值、实测厚度按 dimlfac 换算后的值以及二者之差"""
+    linear = np.flatnonzero(np.isin(dimension_table["dimtype"], list(dt.LINEAR_TYPES)))
+    if len(linear) == 0 or not pairs:
+        return pairs
+    p2 = dimension_table["defpoints"][linear, 1, :2]
+    p3 = dimension_table["defpoints"][linear, 2, :2]
+    index = si.build_grid_index(np.hstack([np.minimum(p2, p3), np.maximum(p2, p3)]))
+    # 线性标注的测量方向：转角标注取 angle，对齐标注取两个原点连线方向
+    measured = np.where(dimension_table["dimtype"][linear] == dt.DIM_LINEAR,
+                        dimension_table["angle"][linear],
+                        np.degrees(np.arctan2(p3[:, 1] - p2[:, 1], p3[:, 0] - p2[:, 0])))
+    for pair in pairs:
+        ids, distance = si.query_nearest(index, pair["center"], k=k)
+        normal_angle = (pair["angle"] + 90.0) % 180.0
+        diff = np.abs((measured[ids] % 180.0) - normal_angle)
+        diff = np.minimum(diff, 180.0 - diff)
+        # 尺寸界线原点在法向上的投影与两条边偏移的偏差（两种顺序取小）
+        rad = np.radians(pair["angle"])
+        nrm = np.array([-np.sin(rad), np.cos(rad)])
+        lo, hi = pair["offsets"]
+        o2, o3 = p2[ids] @ nrm, p3[ids] @ nrm
+        residual = np.minimum(np.abs(o2 - lo) + np.abs(o3 - hi), np.abs(o2 - hi) + np.abs(o3 - lo))
+        ok = (diff <= angle_tolerance) & (residual <= offset_tolerance * max(pair["thickness"], 1.0))
+        if not ok.any():
+            continue
+        best = np.flatnonzero(ok)[0]
+        row = linear[ids[best]]
+        scale = float(dimension_table["dimlfac"][row])
+        value = float(dimension_table["value"][row])
+        pair["dimension"] = {
+            "handle": dimension_table["handle"][row],
+            "text": dimension_table["text"][row],
+            "value": value,
+            "distance": float(distance[best]),
+        }
+        pair["scaled_thickness"] = round(pair["thickness"] * scale, 2)
+        pair["difference"] = round(pair["scaled_thickness"] - value, 2)
+    return pairs
+
+
+def thickness_by_face(pairs, faces):
+    """按闭合面汇总厚度：条带中心落在哪个面内就记到哪个面"""
+    regions = []
+    for face in faces:
+        polygon = np.array(face["points"])
+        x0, y0, x1, y1 = face["bbox"]
+        inside = [pair for pair in pairs
+                  if x0 <= pair["center"][0] <= x1 and y0 <= pair["center"][1] <= y1
+                  and fc.polygon_contains(polygon, pair["center"])]
+        if not inside:
+            continue
+        values = np.array([pair["thickness"] for pair in inside])
+        regions.append({
+            "bbox": face["bbox"],
+            "area": face["net_area"],
+            "thickness_min": float(values.min()),
+            "thickness_max": float(values.max()),
+            "measurements": inside,
+        })
+    return regions
+
+
+def save_to_json(data, output_filename):
+    try:
+        with open(output_filename, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        print(f"Thickness successfully saved to {output_filename}")
+    except Exception as e:
+        print(f"An error occurred while saving to JSON: {e}")
+
+
+if __name__ == "__main__":
+    # 示例用法
+    import ezdxf
+    dxf_file_path = r"C:\Users\Lenovo\Desktop\水闸纵剖面图\cad解析\剖面底板厚度.dxf"
+    doc = ezdxf.readfile(dxf_file_path)
+    store = es.build_entity_store(doc)
+    pairs = measure_store_thickness(store, layer='SG001轮廓')
+    attach_nearest_dimensions(pairs, dt.build_dimension_table(doc))
+    regions = thickness_by_face(pairs, fc.extract_faces_from_store(store, layer='SG001轮廓'))
+    save_to_json(regions, r"C:\\Users\\Lenovo\\Desktop\\水闸纵剖面图\\thickness.json")